@@ -0,0 +1,112 @@
+"""
+COG Read Latency Benchmark
+--------------------------
+
+Random window read latency of a raster written by raster.create_raster
+(plain striped GeoTIFF) and with cog=True (Cloud Optimized GeoTIFF). Each
+read opens the file, so no blocks are reused between reads. Along with
+time, the bytes of the strips or tiles a window touches are reported, which
+is what a window read costs over HTTP range requests.
+
+usage: python benchmarks/cog_read_latency.py [size [n_windows]]
+    size defaults to 10000 pixels, n_windows to 200 per window size
+"""
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+from osgeo import gdal, osr
+
+from spicebox import raster
+
+## (window size, output buffer size), reads with a smaller buffer use
+## overviews when the file has them
+WINDOWS = [(256, 256), (1024, 1024), (4096, 512)]
+
+
+def make_data(size, seed=0):
+    """smooth float32 surface with noise, compresses like a DEM"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    data = 1000 * np.sin(6 * x) * np.cos(4 * y) + 50 * np.sin(40 * x * y)
+    data += rng.normal(0, 1, (size, size)).astype(np.float32)
+    return data.astype(np.float32)
+
+
+def window_bytes(ds, xoff, yoff, xsize, ysize):
+    """bytes of the strips or tiles of band 1 that a window touches"""
+    band = ds.GetRasterBand(1)
+    block_x, block_y = band.GetBlockSize()
+    total = 0
+    for row in range(yoff // block_y, (yoff + ysize - 1) // block_y + 1):
+        for col in range(xoff // block_x, (xoff + xsize - 1) // block_x + 1):
+            size = band.GetMetadataItem(
+                'BLOCK_SIZE_%i_%i' % (col, row), 'TIFF'
+            )
+            total += int(size or 0)
+    return total
+
+
+def run(file_name, size, n_windows, seed=1):
+    """time random window reads of file_name, returns rows of results"""
+    rng = np.random.default_rng(seed)
+    info = gdal.Open(file_name)
+    rows = []
+    for window, buf in WINDOWS:
+        times, touched = [], []
+        for _ in range(n_windows):
+            xoff, yoff = rng.integers(0, size - window, 2)
+            xoff, yoff = int(xoff), int(yoff)
+            start = time.perf_counter()
+            ds = gdal.Open(file_name)
+            ds.GetRasterBand(1).ReadAsArray(
+                xoff, yoff, window, window, buf_xsize=buf, buf_ysize=buf
+            )
+            ds = None
+            times.append(time.perf_counter() - start)
+            if buf == window:
+                touched.append(window_bytes(info, xoff, yoff, window, window))
+        times = np.array(times) * 1000
+        rows.append((
+            window, buf, np.median(times), np.percentile(times, 95),
+            np.mean(touched) / 1024**2 if touched else np.nan
+        ))
+    return rows
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    n_windows = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    print('GDAL', gdal.__version__, '%i x %i float32' % (size, size))
+
+    data = make_data(size)
+    transform = (0, 30, 0, size * 30, 0, -30)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(3338)
+    with tempfile.TemporaryDirectory() as work_dir:
+        files = {
+            'GTiff': os.path.join(work_dir, 'striped.tif'),
+            'COG': os.path.join(work_dir, 'cog.tif'),
+        }
+        for label, file_name in files.items():
+            raster.create_raster(
+                file_name, data, transform, srs.ExportToWkt(),
+                cog=label == 'COG'
+            )
+        del data
+        print('%-6s %9s %6s %10s %10s %12s' % (
+            'file', 'window', 'buffer', 'median ms', 'p95 ms', 'MiB touched'
+        ))
+        for label, file_name in files.items():
+            print('%s %.1f MiB, %s' % (
+                label, os.path.getsize(file_name) / 1024**2,
+                raster.validate_cog(file_name)[1] or 'valid COG'
+            ))
+            for window, buf, median, p95, touched in run(
+                    file_name, size, n_windows
+                ):
+                print('%-6s %9i %6i %10.2f %10.2f %12.2f' % (
+                    label, window, buf, median, p95, touched
+                ))
@@ -0,0 +1,77 @@
+"""
+Rescale Raster Benchmark
+------------------------
+
+Run time of the integer factor fast path of raster.rescale_raster against
+gdal.Warp (fast_path=False) on a square float32 raster with no data holes.
+Both paths write uncompressed GeoTIFFs.
+
+usage: python benchmarks/rescale_raster.py [size [factor ...]]
+    size defaults to 20000 pixels, factors default to 2 4 10
+"""
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+from osgeo import gdal, osr
+
+from spicebox import raster
+
+
+def make_input(file_name, size, block_rows=512, seed=0):
+    """write a size x size tiled float32 raster with random values and a
+    no data value of -9999 for 1% of pixels
+    """
+    rng = np.random.default_rng(seed)
+    transform = (0, 30, 0, size * 30, 0, -30)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(3338)
+    ds = raster.create_empty_raster(
+        file_name, size, size, transform, srs.ExportToWkt(), 1,
+        gdal.GDT_Float32, -9999,
+        creation_options=['TILED=YES', 'BIGTIFF=YES']
+    )
+    band = ds.GetRasterBand(1)
+    for yoff in range(0, size, block_rows):
+        rows = min(block_rows, size - yoff)
+        data = rng.random((rows, size), dtype=np.float32) * 1000
+        data[rng.random((rows, size)) < 0.01] = -9999
+        band.WriteArray(data, 0, yoff)
+    ds.FlushCache()
+    return ds
+
+
+def run(in_raster, work_dir, factors, resampling='average'):
+    """time both paths for each factor"""
+    ds = gdal.Open(in_raster)
+    resolution = ds.GetGeoTransform()[1]
+    for factor in factors:
+        new_res = (resolution * factor, -resolution * factor)
+        times = {}
+        for label, fast_path in (('fast path', True), ('gdal.Warp', False)):
+            out_raster = os.path.join(
+                work_dir, '%s_%i.tif' % (label.replace(' ', '_'), factor)
+            )
+            start = time.perf_counter()
+            raster.rescale_raster(
+                in_raster, out_raster, new_res,
+                resampling=resampling, fast_path=fast_path
+            )
+            times[label] = time.perf_counter() - start
+            os.remove(out_raster)
+        print('%3ix %-8s fast path %7.2f s  gdal.Warp %7.2f s  %5.1fx' % (
+            factor, resampling, times['fast path'], times['gdal.Warp'],
+            times['gdal.Warp'] / times['fast path']
+        ))
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    factors = [int(f) for f in sys.argv[2:]] or [2, 4, 10]
+    print('GDAL', gdal.__version__, '%i x %i float32' % (size, size))
+    with tempfile.TemporaryDirectory() as work_dir:
+        in_raster = os.path.join(work_dir, 'input.tif')
+        make_input(in_raster, size)
+        run(in_raster, work_dir, factors)
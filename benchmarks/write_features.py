@@ -0,0 +1,89 @@
+"""
+Write Features Benchmark
+------------------------
+
+Throughput of vector.write_features against the per feature path
+(create_new_feature and layer.CreateFeature with no transaction control)
+when writing square polygons with an integer and a float field to a
+GeoPackage.
+
+usage: python benchmarks/write_features.py [n_features ...]
+"""
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+from osgeo import gdal, ogr, osr
+
+from spicebox import vector
+
+
+def make_squares(n_features, seed=0):
+    """flat coordinates and offsets of n_features closed square rings"""
+    rng = np.random.default_rng(seed)
+    corners = rng.uniform(0, 100000, (n_features, 2))
+    unit = np.array([[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]], dtype=float)
+    coords = (corners[:, None, :] + unit[None, :, :]).reshape(-1, 2)
+    offsets = np.arange(0, len(coords) + 1, len(unit))
+    return coords, offsets
+
+
+def per_feature(file_name, geometries, fields, crs):
+    """write features one at a time, the path used before write_features"""
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(crs)
+    data_source = vector.create_new_data_source(file_name, 'GPKG')
+    layer = data_source.CreateLayer('squares', srs, ogr.wkbPolygon)
+    layer.CreateField(ogr.FieldDefn('id', ogr.OFTInteger64))
+    layer.CreateField(ogr.FieldDefn('value', ogr.OFTReal))
+    feat_def = layer.GetLayerDefn()
+    for idx, geom in enumerate(geometries):
+        feat = vector.create_new_feature(feat_def, geom)
+        feat.SetField('id', int(fields['id'][idx]))
+        feat.SetField('value', float(fields['value'][idx]))
+        layer.CreateFeature(feat)
+    vector.save_vector(data_source)
+
+
+def run(n_features, work_dir):
+    """time both paths for n_features, returns features per second"""
+    coords, offsets = make_squares(n_features)
+    geometries = vector.coords_to_geometries(coords, offsets, ogr.wkbPolygon)
+    fields = {
+        'id': np.arange(n_features),
+        'value': np.random.default_rng(1).random(n_features),
+    }
+    results = {}
+
+    name = os.path.join(work_dir, 'per_feature_%i.gpkg' % n_features)
+    start = time.perf_counter()
+    per_feature(name, geometries, fields, 3338)
+    results['per feature'] = time.perf_counter() - start
+
+    name = os.path.join(work_dir, 'write_features_%i.gpkg' % n_features)
+    start = time.perf_counter()
+    vector.write_features(name, geometries, fields, crs=3338)
+    results['write_features'] = time.perf_counter() - start
+
+    name = os.path.join(work_dir, 'coords_%i.gpkg' % n_features)
+    start = time.perf_counter()
+    vector.write_features(
+        name, fields=fields, crs=3338, coords=coords, offsets=offsets
+    )
+    results['write_features (coords)'] = time.perf_counter() - start
+
+    for path, seconds in results.items():
+        print('%8i  %-24s %8.2f s %10.0f features/s' % (
+            n_features, path, seconds, n_features / seconds
+        ))
+    return results
+
+
+if __name__ == '__main__':
+    sizes = [int(n) for n in sys.argv[1:]] or [10000, 100000]
+    print('GDAL', gdal.__version__)
+    with tempfile.TemporaryDirectory() as work_dir:
+        for n_features in sizes:
+            run(n_features, work_dir)
@@ -0,0 +1,334 @@
+"""
+Async Raster
+------------
+
+asyncio versions of raster reading functions. Reads run on a bounded
+thread pool (GDAL releases the GIL while reading), each thread uses its own
+dataset handles from a datasets.DatasetPool, and the number of reads in
+progress is limited by a semaphore.
+
+Example
+-------
+>>> async def main(files):
+...     loaded = await asyncio.gather(*[aload_raster(f) for f in files])
+...     values = await asample_points('dem.tif', [(x, y)])
+"""
+import asyncio
+import functools
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from osgeo import gdal_array
+
+from . import raster
+from . import datasets
+
+
+def _read_window_job_(pool, filename, window, band, cancel, tile_cache,
+        min_pixels
+    ):
+    """read a window of a band in a worker thread, in row chunks so a
+    cancelled read stops between chunks
+    """
+    ds = pool.get(filename)
+    rb = ds.GetRasterBand(band)
+    if window is None:
+        window = (0, 0, ds.RasterXSize, ds.RasterYSize)
+    xoff, yoff, xsize, ysize = window
+
+    block_y = rb.GetBlockSize()[1]
+    rows = max(1, min_pixels // max(1, xsize)) // block_y * block_y
+    rows = max(block_y, rows)
+    data = np.empty(
+        (ysize, xsize),
+        dtype=gdal_array.GDALTypeCodeToNumericTypeCode(rb.DataType)
+    )
+    for y_start in range(yoff, yoff + ysize, rows):
+        if cancel.is_set():
+            raise asyncio.CancelledError()
+        y_size = min(rows, yoff + ysize - y_start)
+        data[y_start - yoff:y_start - yoff + y_size] = raster.read_window(
+            ds, xoff, y_start, xsize, y_size, band, tile_cache
+        )
+
+    metadata = {
+        'transform': ds.GetGeoTransform(),
+        'projection': ds.GetProjection(),
+        'x_size': ds.RasterXSize,
+        'y_size': ds.RasterYSize,
+    }
+    return data, metadata
+
+
+class AsyncRasterReader(object):
+    """Reads rasters from coroutines without blocking the event loop.
+
+    Cancelling a read (i.e. with asyncio.wait_for) stops it between row
+    chunks. Reads that have not started when cancelled are not run.
+    """
+
+    def __init__(self, max_workers=8, max_concurrency=None, pool=None,
+            tile_cache=None, min_pixels=1024*1024
+        ):
+        """
+        Parameters
+        ----------
+        max_workers: int, default 8
+            number of reader threads
+        max_concurrency: int, optional
+            maximum reads in progress or waiting for a thread, defaults to
+            4 * max_workers. Other reads wait without using the pool
+        pool: datasets.DatasetPool, optional
+            pool of per thread dataset handles, a new pool is created if
+            not given. A given pool is not cleared by close
+        tile_cache: tilecache.TileCache, optional
+            cache of decoded blocks, see raster.read_window
+        min_pixels: int, default 1024*1024
+            minimum pixels read between cancellation checks
+        """
+        self.executor = ThreadPoolExecutor(
+            max_workers, thread_name_prefix='spicebox-async'
+        )
+        self.max_concurrency = max_concurrency or 4 * max_workers
+        self._own_pool = pool is None
+        self.pool = pool if pool is not None else \
+            datasets.DatasetPool(max_open=4 * max_workers)
+        self.tile_cache = tile_cache
+        self.min_pixels = min_pixels
+        ## one semaphore per event loop
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    def close(self, wait=True):
+        """Shut down reader threads and drop dataset handles, if the 
+        dataset pool was created by the reader
+
+        Parameters
+        ----------
+        wait: bool, default True
+            if True wait for reads in progress to finish
+        """
+        self.executor.shutdown(wait=wait)
+        if self._own_pool:
+            self.pool.clear()
+
+    def _semaphore(self):
+        """semaphore limiting reads for the running event loop"""
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[loop]
+
+    async def run(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) on a reader thread. If func has a
+        cancel keyword argument it is passed a threading.Event that is set
+        when the call is cancelled
+
+        Parameters
+        ----------
+        func: function
+        *args, **kwargs:
+            arguments for func
+
+        Returns
+        -------
+        return value of func
+        """
+        async with self._semaphore():
+            cancel = threading.Event()
+            if 'cancel' in kwargs:
+                kwargs['cancel'] = cancel
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(
+                    self.executor, functools.partial(func, *args, **kwargs)
+                )
+            except asyncio.CancelledError:
+                cancel.set()
+                raise
+
+    async def read_window(self, filename, xoff, yoff, xsize, ysize, band=1):
+        """Read a window of a band, see raster.read_window
+
+        Parameters
+        ----------
+        filename: path
+        xoff: int
+        yoff: int
+            window offset in pixels
+        xsize: int
+        ysize: int
+            window size in pixels
+        band: int, default 1
+
+        Returns
+        -------
+        np.array
+        """
+        data, metadata = await self.run(
+            _read_window_job_, self.pool, filename,
+            (xoff, yoff, xsize, ysize), band, cancel=None,
+            tile_cache=self.tile_cache, min_pixels=self.min_pixels
+        )
+        return data
+
+    async def load_raster(self, filename, band=1):
+        """Load a band and metadata, see raster.load_raster. Datasets
+        cannot be returned as they belong to reader threads
+
+        Parameters
+        ----------
+        filename: path
+        band: int, default 1
+
+        Returns
+        -------
+        np.array
+            2d raster data
+        dict
+            metadata
+        """
+        return await self.run(
+            _read_window_job_, self.pool, filename, None, band,
+            cancel=None, tile_cache=self.tile_cache,
+            min_pixels=self.min_pixels
+        )
+
+    async def sample_points(self, filename, points, band=1,
+            no_data=np.nan
+        ):
+        """Get values of a band at points, see raster.sample_points
+
+        Parameters
+        ----------
+        filename: path
+        points: list like
+            (x, y) or list of (x, y) coordinates
+        band: int, default 1
+        no_data: number, default np.nan
+            value for points outside of raster
+
+        Returns
+        -------
+        np.array
+        """
+        return await self.run(
+            raster.sample_points, filename, points, band, no_data,
+            pool=self.pool, tile_cache=self.tile_cache
+        )
+
+
+_default_reader = None
+_default_lock = threading.Lock()
+
+def get_default_reader():
+    """Get the reader used by the module level functions, created on first
+    use with default arguments
+
+    Returns
+    -------
+    AsyncRasterReader
+    """
+    global _default_reader
+    with _default_lock:
+        if _default_reader is None:
+            _default_reader = AsyncRasterReader()
+        return _default_reader
+
+
+async def aload_raster(filename, band=1, reader=None):
+    """async raster.load_raster, see AsyncRasterReader.load_raster
+
+    Parameters
+    ----------
+    filename: path
+    band: int, default 1
+    reader: AsyncRasterReader, optional
+        defaults to get_default_reader()
+
+    Returns
+    -------
+    np.array
+        2d raster data
+    dict
+        metadata
+    """
+    reader = reader or get_default_reader()
+    return await reader.load_raster(filename, band)
+
+
+async def aread_window(filename, xoff, yoff, xsize, ysize, band=1,
+        reader=None
+    ):
+    """async raster.read_window, see AsyncRasterReader.read_window
+
+    Parameters
+    ----------
+    filename: path
+    xoff: int
+    yoff: int
+        window offset in pixels
+    xsize: int
+    ysize: int
+        window size in pixels
+    band: int, default 1
+    reader: AsyncRasterReader, optional
+        defaults to get_default_reader()
+
+    Returns
+    -------
+    np.array
+    """
+    reader = reader or get_default_reader()
+    return await reader.read_window(filename, xoff, yoff, xsize, ysize, band)
+
+
+async def asample_points(filename, points, band=1, no_data=np.nan,
+        reader=None
+    ):
+    """async raster.sample_points, see AsyncRasterReader.sample_points
+
+    Parameters
+    ----------
+    filename: path
+    points: list like
+        (x, y) or list of (x, y) coordinates
+    band: int, default 1
+    no_data: number, default np.nan
+        value for points outside of raster
+    reader: AsyncRasterReader, optional
+        defaults to get_default_reader()
+
+    Returns
+    -------
+    np.array
+    """
+    reader = reader or get_default_reader()
+    return await reader.sample_points(filename, points, band, no_data)
+
+
+async def aload_rasters(filenames, band=1, reader=None):
+    """Load many rasters concurrently
+
+    Parameters
+    ----------
+    filenames: list
+    band: int, default 1
+    reader: AsyncRasterReader, optional
+        defaults to get_default_reader()
+
+    Returns
+    -------
+    list
+        (data, metadata) for each file
+    """
+    return await asyncio.gather(
+        *[aload_raster(f, band, reader) for f in filenames]
+    )
@@ -0,0 +1,363 @@
+"""
+Catalog
+-------
+
+SQLite catalog of raster footprints for finding rasters that overlap an area
+without opening them
+
+"""
+import os
+import sqlite3
+import fnmatch
+from multiprocessing import Pool
+
+import numpy as np
+from osgeo import gdal
+
+from . import raster
+from . import transforms
+
+RASTER_PATTERNS = ['*.tif', '*.tiff', '*.vrt', '*.img', '*.jp2']
+
+## crs used for the spatial index
+INDEX_CRS = 4326
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS rasters (
+        id INTEGER PRIMARY KEY,
+        path TEXT UNIQUE NOT NULL,
+        mtime REAL, size INTEGER,
+        min_x REAL, min_y REAL, max_x REAL, max_y REAL,
+        crs TEXT, x_res REAL, y_res REAL, x_size INTEGER, y_size INTEGER,
+        bands INTEGER, datatype TEXT, no_data REAL
+    )""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS footprints USING rtree(
+        id, min_x, max_x, min_y, max_y
+    )""",
+]
+
+_FIELDS = [
+    'path', 'mtime', 'size', 'min_x', 'min_y', 'max_x', 'max_y', 'crs',
+    'x_res', 'y_res', 'x_size', 'y_size', 'bands', 'datatype', 'no_data'
+]
+
+
+def _bounds_from_transform(transform, x_size, y_size):
+    """(min x, min y, max x, max y) of a raster grid"""
+    xs, ys = [], []
+    for col, row in ((0, 0), (x_size, 0), (0, y_size), (x_size, y_size)):
+        xs.append(transform[0] + col * transform[1] + row * transform[2])
+        ys.append(transform[3] + col * transform[4] + row * transform[5])
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def transform_bounds(bounds, in_crs, out_crs, densify=21):
+    """Transform a bounding box between CRSs, sampling points along the
+    edges so curved edges are covered
+
+    Parameters
+    ----------
+    bounds: tuple
+        (min x, min y, max x, max y)
+    in_crs: str, int, or SpatialReference
+    out_crs: str, int, or SpatialReference
+        These arguments are passed through transforms.format_crs
+    densify: int, default 21
+        points per edge
+
+    Returns
+    -------
+    tuple
+        (min x, min y, max x, max y) in out_crs
+    """
+    min_x, min_y, max_x, max_y = bounds
+    xs = np.linspace(min_x, max_x, densify)
+    ys = np.linspace(min_y, max_y, densify)
+    points = np.concatenate([
+        np.column_stack([xs, np.full(densify, min_y)]),
+        np.column_stack([xs, np.full(densify, max_y)]),
+        np.column_stack([np.full(densify, min_x), ys]),
+        np.column_stack([np.full(densify, max_x), ys]),
+    ])
+    transform = transforms.coordinate_transformation(in_crs, out_crs)
+    points = np.array(transform.TransformPoints(points.tolist()))[:, :2]
+    points = points[np.isfinite(points).all(axis=1)]
+    return (
+        points[:, 0].min(), points[:, 1].min(),
+        points[:, 0].max(), points[:, 1].max()
+    )
+
+
+def _read_footprint_(path):
+    """read catalog row for a raster, used by Catalog.scan
+
+    Returns
+    -------
+    tuple
+        (row values in _FIELDS order, index bounds), or None if the raster
+        cannot be read
+    """
+    try:
+        stat = os.stat(path)
+        ds = gdal.Open(path, gdal.GA_ReadOnly)
+        if ds is None:
+            return None
+        transform = ds.GetGeoTransform()
+        crs = ds.GetProjection()
+        bounds = _bounds_from_transform(
+            transform, ds.RasterXSize, ds.RasterYSize
+        )
+        band = ds.GetRasterBand(1)
+        row = (
+            path, stat.st_mtime, stat.st_size, *bounds, crs,
+            transform[1], transform[5], ds.RasterXSize, ds.RasterYSize,
+            ds.RasterCount, gdal.GetDataTypeName(band.DataType),
+            band.GetNoDataValue()
+        )
+        index_bounds = transform_bounds(bounds, crs, INDEX_CRS) if crs \
+            else None
+    except Exception:
+        return None
+    return row, index_bounds
+
+
+class Catalog(object):
+    """Catalog of raster footprints stored in a SQLite database with an
+    R*Tree spatial index. Footprints are indexed in EPSG:4326 (longitude,
+    latitude), footprints crossing the antimeridian are not split.
+
+    Example
+    -------
+    >>> catalog = Catalog('tiles.sqlite')
+    >>> catalog.scan('/data/tiles', workers=8)
+    >>> tiles = catalog.query((-150, 64, -147, 65), 4326)
+    >>> raster.merge(tiles, 'merged.tif')
+    """
+
+    def __init__(self, database):
+        """
+        Parameters
+        ----------
+        database: path
+            SQLite database file, created if it does not exist
+        """
+        self.database = database
+        self.connection = sqlite3.connect(database)
+        for statement in _SCHEMA:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM rasters'
+        ).fetchone()[0]
+
+    def close(self):
+        """close database connection"""
+        self.connection.close()
+
+    def find_rasters(self, root, patterns=RASTER_PATTERNS):
+        """find raster files under root
+
+        Parameters
+        ----------
+        root: path
+        patterns: list
+            fnmatch patterns of raster file names
+
+        Returns
+        -------
+        list of paths
+        """
+        found = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            for name in filenames:
+                if any(fnmatch.fnmatch(name.lower(), p) for p in patterns):
+                    found.append(os.path.abspath(os.path.join(dirpath, name)))
+        return sorted(found)
+
+    def scan(self, root, patterns=RASTER_PATTERNS, workers=1, verbose=False):
+        """Add rasters under root to catalog. Only rasters that are new, or
+        have a changed size or modification time are read, and rasters that
+        no longer exist are removed. Only metadata is read.
+
+        Parameters
+        ----------
+        root: path
+        patterns: list
+            fnmatch patterns of raster file names
+        workers: int, default 1
+            number of processes reading metadata
+        verbose: bool, default False
+
+        Returns
+        -------
+        dict
+            number of rasters 'added', 'updated', 'removed', 'unchanged',
+            and 'failed'
+        """
+        root = os.path.abspath(root)
+        ## exact prefix match, LIKE treats _ and % in paths as wildcards 
+        ## and ignores case
+        prefix = os.path.join(root, '')
+        known = {
+            path: (id_, mtime, size) for id_, path, mtime, size in
+                self.connection.execute(
+                    'SELECT id, path, mtime, size FROM rasters '
+                    'WHERE substr(path, 1, ?) = ?', (len(prefix), prefix)
+                )
+        }
+        summary = {
+            'added': 0, 'updated': 0, 'removed': 0,
+            'unchanged': 0, 'failed': 0
+        }
+
+        to_read = []
+        found = self.find_rasters(root, patterns)
+        for path in found:
+            if path in known:
+                stat = os.stat(path)
+                if known[path][1:] == (stat.st_mtime, stat.st_size):
+                    summary['unchanged'] += 1
+                    continue
+            to_read.append(path)
+
+        removed = [known[path][0] for path in set(known) - set(found)]
+
+        if workers > 1 and len(to_read) > 1:
+            with Pool(min(workers, len(to_read))) as pool:
+                results = pool.imap(_read_footprint_, to_read, chunksize=16)
+                self._update(to_read, results, known, summary, verbose)
+        else:
+            results = map(_read_footprint_, to_read)
+            self._update(to_read, results, known, summary, verbose)
+
+        with self.connection:
+            for id_ in removed:
+                self._delete(id_)
+        summary['removed'] = len(removed)
+
+        if verbose:
+            print(summary)
+        return summary
+
+    def _delete(self, id_):
+        """remove a raster from the catalog"""
+        self.connection.execute('DELETE FROM rasters WHERE id = ?', (id_,))
+        self.connection.execute('DELETE FROM footprints WHERE id = ?', (id_,))
+
+    def _update(self, paths, results, known, summary, verbose=False):
+        """insert or replace scan results in one transaction"""
+        insert = 'INSERT INTO rasters (%s) VALUES (%s)' % (
+            ', '.join(_FIELDS), ', '.join('?' * len(_FIELDS))
+        )
+        with self.connection:
+            for path, result in zip(paths, results):
+                if path in known:
+                    self._delete(known[path][0])
+                if result is None:
+                    if verbose:
+                        print('could not read', path)
+                    summary['failed'] += 1
+                    continue
+                row, index_bounds = result
+                id_ = self.connection.execute(insert, row).lastrowid
+                if index_bounds is not None:
+                    min_x, min_y, max_x, max_y = index_bounds
+                    self.connection.execute(
+                        'INSERT INTO footprints VALUES (?, ?, ?, ?, ?)',
+                        (id_, min_x, max_x, min_y, max_y)
+                    )
+                summary['updated' if path in known else 'added'] += 1
+
+    def query(self, bounds, crs=INDEX_CRS, exact=True):
+        """Find rasters that overlap a bounding box
+
+        Parameters
+        ----------
+        bounds: tuple
+            (min x, min y, max x, max y)
+        crs: str, int, or SpatialReference, default 4326
+            CRS of bounds, passed through transforms.format_crs
+        exact: bool, default True
+            if True the index results are checked against the bounds
+            transformed to each rasters CRS, otherwise rasters whose
+            EPSG:4326 footprint overlaps are returned
+
+        Returns
+        -------
+        list
+            paths of overlapping rasters, can be passed to raster.merge
+        """
+        index_bounds = bounds if crs == INDEX_CRS else \
+            transform_bounds(bounds, crs, INDEX_CRS)
+        min_x, min_y, max_x, max_y = index_bounds
+        rows = self.connection.execute(
+            'SELECT r.path, r.crs, r.min_x, r.min_y, r.max_x, r.max_y '
+            'FROM footprints f JOIN rasters r ON r.id = f.id '
+            'WHERE f.max_x >= ? AND f.min_x <= ? '
+            'AND f.max_y >= ? AND f.min_y <= ? ORDER BY r.path',
+            (min_x, max_x, min_y, max_y)
+        ).fetchall()
+        if not exact:
+            return [row[0] for row in rows]
+
+        found = []
+        native = {}
+        for path, raster_crs, r_min_x, r_min_y, r_max_x, r_max_y in rows:
+            if raster_crs not in native:
+                native[raster_crs] = transform_bounds(
+                    bounds, crs, raster_crs
+                )
+            q_min_x, q_min_y, q_max_x, q_max_y = native[raster_crs]
+            if r_max_x >= q_min_x and r_min_x <= q_max_x and \
+                    r_max_y >= q_min_y and r_min_y <= q_max_y:
+                found.append(path)
+        return found
+
+    def get_info(self, path):
+        """get catalog information for a raster
+
+        Parameters
+        ----------
+        path: path
+
+        Returns
+        -------
+        dict or None
+        """
+        row = self.connection.execute(
+            'SELECT %s FROM rasters WHERE path = ?' % ', '.join(_FIELDS),
+            (os.path.abspath(path),)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(_FIELDS, row))
+
+    def merge(self, bounds, outfile, crs=INDEX_CRS, warp_options=[]):
+        """merge rasters overlapping bounds with raster.merge
+
+        Parameters
+        ----------
+        bounds: tuple
+            (min x, min y, max x, max y)
+        outfile: path
+        crs: str, int, or SpatialReference, default 4326
+            CRS of bounds
+        warp_options: gdal.WarpOptions
+            options passed to raster.merge
+
+        Returns
+        -------
+        gdal.Dataset, or None if no rasters overlap
+        """
+        to_merge = self.query(bounds, crs)
+        if len(to_merge) == 0:
+            return None
+        return raster.merge(to_merge, outfile, warp_options)
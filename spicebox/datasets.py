@@ -0,0 +1,179 @@
+"""
+Datasets
+--------
+
+Thread safe pool of open gdal datasets. GDAL datasets cannot be shared
+between threads, so each thread gets its own handle for a (path, mode),
+which is reused by later calls in that thread.
+
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from osgeo import gdal
+
+
+class DatasetPool(object):
+    """Pool of open gdal datasets, one per (path, mode, thread). The least
+    recently used handles are dropped when more than max_open are open, and
+    handles are reopened when a files modification time changes.
+
+    Dropping a handle only removes the pools reference, so a dataset still
+    in use by its thread stays open until that thread is done with it, and
+    datasets opened for update are flushed when they are closed.
+    Datasets from the pool should not be closed or deleted by callers.
+
+    Example
+    -------
+    >>> pool = DatasetPool(max_open=32)
+    >>> ds = pool.get('tile.tif')
+    """
+
+    def __init__(self, max_open=64, check_mtime=True):
+        """
+        Parameters
+        ----------
+        max_open: int, default 64
+            maximum number of open datasets
+        check_mtime: bool, default True
+            if True reopen datasets when their files modification time
+            changes
+        """
+        self.max_open = max_open
+        self.check_mtime = check_mtime
+        self._lock = threading.Lock()
+        self._handles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._handles)
+
+    def __contains__(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            return any(key[0] == path for key in self._handles)
+
+    @staticmethod
+    def _mtime(path):
+        """modification time of path, or None if it is not a local file"""
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def get(self, path, mode=gdal.GA_ReadOnly):
+        """Get the calling threads dataset for path, opening it if needed
+
+        Parameters
+        ----------
+        path: path
+            raster file, or any name gdal.Open accepts
+        mode: int, default gdal.GA_ReadOnly
+            gdal.GA_ReadOnly or gdal.GA_Update
+
+        Raises
+        ------
+        IOError
+            if the dataset cannot be opened
+
+        Returns
+        -------
+        gdal.Dataset
+        """
+        if os.path.exists(path):
+            path = os.path.abspath(path)
+        key = (path, mode, threading.get_ident())
+        mtime = self._mtime(path) if self.check_mtime else None
+
+        with self._lock:
+            if key in self._handles:
+                dataset, opened_mtime = self._handles[key]
+                if mtime == opened_mtime:
+                    self._handles.move_to_end(key)
+                    self.hits += 1
+                    return dataset
+                del self._handles[key]
+            self.misses += 1
+
+        ## open outside of the lock so other threads are not blocked
+        dataset = gdal.Open(path, mode)
+        if dataset is None:
+            raise IOError('could not open %s' % path)
+
+        with self._lock:
+            self._handles[key] = (dataset, mtime)
+            self._handles.move_to_end(key)
+            self._evict()
+        return dataset
+
+    def _evict(self):
+        """drop handles of finished threads, then least recently used
+        handles until max_open are open. Caller must hold lock
+        """
+        if len(self._handles) <= self.max_open:
+            return
+        alive = {thread.ident for thread in threading.enumerate()}
+        for key in [key for key in self._handles if key[2] not in alive]:
+            del self._handles[key]
+            self.evictions += 1
+        while len(self._handles) > self.max_open:
+            self._handles.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, path=None):
+        """Drop handles for a path, in all threads and modes
+
+        Parameters
+        ----------
+        path: path, optional
+            if None all handles are dropped
+        """
+        if path is not None and os.path.exists(path):
+            path = os.path.abspath(path)
+        with self._lock:
+            for key in list(self._handles):
+                if path is None or key[0] == path:
+                    del self._handles[key]
+
+    def clear(self):
+        """Drop all handles"""
+        self.invalidate()
+
+    def stats(self):
+        """Get pool counters
+
+        Returns
+        -------
+        dict
+            'open', 'hits', 'misses', and 'evictions'
+        """
+        with self._lock:
+            return {
+                'open': len(self._handles), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions
+            }
+
+
+## pool used when functions are called with pool=True
+DEFAULT_POOL = DatasetPool()
+
+def get_pool(pool):
+    """Get a DatasetPool from a pool argument
+
+    Parameters
+    ----------
+    pool: DatasetPool, bool, or None
+        True for DEFAULT_POOL, None or False for no pool
+
+    Returns
+    -------
+    DatasetPool or None
+    """
+    if pool is True:
+        return DEFAULT_POOL
+    if pool is False:
+        return None
+    return pool
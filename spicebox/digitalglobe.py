@@ -10,6 +10,158 @@ and
 https://dg-cms-uploads-production.s3.amazonaws.com/uploads/document/file/207/Radiometric_Use_of_WorldView-3_v2.pdf
  
 """
+import os
+import re
+import time
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from osgeo import gdal
+
+from . import raster, transforms
+
+DG_METADATA = namedtuple('DG_METADATA', 
+    ['satellite', 'bands', 'abs_cal_factors', 'effective_bandwidths', 
+        'acquisition_time', 'sun_azimuth', 'sun_elevation', 'solar_zenith'
+    ]
+)
+
+def _parse_time(value):
+    """parse a digital globe metadata time string"""
+    value = value.strip().strip('"').rstrip('Z')
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError('Could not parse time %s' % value)
+
+
+def _parse_imd(path):
+    """Parse a digital globe .IMD file into a dict of groups
+
+    Parameters
+    ----------
+    path: path
+
+    Returns
+    -------
+    dict
+        group name: dict of key: string value. Top level items are in group
+        ''
+    """
+    groups = {'': {}}
+    stack = ['']
+    item = re.compile(r'^\s*(\w+)\s*=\s*(.*?);?\s*$')
+    with open(path, 'r') as fd:
+        for line in fd:
+            match = item.match(line)
+            if match is None:
+                continue
+            key, value = match.groups()
+            if key == 'BEGIN_GROUP':
+                stack.append(value)
+                groups[value] = {}
+            elif key == 'END_GROUP':
+                stack.pop()
+            else:
+                groups[stack[-1]][key] = value.strip('"')
+    return groups
+
+
+def _parse_xml(path):
+    """Parse the IMD section of a digital globe .XML file into a dict of 
+    groups using the same key names as .IMD files
+
+    Parameters
+    ----------
+    path: path
+
+    Returns
+    -------
+    dict
+        group name: dict of key: string value
+    """
+    names = {
+        'ABSCALFACTOR': 'absCalFactor',
+        'EFFECTIVEBANDWIDTH': 'effectiveBandwidth',
+        'SATID': 'satId',
+        'FIRSTLINETIME': 'firstLineTime',
+        'EARLIESTACQTIME': 'earliestAcqTime',
+        'MEANSUNAZ': 'meanSunAz',
+        'MEANSUNEL': 'meanSunEl',
+    }
+    root = ET.parse(path).getroot()
+    imd = root if root.tag == 'IMD' else root.find('IMD')
+    groups = {}
+    for group in imd:
+        name = 'IMAGE_1' if group.tag == 'IMAGE' else group.tag
+        groups[name] = {
+            names.get(child.tag, child.tag): (child.text or '').strip() 
+                for child in group
+        }
+    return groups
+
+
+@lru_cache(maxsize=256)
+def _read_metadata(path, mtime):
+    """Read and cache metadata, see read_metadata. mtime is only used as
+    part of the cache key
+    """
+    if os.path.splitext(path)[1].lower() == '.xml':
+        groups = _parse_xml(path)
+    else:
+        groups = _parse_imd(path)
+
+    bands = [name for name in groups if name.startswith('BAND_')]
+    image = groups['IMAGE_1']
+    time = image.get('firstLineTime', image.get('earliestAcqTime'))
+    sun_el = float(image['meanSunEl'])
+
+    return DG_METADATA(
+        satellite = image.get('satId'),
+        bands = tuple(bands),
+        abs_cal_factors = tuple(
+            float(groups[b]['absCalFactor']) for b in bands
+        ),
+        effective_bandwidths = tuple(
+            float(groups[b]['effectiveBandwidth']) for b in bands
+        ),
+        acquisition_time = _parse_time(time),
+        sun_azimuth = float(image['meanSunAz']),
+        sun_elevation = sun_el,
+        solar_zenith = np.radians(90.0 - sun_el),
+    )
+
+
+def read_metadata(path):
+    """Read the calibration constants, acquisition time, and sun angles from
+    a digital globe .IMD or .XML metadata file. Results are cached by path 
+    and modification time so repeated calls do not re-parse the file.
+
+    Parameters
+    ----------
+    path: path
+        .IMD or .XML file
+
+    Returns
+    -------
+    DG_METADATA
+        named tuple with fields: satellite, bands (band group names in 
+        file order), abs_cal_factors, effective_bandwidths (per band tuples),
+        acquisition_time (datetime.datetime of first line), sun_azimuth, 
+        sun_elevation (degrees), and solar_zenith (radians)
+    """
+    path = os.path.abspath(path)
+    return _read_metadata(path, os.path.getmtime(path))
+
 
 def calc_julian_days_dg(tlc_time):
     """Calculate the Julida dayys according to the fomula provided by
@@ -18,20 +170,28 @@ def calc_julian_days_dg(tlc_time):
 
     Parameters
     ----------
-    tlc_time: datetime.datetime
+    tlc_time: datetime.datetime or DG_METADATA
+        if DG_METADATA the acquisition time is used
 
     Returns
     -------
-    int:
+    float:
         days since the beginning of the year -4712 
         Meuss, Jean. "Astronomical algorithms, 2nd Ed.." Richmond, VA: Willmann-Bell(1998). Pg 61
     """
-    a = tlctime.year//100 
+    if type(tlc_time) is DG_METADATA:
+        tlc_time = tlc_time.acquisition_time
+    year, month = tlc_time.year, tlc_time.month
+    if month <= 2:
+        year -= 1
+        month += 12
+    a = year//100 
     b = 2 - a + (a // 4)
-    UT = tlctime.hour + tlctime.minute/60 + (tlctime.second+tlctime.microsecond)/3600
-    jd = int(365.25*tlctime.year+4716) + \
-        int(30.6001*(tlctime.month+1)) + \
-        tlctime.day + UT/24+b-1524.5
+    UT = tlc_time.hour + tlc_time.minute/60 + \
+        (tlc_time.second + tlc_time.microsecond/1e6)/3600
+    jd = int(365.25*(year+4716)) + \
+        int(30.6001*(month+1)) + \
+        tlc_time.day + UT/24+b-1524.5
     return jd
 
 def calc_dist_sun_earth_au(jd):
@@ -48,10 +208,190 @@ def calc_dist_sun_earth_au(jd):
         earth sun distance  in AU
     """
     d = jd - 2451545.0
-    g = 357.529 + 0.98560028 * d
+    g = np.radians(357.529 + 0.98560028 * d)
     d_es = 1.00014 - 0.01671 * np.cos(g) - 0.00014*np.cos(2*g)
     return d_es
 
+def calc_julian_days_array(times):
+    """Calculate Julian days for an array of times. Equivalent to 
+    calc_julian_days_dg for dates in the Gregorian calendar.
+
+    Parameters
+    ----------
+    times: array like
+        datetime.datetime or np.datetime64 values (UTC)
+
+    Returns
+    -------
+    np.array
+        Julian days
+    """
+    times = np.asarray(times, dtype='datetime64[us]')
+    j2000 = np.datetime64('2000-01-01T12:00:00', 'us')
+    return (times - j2000) / np.timedelta64(1, 'D') + 2451545.0
+
+
+def calc_dist_sun_earth_au_array(times):
+    """Calculate the earth sun distance in AU for an array of times
+
+    Parameters
+    ----------
+    times: array like
+        datetime.datetime or np.datetime64 values (UTC)
+
+    Returns
+    -------
+    np.array
+        earth sun distance in AU
+    """
+    return calc_dist_sun_earth_au(calc_julian_days_array(times))
+
+
+def calc_solar_zenith(times, lat, lon):
+    """Calculate the solar zenith angle. Uses the approximate solar 
+    position equations from the U.S. Naval Observatory (accurate to about
+    a hundredth of a degree), inputs are broadcast together.
+
+    Parameters
+    ----------
+    times: array like
+        datetime.datetime or np.datetime64 values (UTC)
+    lat: array like
+    lon: array like
+        latitude and longitude in degrees
+
+    Returns
+    -------
+    np.array
+        solar zenith angle (radians)
+    """
+    d = calc_julian_days_array(times) - 2451545.0
+    g = np.radians(357.529 + 0.98560028 * d)
+    q = 280.459 + 0.98564736 * d # mean longitude
+    ecliptic_lon = np.radians(q + 1.915 * np.sin(g) + 0.020 * np.sin(2*g))
+    obliquity = np.radians(23.439 - 0.00000036 * d)
+
+    right_ascension = np.arctan2(
+        np.cos(obliquity) * np.sin(ecliptic_lon), np.cos(ecliptic_lon)
+    )
+    declination = np.arcsin(np.sin(obliquity) * np.sin(ecliptic_lon))
+    gmst = (18.697374558 + 24.06570982441908 * d) % 24
+
+    hour_angle = np.radians(gmst * 15 + np.asarray(lon)) - right_ascension
+    lat = np.radians(lat)
+    cos_zenith = np.sin(lat) * np.sin(declination) + \
+        np.cos(lat) * np.cos(declination) * np.cos(hour_angle)
+    return np.arccos(np.clip(cos_zenith, -1, 1))
+
+
+def _interp_axis(values, coarse, n, axis):
+    """linearly interpolate values at coarse indices to indices 0 to n-1
+    along axis
+    """
+    if len(coarse) == 1:
+        return np.repeat(values, n, axis=axis)
+    x = np.arange(n)
+    idx = np.clip(np.searchsorted(coarse, x, 'right') - 1, 0, len(coarse) - 2)
+    weight = (x - coarse[idx]) / (coarse[idx + 1] - coarse[idx])
+    shape = [1, 1]
+    shape[axis] = n
+    weight = weight.reshape(shape)
+    return np.take(values, idx, axis) * (1 - weight) + \
+        np.take(values, idx + 1, axis) * weight
+
+
+def calc_solar_zenith_window(
+        times, geotransform, projection, xoff, yoff, xsize, ysize, 
+        grid_step=64, transform=None
+    ):
+    """Calculate per pixel solar zenith angles for a raster window. Angles 
+    are calculated on a coarse grid and bilinearly interpolated.
+
+    Parameters
+    ----------
+    times: datetime.datetime, np.datetime64 or array like
+        acquisition time, or array of acquisition times for each row in the 
+        full raster (for scanning sensors)
+    geotransform: tuple
+        raster geotransform
+    projection: str
+        raster projection WKT
+    xoff: int
+    yoff: int
+    xsize: int
+    ysize: int
+        window, as used by ReadAsArray
+    grid_step: int, default 64
+        spacing of coarse grid in pixels, 1 calculates every pixel
+    transform: osr.CoordinateTransformation, optional
+        transformation from projection to EPSG:4326 with lon/lat axis order
+        (see transforms.coordinate_transformation), created if not given.
+        Pass one to avoid recreating it for every window
+
+    Returns
+    -------
+    np.array
+        (ysize, xsize) solar zenith angle (radians)
+    """
+    rows = np.unique(np.append(np.arange(0, ysize, grid_step), ysize - 1))
+    cols = np.unique(np.append(np.arange(0, xsize, grid_step), xsize - 1))
+    cc, rr = np.meshgrid(cols + xoff + 0.5, rows + yoff + 0.5)
+    gt = geotransform
+    x = gt[0] + cc * gt[1] + rr * gt[2]
+    y = gt[3] + cc * gt[4] + rr * gt[5]
+
+    if transform is None:
+        transform = transforms.coordinate_transformation(projection, 4326)
+    lon_lat = np.array(transform.TransformPoints(
+        np.stack([x.ravel(), y.ravel()], axis=1).tolist()
+    ))[:, :2].reshape(len(rows), len(cols), 2)
+
+    times = np.asarray(times, dtype='datetime64[us]')
+    if times.ndim > 0:
+        times = times[rows + yoff].reshape(len(rows), 1)
+
+    zenith = calc_solar_zenith(times, lon_lat[..., 1], lon_lat[..., 0])
+    zenith = _interp_axis(zenith, rows, ysize, 0)
+    return _interp_axis(zenith, cols, xsize, 1)
+
+
+def solar_zenith_function(in_raster, times, grid_step=64):
+    """Create a function that calculates per pixel solar zenith angles for
+    windows of a raster, for use as theta in calc_toa_reflectance_raster
+
+    Parameters
+    ----------
+    in_raster: path or gdal.Dataset
+    times: datetime.datetime, np.datetime64 or array like
+        see calc_solar_zenith_window
+    grid_step: int, default 64
+        see calc_solar_zenith_window
+
+    Returns
+    -------
+    function
+        f(xoff, yoff, xsize, ysize) -> np.array of solar zenith (radians)
+    """
+    ds = raster.load_raster(in_raster, True) if type(in_raster) is str \
+        else in_raster
+    geotransform = ds.GetGeoTransform()
+    projection = ds.GetProjection()
+    ## coordinate transformations are not thread safe, so one is created 
+    ## per thread for the scene and reused for all windows
+    local = threading.local()
+
+    def zenith(xoff, yoff, xsize, ysize):
+        if not hasattr(local, 'transform'):
+            local.transform = transforms.coordinate_transformation(
+                projection, 4326
+            )
+        return calc_solar_zenith_window(
+            times, geotransform, projection, xoff, yoff, xsize, ysize, 
+            grid_step, local.transform
+        )
+    return zenith
+
+
 def calc_absolute_radiometric_calibration(
         data, gain,offset, abs_cal_factor, effective_bandwidth, 
     ):
@@ -99,3 +439,460 @@ def calc_toa_reflectance(radiance, dist_earth_sun, irradiance, theta):
     """
     ref = (radiance * (dist_earth_sun**2) * np.pi)/ (irradiance * np.cos(theta))
     return ref
+
+
+def _per_band(value, n_bands):
+    """Expand a scalar or sequence to a per band float64 array"""
+    value = np.asarray(value, dtype=float)
+    if value.ndim == 0:
+        return np.full(n_bands, float(value))
+    if len(value) != n_bands:
+        raise ValueError('Expected %i per band values got %i' % \
+            (n_bands, len(value)))
+    return value
+
+
+def calc_toa_reflectance_coefficients(
+        gain, offset, abs_cal_factor, effective_bandwidth, 
+        dist_earth_sun, irradiance, theta
+    ):
+    """Combine the absolute radiometric calibration and Top-of-Atmosphere 
+    reflectance equations into a single linear transform per band, so
+    reflectance = data * scale + shift
+
+    Parameters
+    ----------
+    gain: number or array
+    offset: number or array
+    abs_cal_factor: number or array
+    effective_bandwidth: number or array
+        see calc_absolute_radiometric_calibration
+    dist_earth_sun: number
+    irradiance: number or array
+    theta: number
+        see calc_toa_reflectance
+
+    Returns
+    -------
+    scale, shift
+    """
+    factor = ((dist_earth_sun**2) * np.pi)/ (
+        np.asarray(irradiance, dtype=float) * np.cos(theta)
+    )
+    scale = np.asarray(gain, dtype=float) * \
+        (np.asarray(abs_cal_factor, dtype=float) / 
+        np.asarray(effective_bandwidth, dtype=float)) * factor
+    shift = np.asarray(offset, dtype=float) * factor
+    return scale, shift
+
+
+def _reflectance_bands(in_raster, out_ds, bands, scales, shifts, no_data,
+        min_pixels, lock, cos_theta_func=None, windows=None
+    ):
+    """Calculate the TOA reflectance of bands block by block, used by
+    calc_toa_reflectance_raster. Each call opens its own dataset handle so 
+    sets of windows can be processed in parallel threads. If cos_theta_func
+    (window -> float32 cosine of solar zenith) is provided scale and shift 
+    must not include the solar zenith term, it is called once per block.
+    windows defaults to all windows of raster.get_window_size.
+    """
+    in_ds = raster.load_raster(in_raster, True) if type(in_raster) is str \
+        else in_raster
+    in_bands = [in_ds.GetRasterBand(band) for band in bands]
+    x_win, y_win = raster.get_window_size(in_bands[0], min_pixels)
+    if windows is None:
+        windows = raster.block_windows(
+            in_ds.RasterXSize, in_ds.RasterYSize, x_win, y_win
+        )
+    buffer = np.empty([y_win, x_win], dtype=np.float32)
+    mask = np.empty([y_win, x_win], dtype=bool)
+    scales = [np.float32(scale) for scale in scales]
+    shifts = [np.float32(shift) for shift in shifts]
+
+    for xoff, yoff, xsize, ysize in windows:
+        cos_theta = None
+        if cos_theta_func is not None:
+            cos_theta = cos_theta_func(xoff, yoff, xsize, ysize)
+        buf = buffer[:ysize, :xsize]
+        msk = mask[:ysize, :xsize]
+        for band, in_band, scale, shift in zip(
+                    bands, in_bands, scales, shifts
+                ):
+            in_band.ReadAsArray(xoff, yoff, xsize, ysize, buf_obj=buf)
+            np.equal(buf, 0, out=msk)
+            np.multiply(buf, scale, out=buf)
+            np.add(buf, shift, out=buf)
+            if cos_theta is not None:
+                np.divide(buf, cos_theta, out=buf)
+            np.copyto(buf, np.float32(no_data), where=msk)
+            with lock:
+                out_ds.GetRasterBand(band).WriteArray(buf, xoff, yoff)
+    return bands
+
+
+def calc_toa_reflectance_raster(
+        in_raster, out_raster, gain, offset, abs_cal_factor, 
+        effective_bandwidth, dist_earth_sun, irradiance, theta, 
+        no_data=np.nan, workers=1, min_pixels=1024*1024,
+        creation_options=['TILED=YES', 'COMPRESS=LZW', 'BIGTIFF=IF_SAFER']
+    ):
+    """Calculate the Top-of-Atmosphere reflectance of a digital globe 
+    scene from raw digital numbers. The radiometric calibration and 
+    reflectance calculations are combined and applied in place to float32
+    blocks, so memory use does not depend on the scene size.
+
+    Parameters
+    ----------
+    in_raster: path or gdal.Dataset
+        multispectral scene of raw digital numbers. Pixels with value 0 are
+        treated as no data.
+    out_raster: path
+        multi band reflectance GeoTIFF to create
+    gain: number or list
+    offset: number or list
+        gain and offset values per band, see 
+        calc_absolute_radiometric_calibration
+    abs_cal_factor: number or list
+    effective_bandwidth: number or list
+        calibration values per band pulled from image metadata
+    dist_earth_sun: number
+        Earth sun distance in AU
+    irradiance: number or list
+        Irradiance per band - see table 4 in document linked above
+    theta: number or function
+        solar zenith angle (radians), or a function that takes a window 
+        (x offset, y offset, x size, y size) and returns the per pixel solar
+        zenith angles for the window (see solar_zenith_function)
+    no_data: number, default np.nan
+        no data value for output
+    workers: int, default 1
+        number of threads processing blocks in parallel, in_raster must be
+        a path if workers > 1
+    min_pixels: int, default 1024*1024
+        minimum pixels per block read
+    creation_options: list
+        GTiff creation options for output 
+
+    Returns
+    -------
+    gdal.Dataset
+        reflectance dataset
+    """
+    in_ds = raster.load_raster(in_raster, True) if type(in_raster) is str \
+        else in_raster
+    if workers > 1 and type(in_raster) is not str:
+        raise TypeError('in_raster must be a path if workers > 1')
+    n_bands = in_ds.RasterCount
+
+    theta_func = theta if callable(theta) else None
+    scale, shift = calc_toa_reflectance_coefficients(
+        _per_band(gain, n_bands), _per_band(offset, n_bands), 
+        _per_band(abs_cal_factor, n_bands), 
+        _per_band(effective_bandwidth, n_bands),
+        dist_earth_sun, _per_band(irradiance, n_bands), 
+        0 if theta_func else theta
+    )
+
+    driver = gdal.GetDriverByName('GTiff')
+    out_ds = driver.Create(
+        out_raster, in_ds.RasterXSize, in_ds.RasterYSize, n_bands, 
+        gdal.GDT_Float32, options=creation_options
+    )
+    out_ds.SetGeoTransform(in_ds.GetGeoTransform())
+    out_ds.SetProjection(in_ds.GetProjection())
+    for band in range(1, n_bands + 1):
+        out_ds.GetRasterBand(band).SetNoDataValue(no_data)
+        out_ds.GetRasterBand(band).SetDescription(
+            in_ds.GetRasterBand(band).GetDescription()
+        )
+
+    ## the solar zenith of each block is calculated once for all bands
+    cos_theta_func = None
+    if theta_func is not None:
+        cos_theta_func = lambda *window: \
+            np.cos(theta_func(*window)).astype(np.float32)
+
+    lock = threading.Lock()
+    bands = list(range(1, n_bands + 1))
+    if workers > 1:
+        ## threads take every workers-th window and process all bands of 
+        ## it, so only the blocks in progress are held in memory
+        windows = list(raster.block_windows(
+            in_ds.RasterXSize, in_ds.RasterYSize,
+            *raster.get_window_size(in_ds.GetRasterBand(1), min_pixels)
+        ))
+        jobs = [
+            (in_raster, out_ds, bands, scale, shift, no_data, min_pixels, 
+                lock, cos_theta_func, windows[idx::workers])
+            for idx in range(workers)
+        ]
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(lambda job: _reflectance_bands(*job), jobs))
+    else:
+        _reflectance_bands(
+            in_ds, out_ds, bands, scale, shift, no_data, min_pixels, lock, 
+            cos_theta_func
+        )
+
+    out_ds.FlushCache()
+    return out_ds
+
+
+def calc_toa_reflectance_from_metadata(
+        in_raster, out_raster, metadata, gain, offset, irradiance, **kwargs
+    ):
+    """Calculate the Top-of-Atmosphere reflectance of a digital globe scene
+    using the calibration constants, acquisition time, and sun angle from
+    its metadata file
+
+    Parameters
+    ----------
+    in_raster: path or gdal.Dataset
+        multispectral scene of raw digital numbers
+    out_raster: path
+        multi band reflectance GeoTIFF to create
+    metadata: path or DG_METADATA
+        .IMD or .XML file, or result of read_metadata
+    gain: number or list
+    offset: number or list
+        gain and offset values per band, see 
+        calc_absolute_radiometric_calibration
+    irradiance: number or list
+        Irradiance per band - see table 4 in document linked above
+    kwargs:
+        other keyword arguments for calc_toa_reflectance_raster
+
+    Returns
+    -------
+    gdal.Dataset
+        reflectance dataset
+    """
+    if type(metadata) is not DG_METADATA:
+        metadata = read_metadata(metadata)
+    dist_earth_sun = calc_dist_sun_earth_au(calc_julian_days_dg(metadata))
+    return calc_toa_reflectance_raster(
+        in_raster, out_raster, gain, offset, metadata.abs_cal_factors, 
+        metadata.effective_bandwidths, dist_earth_sun, irradiance, 
+        metadata.solar_zenith, **kwargs
+    )
+
+
+TILE_PATTERN = re.compile(r'[_-]R\d+C\d+', re.IGNORECASE)
+
+def find_scenes(root, extensions=('.tif', '.ntf'), include_skipped=False):
+    """Find digital globe scenes under a directory. Tiled sub images 
+    (R1C1, R1C2, ...) are grouped into a single scene. Each scene needs a
+    .IMD or .XML metadata file in its directory with the same name (minus 
+    any tile suffix), scenes without one are skipped with a warning.
+
+    Parameters
+    ----------
+    root: path
+        directory to search recursively
+    extensions: tuple, default ('.tif', '.ntf')
+        image file extensions (case insensitive)
+    include_skipped: bool, default False
+        if True scenes without a metadata file are returned with 
+        'metadata' set to None, instead of being left out
+
+    Returns
+    -------
+    dict
+        (directory, scene name): {'name': scene name, 'directory': 
+        directory, 'tiles': list of image paths, 'metadata': path to .IMD 
+        or .XML file}
+    """
+    scenes = {}
+    metadata = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in sorted(filenames):
+            stem, ext = os.path.splitext(name)
+            key = (dirpath, TILE_PATTERN.sub('', stem))
+            if ext.lower() in ('.imd', '.xml'):
+                ## prefer .IMD over .XML
+                if key not in metadata or ext.lower() == '.imd':
+                    metadata[key] = os.path.join(dirpath, name)
+                continue
+            if ext.lower() not in extensions:
+                continue
+            scene = scenes.setdefault(key, {
+                'name': key[1], 'directory': dirpath, 'tiles': [], 
+                'metadata': None
+            })
+            scene['tiles'].append(os.path.join(dirpath, name))
+
+    for key in list(scenes):
+        if key not in metadata:
+            warnings.warn(
+                'skipping scene %s, no metadata file named %s.IMD or '
+                '%s.XML' % (os.path.join(*key), key[1], key[1])
+            )
+            if not include_skipped:
+                del scenes[key]
+            continue
+        scenes[key]['metadata'] = metadata[key]
+    return scenes
+
+
+def build_scene_vrt(tiles, vrt_path):
+    """Mosaic the tiles of a scene into a virtual raster (VRT)
+
+    Parameters
+    ----------
+    tiles: list
+        list of image paths
+    vrt_path: path
+        VRT file to create
+
+    Returns
+    -------
+    gdal.Dataset
+    """
+    vrt = gdal.BuildVRT(vrt_path, sorted(tiles))
+    vrt.FlushCache()
+    return vrt
+
+
+def _available_memory():
+    """available physical memory in bytes, or None if unknown"""
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _process_scene(args):
+    """Calibrate a single scene, used by process_scenes
+
+    Parameters
+    ----------
+    args: tuple
+        (scene id, scene dict from find_scenes, output path, calibration
+        dict, keyword arguments for calc_toa_reflectance_raster)
+
+    Returns
+    -------
+    dict
+        summary with keys 'scene', 'output', 'status', 'elapsed', and 'error'
+    """
+    name, scene, out_raster, calibration, kwargs = args
+    start = time.time()
+    summary = {
+        'scene': name, 'output': out_raster, 'status': 'done', 'error': None
+    }
+    try:
+        metadata = read_metadata(scene['metadata'])
+        if 'gain' not in calibration:
+            calibration = calibration[metadata.satellite]
+
+        vrt_path = os.path.splitext(out_raster)[0] + '.vrt'
+        build_scene_vrt(scene['tiles'], vrt_path)
+
+        partial = out_raster + '.partial'
+        kwargs = dict(kwargs)
+        options = kwargs.pop('creation_options', 
+            ['TILED=YES', 'COMPRESS=LZW', 'BIGTIFF=IF_SAFER']
+        )
+        ds = calc_toa_reflectance_from_metadata(
+            vrt_path, partial, metadata, calibration['gain'], 
+            calibration['offset'], calibration['irradiance'], 
+            creation_options=options, **kwargs
+        )
+        ds = None # close dataset before renaming
+        os.replace(partial, out_raster)
+    except Exception as error:
+        summary['status'] = 'failed'
+        summary['error'] = repr(error)
+    summary['elapsed'] = time.time() - start
+    return summary
+
+
+def process_scenes(
+        root, out_dir, calibration, workers=None, 
+        memory_per_worker=2*1024**3, overwrite=False, verbose=False, 
+        **kwargs
+    ):
+    """Calculate Top-of-Atmosphere reflectance for all digital globe scenes
+    in a directory. Each scene's tiles are mosaiced as a VRT and scenes are 
+    processed in a process pool. Scenes with completed outputs are skipped
+    so an interrupted run can be restarted. Outputs are written to the 
+    scene's directory relative to root, under out_dir.
+
+    Parameters
+    ----------
+    root: path
+        directory of digital globe deliveries, see find_scenes
+    out_dir: path
+        directory for output reflectance GeoTIFFs and scene VRTs
+    calibration: dict
+        {'gain': list, 'offset': list, 'irradiance': list} of per band 
+        values, or dict of satellite id (i.e. 'WV03') to such dicts
+    workers: int, optional
+        number of processes, if None the cpu count limited by available
+        memory divided by memory_per_worker is used
+    memory_per_worker: int, default 2 GiB
+        estimated bytes of memory used per process
+    overwrite: bool, default False
+        if True completed outputs are recreated
+    verbose: bool, default False
+        if True print the result of each scene
+    kwargs:
+        other keyword arguments for calc_toa_reflectance_raster
+
+    Returns
+    -------
+    list
+        list of dicts with keys 'scene' (path relative to root), 'output',
+        'status' ('done', 'skipped', or 'failed'), 'elapsed' (seconds), and
+        'error'. Scenes skipped for having no metadata file have an 'output'
+        of None and an 'error' saying so
+    """
+    scenes = find_scenes(root, include_skipped=True)
+
+    summary = []
+    jobs = []
+    for key in sorted(scenes):
+        scene = scenes[key]
+        rel_dir = os.path.relpath(scene['directory'], root)
+        scene_id = os.path.normpath(os.path.join(rel_dir, scene['name']))
+        if scene['metadata'] is None:
+            summary.append({
+                'scene': scene_id, 'output': None, 'status': 'skipped',
+                'elapsed': 0, 'error': 'no metadata file found'
+            })
+            continue
+        scene_out_dir = os.path.normpath(os.path.join(out_dir, rel_dir))
+        os.makedirs(scene_out_dir, exist_ok=True)
+        out_raster = os.path.join(
+            scene_out_dir, '%s-toa-reflectance.tif' % scene['name']
+        )
+        if os.path.exists(out_raster) and not overwrite:
+            summary.append({
+                'scene': scene_id, 'output': out_raster, 
+                'status': 'skipped', 'elapsed': 0, 'error': None
+            })
+            continue
+        jobs.append((scene_id, scene, out_raster, calibration, kwargs))
+
+    if workers is None:
+        workers = os.cpu_count()
+        available = _available_memory()
+        if available is not None:
+            workers = max(1, min(workers, available // memory_per_worker))
+    workers = max(1, min(workers, len(jobs)))
+
+    if workers > 1:
+        with Pool(workers) as pool:
+            results = pool.imap_unordered(_process_scene, jobs)
+            for result in results:
+                if verbose:
+                    print('%(scene)s: %(status)s in %(elapsed).1fs' % result)
+                summary.append(result)
+    else:
+        for job in jobs:
+            result = _process_scene(job)
+            if verbose:
+                print('%(scene)s: %(status)s in %(elapsed).1fs' % result)
+            summary.append(result)
+
+    return summary
@@ -8,77 +8,721 @@ Tools for general files
 import os
 import tarfile
 import glob
+import time
+import gzip
+import lzma
+import json
+import hashlib
+import zlib
+import bisect
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+
+
+PARALLEL_COMPRESSION = {
+    'pgz': 'gz',
+    'pxz': 'xz',
+}
+
+SEEKABLE_COMPRESSION = {
+    'sgz': 'gz',
+    'sxz': 'xz',
+}
+
+SEEKABLE_BLOCK_SIZE = 1024 * 1024
+INDEX_EXT = '.index.json'
+
+
+class ParallelCompressedWriter(object):
+    """File like object that compresses data written to it in independent 
+    blocks using a thread pool, similar to pigz. Each block is written as
+    a complete gzip member or xz stream so the output is readable by 
+    standard tools (gzip, xz, tar). zlib and lzma release the GIL so the 
+    blocks are compressed in parallel.
+    """
+
+    def __init__(self, fileobj, compression='gz', threads=None, 
+            block_size=4 * 1024 * 1024, level=6
+        ):
+        """
+        Parameters
+        ----------
+        fileobj: path or file like object
+            output file, if a path it is opened for writing and closed when 
+            the writer is closed
+        compression: str, default 'gz'
+            'gz' or 'xz'
+        threads: int, optional
+            number of compression threads, defaults to os.cpu_count()
+        block_size: int, default 4 MiB
+            uncompressed size of each independent block
+        level: int, default 6
+            compression level (gzip) or preset (xz)
+        """
+        if compression == 'gz':
+            self.compress = lambda block: gzip.compress(block, level)
+        elif compression == 'xz':
+            self.compress = lambda block: lzma.compress(
+                block, format=lzma.FORMAT_XZ, preset=level
+            )
+        else:
+            raise ValueError(
+                'parallel compression not supported for %s' % compression
+            )
+
+        self.owns_file = type(fileobj) is str
+        self.fileobj = open(fileobj, 'wb') if self.owns_file else fileobj
+        self.threads = threads if threads else os.cpu_count()
+        self.block_size = block_size
+        self.executor = ThreadPoolExecutor(self.threads)
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.blocks_written = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.bytes_submitted = 0
+        self.blocks = []
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _submit_(self, block):
+        """submit a block for compression, writing finished blocks in order
+        so that at most 2 blocks per thread are held in memory
+        """
+        self.pending.append(
+            (self.bytes_submitted, self.executor.submit(self.compress, block))
+        )
+        self.bytes_submitted += len(block)
+        while len(self.pending) > 2 * self.threads:
+            self._write_next_()
+
+    def _write_next_(self):
+        """write the oldest pending block, and record its uncompressed and
+        compressed offsets in self.blocks
+        """
+        start, future = self.pending.popleft()
+        block = future.result()
+        self.blocks.append([start, self.bytes_out])
+        self.fileobj.write(block)
+        self.blocks_written += 1
+        self.bytes_out += len(block)
+
+    def write(self, data):
+        """Write data
+
+        Parameters
+        ----------
+        data: bytes like
+
+        Returns
+        -------
+        int 
+            number of bytes written
+        """
+        self.buffer += data
+        self.bytes_in += len(data)
+        while len(self.buffer) >= self.block_size:
+            self._submit_(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def tell(self):
+        """number of uncompressed bytes written"""
+        return self.bytes_in
+
+    def flush(self):
+        """end the current block and write all pending blocks. Data written
+        after a flush starts a new independent block.
+
+        Returns
+        -------
+        int
+            number of compressed bytes written
+        """
+        if len(self.buffer) > 0:
+            self._submit_(bytes(self.buffer))
+            self.buffer = bytearray()
+        while len(self.pending) > 0:
+            self._write_next_()
+        self.fileobj.flush()
+        return self.bytes_out
+
+    def close(self):
+        """compress remaining data, finish writing, and close the file if
+        it was opened by the writer
+        """
+        if self.closed:
+            return
+        if len(self.buffer) > 0 or \
+                (self.blocks_written == 0 and len(self.pending) == 0):
+            self._submit_(bytes(self.buffer))
+            self.buffer = bytearray()
+        while len(self.pending) > 0:
+            self._write_next_()
+        self.executor.shutdown()
+        if self.owns_file:
+            self.fileobj.close()
+        else:
+            self.fileobj.flush()
+        self.closed = True
+
+
+class _CountingFile(object):
+    """Wraps a writable file object and counts the bytes written to it"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.bytes_out = 0
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.bytes_out += len(data)
+        return len(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+
+def _walk_items_(file_or_dir, name):
+    """List a file or directory, and its contents, in the order tarfile 
+    adds them
+
+    Parameters
+    ----------
+    file_or_dir: path
+    name: str
+        name of file_or_dir in archive
+
+    Returns
+    -------
+    list
+        list of (path, name in archive) tuples
+    """
+    items = [(file_or_dir, name)]
+    if os.path.isdir(file_or_dir) and not os.path.islink(file_or_dir):
+        for sub in sorted(os.listdir(file_or_dir)):
+            items += _walk_items_(
+                os.path.join(file_or_dir, sub), os.path.join(name, sub)
+            )
+    return items
+
 
+def _add_items_(tar, items, counter, callback=None, filter=None):
+    """Add items to an open tarball, optionally reporting progress after 
+    each entry
 
-def to_tarball(file_or_dir, archive_name, compresson='gz'):
+    Parameters
+    ----------
+    tar: tarfile.TarFile
+    items: list
+        list of (path, name in archive, recursive) tuples
+    counter: object
+        object with a bytes_out attribute counting compressed bytes written
+    callback: function, optional
+        called after each entry with a dict with keys 'name', 'bytes_read',
+        'bytes_written', 'ratio', 'elapsed', 'total_read', 'total_written',
+        and 'throughput' (bytes read per second). Compressors buffer data so
+        bytes written per entry is approximate.
+    filter: function, optional
+        passed to tarfile.TarFile.add
+    """
+    if callback is None:
+        for pth, name, recursive in items:
+            tar.add(pth, name, recursive, filter=filter)
+        return
+
+    expanded = []
+    for pth, name, recursive in items:
+        expanded += _walk_items_(pth, name) if recursive else [(pth, name)]
+
+    start = time.time()
+    total_read = 0
+    for pth, name in expanded:
+        entry_start = time.time()
+        written = counter.bytes_out
+        tar.add(pth, name, False, filter=filter)
+        bytes_read = os.path.getsize(pth) \
+            if os.path.isfile(pth) and not os.path.islink(pth) else 0
+        bytes_written = counter.bytes_out - written
+        total_read += bytes_read
+        elapsed = time.time() - start
+        callback({
+            'name': name,
+            'bytes_read': bytes_read,
+            'bytes_written': bytes_written,
+            'ratio': bytes_read / bytes_written if bytes_written else None,
+            'elapsed': time.time() - entry_start,
+            'total_read': total_read,
+            'total_written': counter.bytes_out,
+            'throughput': total_read / elapsed if elapsed else None,
+        })
+
+
+def _parallel_tarball_(writer, items, callback=None):
+    """Write items to a tarball with a ParallelCompressedWriter. The end of
+    archive marker is written as its own compressed block so more items can 
+    be appended later
+
+    Parameters
+    ----------
+    writer: ParallelCompressedWriter
+    items: list
+        list of (path, name in archive, recursive) tuples
+    callback: function, optional
+        progress callback see _add_items_
+
+    Returns
+    -------
+    int, list
+        compressed bytes written before the end of archive marker, and list
+        of (name, uncompressed data offset, size) for the files written
+    """
+    tar = tarfile.open(fileobj=writer, mode="w")
+    members = []
+    def record(tarinfo):
+        if tarinfo.isfile():
+            header = tarinfo.tobuf(tar.format, tar.encoding, tar.errors)
+            members.append(
+                (tarinfo.name, writer.tell() + len(header), tarinfo.size)
+            )
+        return tarinfo
+
+    _add_items_(tar, items, writer, callback, record)
+    trailer_offset = writer.flush()
+    tar.close()
+    return trailer_offset, members
+
+
+def to_tarball(
+        file_or_dir, archive_name, compresson='gz', threads=None, 
+        bufsize=tarfile.RECORDSIZE, callback=None
+    ):
     """add a file to a tarball archive
 
     Parameters
     ----------
     file_or_dir:
         path to compress
-    archive_name: path
-        path to output tarball
+    archive_name: path or file like object
+        path to output tarball, or a writable file object such as a pipe 
+        (i.e. sys.stdout.buffer or subprocess.Popen.stdin) that the archive 
+        is streamed to. File objects are not closed.
     copression: string optional, default 'gz'
-        compression type to use 
+        compression type to use. Any type supported by tarfile, or 'pgz' 
+        and 'pxz' for gzip or xz compressed in parallel blocks using 
+        ParallelCompressedWriter, or 'sgz' and 'sxz' for seekable gzip or xz
+        with an index of members for extract_member ('sgz' and 'sxz' require
+        a path).
+    threads: int, optional
+        number of threads used for 'pgz' and 'pxz', defaults to 
+        os.cpu_count()
+    bufsize: int, default tarfile.RECORDSIZE
+        output buffer size used by tarfile's stream mode
+    callback: function, optional
+        called after each entry is added with a dict of progress and 
+        throughput information, see _add_items_
+
+    Returns
+    -------
+    int or None
+        for 'pgz' and 'pxz' the compressed offset of the end of archive 
+        marker, which append_to_tarball uses. Otherwise None
     """
 
     file = os.path.split(file_or_dir)[1]
+    items = [(file_or_dir, file, True)]
+
+    if compresson in PARALLEL_COMPRESSION:
+        with ParallelCompressedWriter(
+                    archive_name, PARALLEL_COMPRESSION[compresson], threads
+                ) as writer:
+            return _parallel_tarball_(writer, items, callback)[0]
+
+    if compresson in SEEKABLE_COMPRESSION:
+        if type(archive_name) is not str:
+            raise ValueError('seekable tarballs must be written to a path')
+        with ParallelCompressedWriter(
+                    archive_name, SEEKABLE_COMPRESSION[compresson], threads,
+                    SEEKABLE_BLOCK_SIZE
+                ) as writer:
+            members = _parallel_tarball_(writer, items, callback)[1]
+        write_index(archive_name, writer.blocks, members, compresson)
+        return
+
+    owns_file = type(archive_name) is str
+    fileobj = open(archive_name, 'wb') if owns_file else archive_name
+    counter = _CountingFile(fileobj)
+    try:
+        with tarfile.open(
+                    fileobj=counter, mode="w|%s" % compresson, bufsize=bufsize
+                ) as tar:
+            _add_items_(tar, items, counter, callback)
+    finally:
+        if owns_file:
+            fileobj.close()
+
+
+def append_to_tarball(
+        archive_name, items, compresson='', trailer_offset=None, threads=None
+    ):
+    """Append files to an existing uncompressed tarball, or a 'pgz' or 'pxz'
+    tarball created by to_tarball
 
-    with tarfile.open(archive_name, "w:%s" % compresson) as tar:
-        tar.add(file_or_dir, file)
+    Parameters
+    ----------
+    archive_name: path
+        existing tarball
+    items: list
+        list of (path, name in archive) tuples to add, items are not added
+        recursively
+    copression: string optional, default ''
+        compression of archive, '', 'pgz', or 'pxz'
+    trailer_offset: int
+        required for 'pgz' and 'pxz', offset returned by to_tarball or 
+        append_to_tarball
+    threads: int, optional
+        number of threads used for 'pgz' and 'pxz'
+
+    Returns
+    -------
+    int or None
+        for 'pgz' and 'pxz' the new compressed offset of the end of archive 
+        marker. Otherwise None
+    """
+    if compresson == '':
+        with tarfile.open(archive_name, "a") as tar:
+            for pth, name in items:
+                tar.add(pth, name, False)
+        return None
+
+    if compresson not in PARALLEL_COMPRESSION or trailer_offset is None:
+        raise ValueError(
+            'Can only append to uncompressed tarballs, or %s tarballs with a'
+            ' known trailer offset' % ' and '.join(PARALLEL_COMPRESSION)
+        )
+
+    with open(archive_name, 'r+b') as fd:
+        fd.truncate(trailer_offset)
+        fd.seek(trailer_offset)
+        with ParallelCompressedWriter(
+                    fd, PARALLEL_COMPRESSION[compresson], threads
+                ) as writer:
+            written = _parallel_tarball_(
+                writer, [(pth, name, False) for pth, name in items]
+            )[0]
+    return trailer_offset + written
+
+
+def write_index(archive_name, blocks, members, compresson):
+    """save the index of a seekable tarball beside the tarball
 
+    Parameters
+    ----------
+    archive_name: path
+    blocks: list
+        list of [uncompressed offset, compressed offset] of each 
+        independently compressed block
+    members: list
+        list of (name, uncompressed data offset, size) for each file
+    compresson: str
+        'sgz' or 'sxz'
+    """
+    with open(archive_name + INDEX_EXT, 'w') as fd:
+        json.dump({
+            'compression': compresson,
+            'blocks': blocks,
+            'members': {
+                name: [offset, size] for name, offset, size in members
+            },
+        }, fd)
 
-def tarball_all_subdirecttories(
-        root, filter='*', outdir = None, outfile_tag = '', copression='gz',
-        verbose = False
+
+def _decompressor_(compression):
+    """create a decompressor for a single gzip member or xz stream"""
+    if compression == 'gz':
+        return zlib.decompressobj(wbits=31)
+    return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+
+
+def extract_member(archive_name, name, out_file=None, chunk_size=64 * 1024):
+    """Extract a single file from a seekable ('sgz' or 'sxz') tarball, 
+    only the compressed blocks containing the file are read
+
+    Parameters
+    ----------
+    archive_name: path
+        tarball created by to_tarball with 'sgz' or 'sxz' compression
+    name: str
+        name of member in the archive, i.e. 'dir/file.txt'
+    out_file: path, optional
+        if provided the member is written to this file
+    chunk_size: int, default 64 KiB
+        size of compressed reads
+
+    Raises
+    ------
+    KeyError: if name is not a file in the archive
+
+    Returns
+    -------
+    bytes or None
+        member contents if out_file is None
+    """
+    with open(archive_name + INDEX_EXT, 'r') as fd:
+        index = json.load(fd)
+    offset, size = index['members'][name]
+    compression = SEEKABLE_COMPRESSION[index['compression']]
+
+    starts = [block[0] for block in index['blocks']]
+    u_start, c_start = index['blocks'][bisect.bisect_right(starts, offset) - 1]
+    skip = offset - u_start
+
+    out = bytearray()
+    with open(archive_name, 'rb') as fd:
+        fd.seek(c_start)
+        decompressor = _decompressor_(compression)
+        while len(out) < size:
+            data = fd.read(chunk_size)
+            if not data:
+                break
+            while data:
+                chunk = decompressor.decompress(data)
+                if skip > 0:
+                    dropped = min(skip, len(chunk))
+                    chunk = chunk[dropped:]
+                    skip -= dropped
+                out += chunk[:size - len(out)]
+                if decompressor.eof:
+                    data = decompressor.unused_data
+                    decompressor = _decompressor_(compression)
+                else:
+                    data = b''
+
+    if len(out) != size:
+        raise EOFError('%s ended before %s was read' % (archive_name, name))
+    if out_file is None:
+        return bytes(out)
+    with open(out_file, 'wb') as fd:
+        fd.write(out)
+
+
+MANIFEST_EXT = '.manifest.json'
+
+def build_manifest(file_or_dir, hash_contents=False):
+    """Build a manifest of the files in a file or directory
+
+    Parameters
+    ----------
+    file_or_dir: path
+    hash_contents: bool, default False
+        if True the sha256 hash of each file is included
+
+    Returns
+    -------
+    dict
+        path relative to file_or_dir's parent: [size, mtime, hash or None]
+    """
+    parent, name = os.path.split(file_or_dir)
+    if os.path.isdir(file_or_dir):
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(file_or_dir):
+            paths += [os.path.join(dirpath, f) for f in filenames]
+    else:
+        paths = [file_or_dir]
+
+    manifest = {}
+    for pth in sorted(paths):
+        stat = os.lstat(pth)
+        digest = None
+        if hash_contents and os.path.isfile(pth) and not os.path.islink(pth):
+            sha = hashlib.sha256()
+            with open(pth, 'rb') as fd:
+                for chunk in iter(lambda: fd.read(1024 * 1024), b''):
+                    sha.update(chunk)
+            digest = sha.hexdigest()
+        manifest[os.path.relpath(pth, parent)] = \
+            [stat.st_size, stat.st_mtime, digest]
+    return manifest
+
+
+def read_manifest(archive_name):
+    """read the manifest saved beside a tarball
+
+    Parameters
+    ----------
+    archive_name: path
+
+    Returns
+    -------
+    dict or None
+        None if there is no manifest
+    """
+    try:
+        with open(archive_name + MANIFEST_EXT, 'r') as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(archive_name, source, entries, compresson, 
+        trailer_offset=None
     ):
-    """compress all of the subdirectories in a given directory in to individual
-    tarballs.
+    """save a manifest beside a tarball
 
     Parameters
     ----------
-    root: path
-        path to subdirectories to compress
-    filter: string optional default, '*' 
-        filter wild card for glob.glob used to construct list of files to 
-        compress
-    outdir: path optional, default none
-        If none save in current director
-    outfile_tag: string optional, default ''
-        tag for output files
+    archive_name: path
+    source: path
+        file or directory archived
+    entries: dict
+        as returned by build_manifest
+    compresson: str
+    trailer_offset: int, optional
+        see to_tarball
+    """
+    with open(archive_name + MANIFEST_EXT, 'w') as fd:
+        json.dump({
+            'source': source,
+            'compression': compresson,
+            'trailer_offset': trailer_offset,
+            'entries': entries,
+        }, fd)
+
+
+def incremental_tarball(
+        file_or_dir, archive_name, compresson='gz', hash_contents=False, 
+        threads=None
+    ):
+    """Create or update a tarball only if its contents have changed. A 
+    manifest of the archived files is saved beside the tarball. If the
+    manifest matches the current files nothing is done. If files have only
+    been added, and the tarball is uncompressed ('') or 'pgz' or 'pxz', the
+    new files are appended. Otherwise the tarball is recreated.
+
+    Parameters
+    ----------
+    file_or_dir:
+        path to compress
+    archive_name: path
+        path to output tarball
     copression: string optional, default 'gz'
-        compression type to use 
-    verbose: bool optional, default False
+        compression type to use see to_tarball
+    hash_contents: bool, default False
+        if True compare file hashes as well as sizes and modification times
+    threads: int, optional
+        number of threads used for 'pgz' and 'pxz'
+
+    Returns
+    -------
+    str, int
+        action taken ('skipped', 'appended', or 'created') and the number of
+        bytes archived
+    """
+    current = build_manifest(file_or_dir, hash_contents)
+    old = read_manifest(archive_name) if os.path.exists(archive_name) \
+        else None
+
+    if old is not None and old['compression'] == compresson and \
+            old['source'] == file_or_dir:
+        entries = old['entries']
+        if entries == current:
+            return 'skipped', 0
+
+        unchanged = all(
+            key in current and current[key] == entries[key] for key in entries
+        )
+        appendable = compresson == '' or old['trailer_offset'] is not None
+        if unchanged and appendable:
+            parent = os.path.split(file_or_dir)[0]
+            new = [key for key in current if key not in entries]
+            trailer_offset = append_to_tarball(
+                archive_name, [(os.path.join(parent, key), key) for key in new],
+                compresson, old['trailer_offset'], threads
+            )
+            write_manifest(
+                archive_name, file_or_dir, current, compresson, trailer_offset
+            )
+            return 'appended', sum(current[key][0] for key in new)
+
+    trailer_offset = to_tarball(file_or_dir, archive_name, compresson, threads)
+    write_manifest(
+        archive_name, file_or_dir, current, compresson, trailer_offset
+    )
+    return 'created', sum(current[key][0] for key in current)
+
+
+def get_size(path):
+    """get the size of a file, or the total size of all files in a directory
+
+    Parameters
+    ----------
+    path: path
 
+    Returns
+    -------
+    int 
+        size in bytes
     """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            fp = os.path.join(dirpath, name)
+            if not os.path.islink(fp):
+                total += os.path.getsize(fp)
+    return total
 
-    if outdir is None:
-        outdir = root
 
-    ext = '.tar.%s' % copression
+def _tarball_job_(args):
+    """Compress a single file or directory and summarize the result, used by
+    _tarball_helper_
 
-    
-    root = os.path.join(root,filter)
-    
-    files = glob.glob(root)
-    
-    outfile_tag = ('%s-' % outfile_tag) if outfile_tag != '' else '' 
-    for pth in files:
-        # print(pth)
-        if not os.path.isdir(pth):
-            continue
+    Parameters
+    ----------
+    args: tuple
+        (path to compress, output tarball, compression type, incremental, 
+        hash_contents)
+
+    Returns
+    -------
+    dict
+        summary with keys 'source', 'archive', 'action', 'bytes_in', 
+        'bytes_out', and 'elapsed' (seconds)
+    """
+    pth, tar, copression, incremental, hash_contents = args
+    start = time.time()
+    if incremental:
+        action, bytes_in = incremental_tarball(
+            pth, tar, copression, hash_contents
+        )
+    else:
+        ## bytes in are totaled as files are added, instead of walking pth
+        ## again afterwards
+        progress = {'total_read': 0}
+        to_tarball(pth, tar, copression, callback=progress.update)
+        action, bytes_in = 'created', progress['total_read']
+    elapsed = time.time() - start
+    return {
+        'source': pth,
+        'archive': tar,
+        'action': action,
+        'bytes_in': bytes_in,
+        'bytes_out': os.path.getsize(tar),
+        'elapsed': elapsed,
+    }
 
-        name = os.path.split(pth)[1]
-        tar = os.path.join(outdir, '%s%s%s' % (outfile_tag, name, ext))
-        if verbose:
-            print('Compressing %s -> %s' % (pth, tar))
- 
-        to_tarball(pth, tar)
 
 def _tarball_helper_(filter_func, root, 
         filter='*', outdir = None, outfile_tag = '', copression='gz',
-        verbose = False ):
+        verbose = False, workers = 1, incremental = False, 
+        hash_contents = False ):
     """abstraction of common code for fillter_all_subdirectories, 
     and fileter_all_files. 
 
@@ -98,33 +742,66 @@ def _tarball_helper_(filter_func, root,
     copression: string optional, default 'gz'
         compression type to use 
     verbose: bool optional, default False
-
+    workers: int optional, default 1
+        number of processes to use. When greater than 1, the largest 
+        entries are compressed first.
+    incremental: bool optional, default False
+        if True only archive entries that have changed, see 
+        incremental_tarball
+    hash_contents: bool optional, default False
+        if True incremental mode compares file hashes
+
+    Returns
+    -------
+    list
+        list of dicts summarizing each archive, see _tarball_job_
     """
     if outdir is None:
         outdir = root
 
-    ext = '.tar.%s' % copression
+    ext = '.tar.%s' % PARALLEL_COMPRESSION.get(
+        copression, SEEKABLE_COMPRESSION.get(copression, copression)
+    )
+    if copression == '':
+        ext = '.tar'
 
     root = os.path.join(root,filter)
     
     files = glob.glob(root)
     
     outfile_tag = ('%s-' % outfile_tag) if outfile_tag != '' else '' 
+    jobs = []
     for pth in files:
-        if not filter_func(pth):
+        if not filter_func(pth) or pth.endswith((MANIFEST_EXT, INDEX_EXT)):
             continue
 
         name = os.path.split(pth)[1]
         tar = os.path.join(outdir, '%s%s%s' % (outfile_tag, name, ext))
+        jobs.append((pth, tar, copression, incremental, hash_contents))
+
+    if workers > 1:
+        jobs.sort(key=lambda job: get_size(job[0]), reverse=True)
+
+    summary = []
+    if workers > 1 and len(jobs) > 1:
         if verbose:
-            print('Compressing %s -> %s' % (pth, tar))
- 
-        to_tarball(pth, tar)
+            for pth, tar, *_ in jobs:
+                print('Compressing %s -> %s' % (pth, tar))
+        with Pool(min(workers, len(jobs))) as pool:
+            summary = pool.map(_tarball_job_, jobs, chunksize=1)
+    else:
+        for job in jobs:
+            if verbose:
+                print('Compressing %s -> %s' % job[:2])
+            summary.append(_tarball_job_(job))
+
+    return summary
     
 
 def tarball_all_subfiles(
         root, filter='*', outdir = None, outfile_tag = '', copression='gz',
-        verbose = False
+        verbose = False, workers = 1, incremental = False, 
+        hash_contents = False
     ):
     """compress all of the sub-files in a given directory in to individual
     tarballs.
@@ -143,16 +820,30 @@ def tarball_all_subfiles(
     copression: string optional, default 'gz'
         compression type to use 
     verbose: bool optional, default False
-
+    workers: int optional, default 1
+        number of processes to use
+    incremental: bool optional, default False
+        if True only archive entries that have changed, see 
+        incremental_tarball
+    hash_contents: bool optional, default False
+        if True incremental mode compares file hashes
+
+    Returns
+    -------
+    list
+        list of dicts summarizing each archive, with keys 'source', 
+        'archive', 'bytes_in', 'bytes_out', and 'elapsed' (seconds)
     """
-    _tarball_helper_(
-        os.path.isfile, root, filter, outdir , outfile_tag, copression, verbose 
+    return _tarball_helper_(
+        os.path.isfile, root, filter, outdir , outfile_tag, copression, 
+        verbose, workers, incremental, hash_contents
     )
 
 
 def tarball_all_subdirecttories(
         root, filter='*', outdir = None, outfile_tag = '', copression='gz',
-        verbose = False
+        verbose = False, workers = 1, incremental = False, 
+        hash_contents = False
     ):
     """compress all of the subdirectories in a given directory in to individual
     tarballs.
@@ -171,16 +862,30 @@ def tarball_all_subdirecttories(
     copression: string optional, default 'gz'
         compression type to use 
     verbose: bool optional, default False
-
+    workers: int optional, default 1
+        number of processes to use
+    incremental: bool optional, default False
+        if True only archive entries that have changed, see 
+        incremental_tarball
+    hash_contents: bool optional, default False
+        if True incremental mode compares file hashes
+
+    Returns
+    -------
+    list
+        list of dicts summarizing each archive, with keys 'source', 
+        'archive', 'bytes_in', 'bytes_out', and 'elapsed' (seconds)
     """
-    _tarball_helper_(
-        os.path.isdir, root, filter, outdir , outfile_tag, copression, verbose 
+    return _tarball_helper_(
+        os.path.isdir, root, filter, outdir , outfile_tag, copression, 
+        verbose, workers, incremental, hash_contents
     )
 
 
 def tarball_all(
         root, filter='*', outdir = None, outfile_tag = '', copression='gz',
-        verbose = False
+        verbose = False, workers = 1, incremental = False, 
+        hash_contents = False
     ):
     """compress all of the sub-files in a given directory in to individual
     tarballs.
@@ -199,13 +904,40 @@ def tarball_all(
     copression: string optional, default 'gz'
         compression type to use 
     verbose: bool optional, default False
-
+    workers: int optional, default 1
+        number of processes to use. Directories and files are scheduled 
+        together, largest first.
+    incremental: bool optional, default False
+        if True only archive entries that have changed, see 
+        incremental_tarball
+    hash_contents: bool optional, default False
+        if True incremental mode compares file hashes
+
+    Returns
+    -------
+    list
+        list of dicts summarizing each archive, with keys 'source', 
+        'archive', 'bytes_in', 'bytes_out', and 'elapsed' (seconds)
     """
+    if workers > 1:
+        if verbose:
+            print("Adding directories and files to tarball...")
+        return _tarball_helper_(
+            lambda pth: os.path.isdir(pth) or os.path.isfile(pth), 
+            root, filter, outdir, outfile_tag, copression, verbose, workers,
+            incremental, hash_contents
+        )
+
     if verbose:
         print("Adding directories to tarball...")
-    tarball_all_subdirecttories(
-        root, filter, outdir, outfile_tag, copression, verbose
+    summary = tarball_all_subdirecttories(
+        root, filter, outdir, outfile_tag, copression, verbose, 1, 
+        incremental, hash_contents
     )
     if verbose:
         print("Adding files to tarball...")
-    tarball_all_subfiles(root, filter, outdir, outfile_tag, copression, verbose)
+    summary += tarball_all_subfiles(
+        root, filter, outdir, outfile_tag, copression, verbose, 1,
+        incremental, hash_contents
+    )
+    return summary
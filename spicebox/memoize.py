@@ -0,0 +1,392 @@
+"""
+Memoize
+-------
+
+Cache of raster operation outputs keyed by fingerprints of the input files
+and options, so repeated runs with unchanged inputs copy a cached output
+instead of recomputing it.
+
+"""
+import os
+import json
+import glob
+import time
+import shutil
+import hashlib
+import tempfile
+
+from osgeo import gdal
+
+from . import raster
+from . import __version__
+
+## bytes read from each sampled location when hashing file contents
+SAMPLE_SIZE = 64 * 1024
+
+## file with fingerprint and output information in each cache entry
+ENTRY_FILE = 'entry.json'
+
+## keyword arguments that do not change results and are not fingerprinted
+IGNORED_OPTIONS = ['pool', 'tile_cache', 'verbose']
+
+
+def fingerprint_file(path, samples=0):
+    """Fingerprint a file by path, size, and modification time, and
+    optionally a hash of sampled blocks of its contents. Shapefiles include
+    files with the same name and other extensions, and directories (i.e. 
+    file geodatabases) include all files in them
+
+    Parameters
+    ----------
+    path: path
+    samples: int, default 0
+        number of evenly spaced blocks of SAMPLE_SIZE bytes to hash, the
+        whole file is hashed if it is smaller than samples * SAMPLE_SIZE
+
+    Returns
+    -------
+    list or None
+        [[path, size, mtime, hash or None], ...], None if path does not
+        exist
+    """
+    if not os.path.exists(path):
+        return None
+    path = os.path.abspath(path)
+    if os.path.isdir(path):
+        files = sorted(
+            os.path.join(dirpath, name)
+                for dirpath, dirnames, names in os.walk(path)
+                    for name in names
+        )
+    elif os.path.splitext(path)[1].lower() == '.shp':
+        stem = glob.escape(os.path.splitext(path)[0])
+        files = sorted(set([path] + glob.glob(stem + '.*')))
+    else:
+        files = [path]
+
+    fingerprint = []
+    for name in files:
+        stat = os.stat(name)
+        digest = None
+        if samples > 0:
+            sha = hashlib.sha1()
+            with open(name, 'rb') as fd:
+                if stat.st_size <= samples * SAMPLE_SIZE:
+                    sha.update(fd.read())
+                else:
+                    step = (stat.st_size - SAMPLE_SIZE) // max(1, samples - 1)
+                    for idx in range(samples):
+                        fd.seek(idx * step)
+                        sha.update(fd.read(SAMPLE_SIZE))
+            digest = sha.hexdigest()
+        fingerprint.append([name, stat.st_size, stat.st_mtime, digest])
+    return fingerprint
+
+
+class MemoCache(object):
+    """Content addressed cache of raster operation outputs.
+
+    Each call is keyed by a hash of the function name, spicebox version,
+    input and vector file fingerprints, and options. On a hit the cached
+    output is copied to the requested output path, so later edits of the 
+    output do not change the cache. Entries
+    are evicted by age and total size, least recently used first.
+
+    Example
+    -------
+    >>> memo = MemoCache('/tmp/spicebox_memo', max_bytes=20 * 1024**3)
+    >>> memo.clip_raster('in.tif', 'clipped.tif', (x0, y1, x1, y0))
+    >>> memo.stats()
+    """
+
+    def __init__(self, cache_dir, max_bytes=None, max_age=None, samples=0,
+            enabled=True
+        ):
+        """
+        Parameters
+        ----------
+        cache_dir: path
+            cache directory, created if needed
+        max_bytes: int, optional
+            size budget, checked after each new entry
+        max_age: float, optional
+            seconds since last use after which entries are evicted
+        samples: int, default 0
+            number of sampled blocks hashed when fingerprinting inputs, see
+            fingerprint_file
+        enabled: bool, default True
+            if False all calls bypass the cache
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.samples = samples
+        self.enabled = enabled
+        os.makedirs(cache_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def key(self, func, in_raster, args, kwargs, vectors=[], 
+            out_raster=None
+        ):
+        """Get cache key of a call
+
+        Parameters
+        ----------
+        func: function
+        in_raster: path or gdal.Dataset
+        args: list
+            positional arguments after in_raster and out_raster
+        kwargs: dict
+            keyword arguments
+        vectors: list
+            vector files used by call
+        out_raster: path, optional
+            output of call, its extension is part of the key as gdal picks
+            the output driver from it
+
+        Returns
+        -------
+        str or None
+            None if an input cannot be fingerprinted
+        """
+        if type(in_raster) is not str:
+            in_raster = in_raster.GetDescription()
+        inputs = [fingerprint_file(in_raster, self.samples)] + \
+            [fingerprint_file(vector, self.samples) for vector in vectors]
+        if None in inputs:
+            return None
+        options = {
+            k: v for k, v in kwargs.items() if k not in IGNORED_OPTIONS
+        }
+        description = json.dumps({
+            'function': func.__module__ + '.' + func.__name__,
+            'version': __version__,
+            'inputs': inputs,
+            'args': args,
+            'options': options,
+            'output_extension': None if out_raster is None else \
+                os.path.splitext(out_raster)[1].lower(),
+        }, sort_keys=True, default=repr)
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    def _entry(self, key):
+        """entry directory for key"""
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    @staticmethod
+    def _copy_outputs(src_dir, src_name, out_raster):
+        """copy an output and its sidecar files (i.e. .aux.xml) from 
+        src_dir to out_raster. Files are not hard linked, a linked output 
+        edited in place would change the cache entry
+        """
+        out_dir = os.path.dirname(os.path.abspath(out_raster))
+        out_name = os.path.basename(out_raster)
+        for name in os.listdir(src_dir):
+            if not name.startswith(src_name):
+                continue
+            target = os.path.join(out_dir, out_name + name[len(src_name):])
+            if os.path.exists(target):
+                ## writing through an existing hard link changes its target
+                os.remove(target)
+            shutil.copyfile(os.path.join(src_dir, name), target)
+
+    def call(self, func, in_raster, out_raster, *args, vectors=[],
+            bypass=False, **kwargs
+        ):
+        """Call func(in_raster, out_raster, *args, **kwargs) through the
+        cache
+
+        Parameters
+        ----------
+        func: function
+            raster function that writes its output to its second argument
+        in_raster: path or gdal.Dataset
+        out_raster: path
+        *args:
+            other positional arguments for func
+        vectors: list
+            vector files used by func, included in fingerprint
+        bypass: bool, default False
+            if True call func directly. VRT outputs are never cached, as 
+            they refer to their sources by relative paths
+        **kwargs:
+            keyword arguments for func
+
+        Returns
+        -------
+        return value of func, gdal.Datasets are reopened from out_raster
+        """
+        key = None
+        is_vrt = os.path.splitext(out_raster)[1].lower() == '.vrt' or \
+            str(kwargs.get('format', '')).upper() == 'VRT'
+        if self.enabled and not bypass and not is_vrt:
+            key = self.key(
+                func, in_raster, args, kwargs, vectors, out_raster
+            )
+        if key is None:
+            self.bypassed += 1
+            return func(in_raster, out_raster, *args, **kwargs)
+
+        entry = self._entry(key)
+        info_file = os.path.join(entry, ENTRY_FILE)
+        try:
+            with open(info_file, 'r') as fd:
+                info = json.load(fd)
+            self._copy_outputs(entry, info['output'], out_raster)
+            os.utime(info_file)
+        except (OSError, ValueError): 
+            ## no entry, or it was evicted by another process while copying
+            pass
+        else:
+            self.hits += 1
+            return gdal.Open(out_raster) if info['dataset'] \
+                else info['result']
+
+        self.misses += 1
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        work_dir = tempfile.mkdtemp(dir=os.path.dirname(entry))
+        name = os.path.basename(out_raster)
+        try:
+            work_out = os.path.join(work_dir, name)
+            result = func(in_raster, work_out, *args, **kwargs)
+            is_dataset = isinstance(result, gdal.Dataset)
+            if is_dataset:
+                result.FlushCache()
+                result = None ## close before moving
+            if not os.path.exists(work_out): ## failed, nothing to cache
+                shutil.rmtree(work_dir, ignore_errors=True)
+                return None if is_dataset else result
+            info = {
+                'output': name, 'dataset': is_dataset, 'result': result,
+                'created': time.time(),
+                'bytes': sum(
+                    os.path.getsize(os.path.join(work_dir, f))
+                        for f in os.listdir(work_dir)
+                ),
+            }
+            with open(os.path.join(work_dir, ENTRY_FILE), 'w') as fd:
+                json.dump(info, fd, default=repr)
+            ## copy before the entry is visible to other processes' evict
+            self._copy_outputs(work_dir, name, out_raster)
+            try:
+                os.rename(work_dir, entry)
+            except OSError: ## another process added the entry
+                pass
+        finally:
+            if os.path.exists(work_dir):
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+        self.evict()
+        return gdal.Open(out_raster) if is_dataset else result
+
+    def _entries(self):
+        """(last used time, bytes, entry directory) of entries"""
+        entries = []
+        for info_file in glob.glob(
+                os.path.join(self.cache_dir, '*', '*', ENTRY_FILE)
+            ):
+            try:
+                with open(info_file, 'r') as fd:
+                    size = json.load(fd)['bytes']
+                entries.append(
+                    (os.stat(info_file).st_mtime, size,
+                        os.path.dirname(info_file))
+                )
+            except (OSError, ValueError, KeyError):
+                continue
+        return entries
+
+    def evict(self, max_bytes=None, max_age=None):
+        """Remove entries older than max_age, then least recently used
+        entries until the cache is smaller than max_bytes
+
+        Parameters
+        ----------
+        max_bytes: int, optional
+            defaults to max_bytes of cache, if both are None size is not
+            limited
+        max_age: float, optional
+            seconds, defaults to max_age of cache, if both are None age is
+            not limited
+
+        Returns
+        -------
+        int
+            number of entries removed
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        max_age = self.max_age if max_age is None else max_age
+        if max_bytes is None and max_age is None:
+            return 0
+        entries = sorted(self._entries())
+        total = sum(size for used, size, entry in entries)
+        now = time.time()
+        removed = 0
+        for used, size, entry in entries:
+            too_old = max_age is not None and now - used > max_age
+            too_big = max_bytes is not None and total > max_bytes
+            if not (too_old or too_big):
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        """Remove all entries"""
+        self.evict(max_bytes=0)
+
+    def stats(self):
+        """Get cache counters for this process
+
+        Returns
+        -------
+        dict
+            'hits', 'misses', 'bypassed', 'entries', and 'bytes'
+        """
+        entries = self._entries()
+        return {
+            'hits': self.hits, 'misses': self.misses,
+            'bypassed': self.bypassed, 'entries': len(entries),
+            'bytes': sum(size for used, size, entry in entries),
+        }
+
+    def clip_raster(self, in_raster, out_raster, *args, bypass=False,
+            **kwargs
+        ):
+        """raster.clip_raster through the cache, see raster.clip_raster"""
+        return self.call(
+            raster.clip_raster, in_raster, out_raster, *args,
+            bypass=bypass, **kwargs
+        )
+
+    def clip_polygon_raster(self, in_raster, out_raster, vector,
+            bypass=False, **warp_options
+        ):
+        """raster.clip_polygon_raster through the cache, see
+        raster.clip_polygon_raster
+        """
+        return self.call(
+            raster.clip_polygon_raster, in_raster, out_raster, vector,
+            vectors=[vector], bypass=bypass, **warp_options
+        )
+
+    def reproject(self, in_img, out_img, *args, bypass=False, **kwargs):
+        """raster.reproject through the cache, see raster.reproject"""
+        return self.call(
+            raster.reproject, in_img, out_img, *args,
+            bypass=bypass, **kwargs
+        )
+
+    def rescale_raster(self, in_raster, out_raster, *args, bypass=False,
+            **kwargs
+        ):
+        """raster.rescale_raster through the cache, see
+        raster.rescale_raster
+        """
+        return self.call(
+            raster.rescale_raster, in_raster, out_raster, *args,
+            bypass=bypass, **kwargs
+        )
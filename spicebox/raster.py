@@ -3,9 +3,13 @@ raster
 ------
 Input Output operations for rasters
 """
-from osgeo import gdal, gdal_array
+from osgeo import gdal, gdal_array, osr
+import os
 import numpy as np
 import subprocess
+import ast
+import json
+from multiprocessing import Pool
 
 ROW, COL = 0,1
 import math
@@ -13,6 +17,7 @@ import math
 import matplotlib.pyplot as plt
 
 from . import transforms
+from . import datasets
 
 from collections import namedtuple
 OLD_STYLE_RASTER_METADATA = namedtuple('RASTER_METADATA', 
@@ -41,7 +46,9 @@ def gdal_type_lookup (item):
 
     return gdal_array.GDALTypeCodeToNumericTypeCode(dtype.type)
 
-def load_raster (filename,  return_dataset = False, band = 1, mode=gdal.GA_ReadOnly):
+def load_raster (filename,  return_dataset = False, band = 1, mode=gdal.GA_ReadOnly,
+        pool = None, tile_cache = None
+    ):
     """Load a raster file and it's metadata
     
     Parameters
@@ -50,6 +57,12 @@ def load_raster (filename,  return_dataset = False, band = 1, mode=gdal.GA_ReadO
         path to raster file to read
     return_dataset: bool
         if true return gdal.dataset
+    pool: datasets.DatasetPool or bool, optional
+        if given the dataset is taken from the pool (True for 
+        datasets.DEFAULT_POOL) instead of being opened. Pooled datasets
+        should not be closed
+    tile_cache: tilecache.TileCache, optional
+        if given data is read through the cache of decoded blocks
         
     Returns 
     -------
@@ -60,7 +73,11 @@ def load_raster (filename,  return_dataset = False, band = 1, mode=gdal.GA_ReadO
     RASTER_METADATA
         metadata on raster file read
     """
-    dataset = gdal.Open(filename, mode)
+    pool = datasets.get_pool(pool)
+    if pool is None:
+        dataset = gdal.Open(filename, mode)
+    else:
+        dataset = pool.get(filename, mode)
     # (X, deltaX, rotation, Y, rotation, deltaY) = dataset.GetGeoTransform()
     if return_dataset:
         return dataset
@@ -72,9 +89,92 @@ def load_raster (filename,  return_dataset = False, band = 1, mode=gdal.GA_ReadO
         'y_size': dataset.RasterYSize,
     }
 
-    data = dataset.GetRasterBand(band).ReadAsArray()
+    data = read_window(
+        dataset, 0, 0, dataset.RasterXSize, dataset.RasterYSize, band, 
+        tile_cache
+    )
     return data, metadata
 
+def read_window(dataset, xoff, yoff, xsize, ysize, band=1, tile_cache=None):
+    """Read a window of a band, optionally through a cache of decoded blocks
+
+    Parameters
+    ----------
+    dataset: gdal.Dataset
+    xoff: int
+    yoff: int
+        window offset in pixels
+    xsize: int
+    ysize: int
+        window size in pixels
+    band: int, default 1
+    tile_cache: tilecache.TileCache, optional
+        if given, blocks are read from the cache, and blocks not in the 
+        cache are read and added to it. Only pass datasets opened read 
+        only, see tilecache.TileCache.source_id
+
+    Returns
+    -------
+    np.array
+    """
+    if tile_cache is None:
+        return dataset.GetRasterBand(band).ReadAsArray(
+            xoff, yoff, xsize, ysize
+        )
+    return tile_cache.read_window(dataset, band, xoff, yoff, xsize, ysize)
+
+def sample_points(raster, points, band=1, no_data=np.nan, pool=None,
+        tile_cache=None
+    ):
+    """Get the values of a band at points. Points in the same block are
+    read together
+
+    Parameters
+    ----------
+    raster: path or gdal.Dataset
+    points: list like
+        (x, y) or list of (x, y) coordinates in the rasters projection
+    band: int, default 1
+    no_data: number, default np.nan
+        value for points outside of the raster
+    pool: datasets.DatasetPool or bool, optional
+        pool to get dataset from, see load_raster
+    tile_cache: tilecache.TileCache, optional
+        cache of decoded blocks, see read_window
+
+    Returns
+    -------
+    np.array
+        values at points
+    """
+    ds = load_raster(raster, True, pool=pool) if type(raster) is str \
+        else raster
+    rb = ds.GetRasterBand(band)
+    points = np.atleast_2d(np.asarray(points, dtype=float))
+    pixels = np.floor(
+        transforms.to_pixel(points, ds.GetGeoTransform())
+    ).astype(np.int64).reshape(-1, 2)
+    rows, cols = pixels[:, ROW], pixels[:, COL]
+    values = np.full(len(pixels), no_data, dtype=np.float64)
+    inside = (rows >= 0) & (rows < ds.RasterYSize) & \
+        (cols >= 0) & (cols < ds.RasterXSize)
+
+    block_x, block_y = rb.GetBlockSize()
+    block_ids = (rows // block_y) * math.ceil(ds.RasterXSize / block_x) + \
+        cols // block_x
+    for block_id in np.unique(block_ids[inside]):
+        selected = inside & (block_ids == block_id)
+        yoff = rows[selected][0] // block_y * block_y
+        xoff = cols[selected][0] // block_x * block_x
+        data = read_window(
+            ds, xoff, yoff, 
+            min(block_x, ds.RasterXSize - xoff), 
+            min(block_y, ds.RasterYSize - yoff),
+            band, tile_cache
+        )
+        values[selected] = data[rows[selected] - yoff, cols[selected] - xoff]
+    return values
+
 def save_raster(filename, data, transform, projection, 
     datatype = gdal.GDT_Float32):
     """Function Docs 
@@ -108,7 +208,9 @@ def create_raster(filename, data, transform, projection,
         no_data = None,
         color_dict = None,
         metadata = {},
-        verbose = False
+        verbose = False,
+        cog = False,
+        cog_options = None
     ):
     """Create a raster data set from an array and metadata
 
@@ -133,20 +235,24 @@ def create_raster(filename, data, transform, projection,
         dict of metadata key value pairs to write to raster metadata
     verbose: bool
         messages may be written to console if true
+    cog: bool, default False
+        if True write a Cloud Optimized GeoTIFF (see to_cog)
+    cog_options: list, optional
+        COG creation options, defaults to COG_CREATION_OPTIONS
 
     Returns
     -------
     gdal raster dateset
     """
-    write_driver = gdal.GetDriverByName('GTiff') 
+    write_driver = gdal.GetDriverByName('MEM' if cog else 'GTiff') 
 
-    if len(data.shape) == 3
+    if len(data.shape) == 3:
         cols, rows, bands = data.shape[2], data.shape[1], data.shape[0]
     else:
         cols, rows, bands = data.shape[1], data.shape[0], 1
 
     raster = write_driver.Create(
-        filename, cols, rows, bands, datatype
+        '' if cog else filename, cols, rows, bands, datatype
     )
 
     raster.SetGeoTransform(transform) 
@@ -154,22 +260,203 @@ def create_raster(filename, data, transform, projection,
 
     for band in range(bands): 
         outband = raster.GetRasterBand(band + 1) # +1 for gdal 1 base index  
-        outband.WriteArray(data['band']) 
-        if band == 0 and no_data:
+        outband.WriteArray(data[band] if len(data.shape) == 3 else data) 
+        if band == 0 and no_data is not None:
             outband.SetNoDataValue(no_data)
         outband.FlushCache()  
         del(outband)
 
     for key in metadata:
-        set_metadata_item(raster, key, metadata['key'], verbose)
+        set_metadata_item(raster, key, metadata[key], verbose)
 
     if color_dict: 
         set_band_color_descriptions(raster, color_dict, verbose)
     
+    if cog:
+        return to_cog(raster, filename, cog_options)
     
     raster.FlushCache()   
     return raster
 
+def create_empty_raster(filename, x_size, y_size, transform, projection, 
+        bands = 1,
+        datatype = gdal.GDT_Float32,
+        no_data = None,
+        creation_options = ['TILED=YES', 'COMPRESS=LZW', 'BIGTIFF=IF_SAFER']
+    ):
+    """Create an empty GeoTIFF to be written block by block
+
+    Parameters
+    ----------
+    filename: path
+        path to file to save
+    x_size: int
+    y_size: int
+        size in pixels
+    transform: tuple
+        (origin X, X resolution, 0, origin Y, 0, Y resolution) 
+    projection: string
+        SRS projection in WTK format
+    bands: int, default 1
+    datatype:
+        Gdal data type
+    no_data:
+        no data value, set for all bands
+    creation_options: list
+        GTiff creation options 
+
+    Returns
+    -------
+    gdal raster dateset
+    """
+    write_driver = gdal.GetDriverByName('GTiff') 
+    raster = write_driver.Create(
+        filename, x_size, y_size, bands, datatype, options=creation_options
+    )
+    raster.SetGeoTransform(transform) 
+    raster.SetProjection(projection) 
+    if no_data is not None:
+        for band in range(1, bands + 1):
+            raster.GetRasterBand(band).SetNoDataValue(no_data)
+    return raster
+
+## Cloud Optimized GeoTIFF creation options. PREDICTOR=YES picks horizontal
+## differencing for integer and floating point predictor for float data
+COG_CREATION_OPTIONS = [
+    'COMPRESS=DEFLATE', 'PREDICTOR=YES', 'BLOCKSIZE=512', 
+    'OVERVIEWS=IGNORE_EXISTING', 'RESAMPLING=AVERAGE', 'BIGTIFF=IF_SAFER',
+    'NUM_THREADS=ALL_CPUS'
+]
+
+def to_cog(in_raster, out_raster, creation_options=None):
+    """Copy a raster to a Cloud Optimized GeoTIFF (tiled, compressed, with
+    internal overviews, and the COG layout where headers and overviews 
+    come before full resolution tiles). Requires GDAL >= 3.1
+
+    Parameters
+    ----------
+    in_raster: path or gdal.Dataset
+    out_raster: path
+    creation_options: list, optional
+        COG driver creation options, defaults to COG_CREATION_OPTIONS
+
+    Returns
+    -------
+    gdal.Dataset
+    """
+    if creation_options is None:
+        creation_options = COG_CREATION_OPTIONS
+    if type(in_raster) is str:
+        in_raster = load_raster(in_raster, True)
+    driver = gdal.GetDriverByName('COG')
+    if driver is None:
+        raise RuntimeError('COG driver requires GDAL >= 3.1')
+    cog = driver.CreateCopy(out_raster, in_raster, options=creation_options)
+    cog.FlushCache()
+    return cog
+
+
+def _block_offsets(band, full_check=True):
+    """offsets of a bands tiles in row major order, sparse tiles (offset 0)
+    are skipped. If full_check is False only the first and last tiles are
+    checked
+    """
+    block_x, block_y = band.GetBlockSize()
+    n_x = math.ceil(band.XSize / block_x)
+    n_y = math.ceil(band.YSize / block_y)
+    if full_check:
+        blocks = [(x, y) for y in range(n_y) for x in range(n_x)]
+    else:
+        blocks = [(0, 0), (n_x - 1, n_y - 1)]
+    offsets = []
+    for x, y in blocks:
+        offset = band.GetMetadataItem('BLOCK_OFFSET_%i_%i' % (x, y), 'TIFF')
+        if offset is not None and int(offset) > 0:
+            offsets.append(int(offset))
+    return offsets
+
+
+def validate_cog(filename, full_check=True):
+    """Check that a GeoTIFF has the Cloud Optimized GeoTIFF layout: tiled,
+    with overviews if larger than 512 pixels, image headers (IFDs) before
+    tile data and ordered from full resolution to smallest overview, tile 
+    data ordered from smallest overview to full resolution, and tiles 
+    ordered by row then column within each level
+
+    Parameters
+    ----------
+    filename: path
+    full_check: bool, default True
+        if True check the offsets of every tile, otherwise only the first
+        and last tiles of each level
+
+    Returns
+    -------
+    tuple
+        (list of warnings, list of errors), the file is a valid COG if the
+        list of errors is empty
+    """
+    warning_list, errors = [], []
+    ds = gdal.OpenEx(filename, gdal.OF_RASTER, allowed_drivers=['GTiff'])
+    if ds is None:
+        return warning_list, ['%s is not a GeoTIFF' % filename]
+
+    band = ds.GetRasterBand(1)
+    block_x, block_y = band.GetBlockSize()
+    if block_x == ds.RasterXSize and ds.RasterXSize > 512:
+        errors.append('file is not tiled')
+    if band.GetOverviewCount() == 0 and \
+            max(ds.RasterXSize, ds.RasterYSize) > 512:
+        warning_list.append(
+            'file is larger than 512 pixels and has no internal overviews'
+        )
+    if ds.GetMetadataItem('LAYOUT', 'IMAGE_STRUCTURE') not in (None, 'COG'):
+        warning_list.append('LAYOUT metadata is not COG')
+
+    levels = [band] + [
+        band.GetOverview(idx) for idx in range(band.GetOverviewCount())
+    ]
+    ifd_offsets = [
+        int(level.GetMetadataItem('IFD_OFFSET', 'TIFF') or 0) 
+            for level in levels
+    ]
+    if ifd_offsets[0] > 16 * 1024:
+        errors.append(
+            'main image header is at %i, not at the start of the file' % 
+            ifd_offsets[0]
+        )
+    for idx in range(1, len(ifd_offsets)):
+        if ifd_offsets[idx] < ifd_offsets[idx - 1]:
+            errors.append(
+                'header of overview %i is before header of %s' % (
+                    idx - 1, 
+                    'main image' if idx == 1 else 'overview %i' % (idx - 2)
+                )
+            )
+
+    first_data = {}
+    for idx, level in enumerate(levels):
+        name = 'main image' if idx == 0 else 'overview %i' % (idx - 1)
+        offsets = _block_offsets(level, full_check)
+        if len(offsets) == 0:
+            continue
+        if offsets[0] < max(ifd_offsets):
+            errors.append('%s tile data is before image headers' % name)
+        if any(b < a for a, b in zip(offsets[:-1], offsets[1:])):
+            errors.append('%s tiles are not in row major order' % name)
+        first_data[idx] = (name, offsets[0])
+
+    ordered = [first_data[idx] for idx in sorted(first_data)]
+    for (name, offset), (smaller, smaller_offset) in \
+            zip(ordered[:-1], ordered[1:]):
+        if offset < smaller_offset:
+            errors.append(
+                '%s tile data is before %s tile data' % (name, smaller)
+            )
+    
+    return warning_list, errors
+
+
 def set_band_color_descriptions(ds, color_dict, verbose=False):
     """Set band descriptions to color names. If band name is red, green, or 
     blue color interpretation is also set 
@@ -234,6 +521,72 @@ def set_metadata_item(ds, key, value, verbose=False):
 
 
 
+def block_windows(x_size, y_size, block_x_size, block_y_size):
+    """Generate windows that cover a raster
+
+    Parameters
+    ----------
+    x_size: int
+    y_size: int
+        raster size in pixels
+    block_x_size: int
+    block_y_size: int
+        window size in pixels, windows on the right and bottom edges may be
+        smaller
+
+    Yields
+    ------
+    tuple
+        (x offset, y offset, x size, y size) as used by ReadAsArray
+    """
+    for yoff in range(0, y_size, block_y_size):
+        ysize = min(block_y_size, y_size - yoff)
+        for xoff in range(0, x_size, block_x_size):
+            xsize = min(block_x_size, x_size - xoff)
+            yield xoff, yoff, xsize, ysize
+
+
+def get_window_size(band, min_pixels=1024*1024):
+    """Find a window size aligned with a bands natural block size that 
+    contains at least min_pixels pixels where possible. Whole blocks are 
+    grouped along rows (for strips) or columns (for tiles).
+
+    Parameters
+    ----------
+    band: gdal.Band
+    min_pixels: int, default 1024*1024
+
+    Returns
+    -------
+    tuple
+        (x size, y size)
+    """
+    block_x, block_y = band.GetBlockSize()
+    if block_x >= band.XSize:
+        n_blocks = max(1, math.ceil(min_pixels / (band.XSize * block_y)))
+        return band.XSize, min(block_y * n_blocks, band.YSize)
+    n_blocks = max(1, math.ceil(min_pixels / (block_x * block_y)))
+    return min(block_x * n_blocks, band.XSize), block_y
+
+
+def band_windows(band, min_pixels=1024*1024):
+    """Generate windows aligned with a bands natural block size, 
+    see get_window_size and block_windows
+
+    Parameters
+    ----------
+    band: gdal.Band
+    min_pixels: int, default 1024*1024
+
+    Yields
+    ------
+    tuple
+        (x offset, y offset, x size, y size)
+    """
+    x_win, y_win = get_window_size(band, min_pixels)
+    return block_windows(band.XSize, band.YSize, x_win, y_win)
+
+
 def zoom_box(data, top_left, bottom_right, no_data_val=np.nan):
     """Zoom to a box defined by the top left and bottom right pixel coordinates
 
@@ -268,24 +621,257 @@ def zoom_box(data, top_left, bottom_right, no_data_val=np.nan):
         new = resized
     return new
 
+def _block_mode(blocks):
+    """most common value along the last axis, ignoring nan. Ties return the
+    smallest value
+
+    Parameters
+    ----------
+    blocks: np.array
+        (..., n) array
+
+    Returns
+    -------
+    np.array
+    """
+    values = np.sort(blocks, axis=-1) # nan sorts last
+    n = values.shape[-1]
+    positions = np.arange(n)
+    start = np.ones(values.shape, dtype=bool)
+    start[..., 1:] = values[..., 1:] != values[..., :-1]
+    run_start = np.maximum.accumulate(np.where(start, positions, 0), axis=-1)
+    run_length = positions - run_start + 1
+    run_length[np.isnan(values)] = 0
+    best = np.argmax(run_length, axis=-1)
+    return np.take_along_axis(values, best[..., None], axis=-1)[..., 0]
+
+
+def _block_reduce(data, factor, ufunc, dtype=None):
+    """reduce each (row factor, col factor) block of data with a binary 
+    ufunc, first across rows then across columns, combining strided views 
+    so blocks are not copied into a transposed array
+
+    Parameters
+    ----------
+    data: np.array
+        2d array, dimensions must be multiples of factor
+    factor: tuple
+        (row factor, col factor)
+    ufunc: np.ufunc
+        i.e. np.add or np.fmin
+    dtype: np.dtype, optional
+        result type, defaults to data type
+
+    Returns
+    -------
+    np.array
+    """
+    fy, fx = factor
+    rows = data[0::fy].astype(dtype or data.dtype)
+    for idx in range(1, fy):
+        ufunc(rows, data[idx::fy], out=rows)
+    result = rows[:, 0::fx].copy()
+    for idx in range(1, fx):
+        ufunc(result, rows[:, idx::fx], out=result)
+    return result
+
+
+## block reductions of aggregate_array, nan aware ufuncs applied with 
+## _block_reduce, or a function of (rows, cols, n) blocks for mode
+AGGREGATE_FUNCTIONS = {
+    'sum': np.add,
+    'average': np.add,
+    'min': np.fmin,
+    'max': np.fmax,
+    'mode': _block_mode,
+}
+
+def aggregate_array(data, factor, resampling='average'):
+    """Aggregate an array by integer factors, ignoring nan values
+
+    Parameters
+    ----------
+    data: np.array
+        2d float array, dimensions must be multiples of factor
+    factor: tuple
+        (row factor, col factor)
+    resampling: str, default 'average'
+        one of AGGREGATE_FUNCTIONS, 'sum', 'average', 'min', 'max', or 'mode'
+
+    Returns
+    -------
+    np.array
+        aggregated data, cells with no valid values are nan
+    """
+    fy, fx = factor
+    valid = ~np.isnan(data)
+    count = _block_reduce(valid, factor, np.add, np.int32)
+    if resampling == 'mode':
+        rows, cols = data.shape[0] // fy, data.shape[1] // fx
+        blocks = data.reshape(rows, fy, cols, fx).transpose(0, 2, 1, 3)
+        result = _block_mode(blocks.reshape(rows, cols, fy * fx))
+    elif resampling in ('sum', 'average'):
+        result = _block_reduce(np.where(valid, data, 0), factor, np.add)
+        if resampling == 'average':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                result /= count
+    else:
+        result = _block_reduce(data, factor, AGGREGATE_FUNCTIONS[resampling])
+    result[count == 0] = np.nan
+    return result
+
+
+def get_integer_factors(transform, resolution):
+    """Find integer aggregation factors between a rasters transform and a 
+    new resolution
+
+    Parameters
+    ----------
+    transform: tuple
+        raster geotransform
+    resolution: tuple
+        (x Resolution, y Resolution)
+
+    Returns
+    -------
+    tuple or None
+        (row factor, col factor), or None if the grid is rotated or the 
+        factors are not integers
+    """
+    if transform[2] != 0 or transform[4] != 0:
+        return None
+    factors = []
+    for res, pixel in ((resolution[1], transform[5]), 
+            (resolution[0], transform[1])):
+        factor = abs(res) / abs(pixel)
+        if round(factor) < 1 or abs(factor - round(factor)) > 1e-9 * factor:
+            return None
+        factors.append(int(round(factor)))
+    return tuple(factors)
+
+
+def _aggregate_no_data(no_data, in_type, out_type):
+    """no data value of an aggregated band, used by _aggregate_raster. 
+    Integer outputs keep the input's no data value if it fits, otherwise
+    use the type's minimum (signed) or maximum (unsigned), and have none if
+    the input is an integer band without no data, as no cell can be empty
+
+    Returns
+    -------
+    number or None
+    """
+    if out_type.kind == 'f':
+        return no_data if no_data is not None else np.nan
+    info = np.iinfo(out_type)
+    if no_data is not None and np.isfinite(no_data) and \
+            no_data == int(no_data) and info.min <= no_data <= info.max:
+        return int(no_data)
+    if no_data is None and in_type.kind in 'iub':
+        return None
+    return int(info.min if out_type.kind == 'i' else info.max)
+
+
+def _aggregate_raster(in_ds, out_raster, factor, resampling, datatype,
+        min_pixels=1024*1024
+    ):
+    """Integer factor aggregation of all bands of a raster block by block,
+    used by rescale_raster. Integer outputs are rounded to the nearest 
+    value, as gdal.Warp does
+    """
+    out_type = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(datatype))
+    fy, fx = factor
+    gt = in_ds.GetGeoTransform()
+    out_x, out_y = in_ds.RasterXSize // fx, in_ds.RasterYSize // fy
+    out_gt = (gt[0], gt[1] * fx, 0, gt[3], 0, gt[5] * fy)
+    ## same uncompressed GTiff layout gdal.Warp writes in rescale_raster
+    out_ds = create_empty_raster(
+        out_raster, out_x, out_y, out_gt, in_ds.GetProjection(), 
+        in_ds.RasterCount, datatype, creation_options=['BIGTIFF=IF_SAFER']
+    )
+
+    for band in range(1, in_ds.RasterCount + 1):
+        in_band = in_ds.GetRasterBand(band)
+        out_band = out_ds.GetRasterBand(band)
+        no_data = in_band.GetNoDataValue()
+        is_no_data = no_data_mask_function(no_data)
+        out_no_data = _aggregate_no_data(
+            no_data, 
+            np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(
+                in_band.DataType
+            )),
+            out_type
+        )
+        if out_no_data is not None:
+            out_band.SetNoDataValue(out_no_data)
+
+        ## whole multiples of fy, aligned to blocks when windows are at 
+        ## least a block tall
+        block_y = in_band.GetBlockSize()[1]
+        rows = max(1, min_pixels // in_ds.RasterXSize)
+        step = np.lcm(fy, block_y)
+        if rows >= step:
+            rows = rows // step * step
+        else:
+            rows = max(fy, rows // fy * fy)
+        for xoff, yoff, xsize, ysize in block_windows(
+                    in_ds.RasterXSize, in_ds.RasterYSize, 
+                    in_ds.RasterXSize, rows
+                ):
+            data = in_band.ReadAsArray(xoff, yoff, xsize, ysize)
+            data = data.astype(np.float64)
+            data[is_no_data(data)] = np.nan
+            result = aggregate_array(data, factor, resampling)
+            if out_type.kind != 'f':
+                np.rint(result, out=result)
+            if out_no_data is not None:
+                result[np.isnan(result)] = out_no_data
+            out_band.WriteArray(result, xoff // fx, yoff // fy)
+        out_band.FlushCache()
+    out_ds.FlushCache()
+    return out_ds
+
+
 def rescale_raster(
-        in_raster, out_raster, resolution, datatype=gdal.GDT_Float32
+        in_raster, out_raster, resolution, datatype=gdal.GDT_Float32,
+        resampling=None, fast_path=True
     ):
-    """Rescales a rasters pixels to resolution
+    """Rescales a rasters pixels to resolution. When the new resolution is
+    an exact integer multiple of the input resolution, the raster size is
+    divisible by the factors, and resampling is one of 'average', 'sum', 
+    'min', 'max', or 'mode' the raster is aggregated block by block with 
+    numpy, otherwise gdal.Warp is used.
                                             
     Parameters
     ----------                                 
-    in_raster: path                           
+    in_raster: path or gdal.Dataset
         input raster file
     out_raster: path
         output raster file
     resolution: tuple
         (x Resolution, y Resolution)
     datatype: gdal.Type
+    resampling: str, optional
+        resampling algorithm (as named by gdal.Warp's resampleAlg), if None
+        gdal.Warp's default (nearest neighbour) is used
+    fast_path: bool, default True
+        if False always use gdal.Warp
     """
+    if fast_path and resampling in AGGREGATE_FUNCTIONS:
+        in_ds = load_raster(in_raster, True) if type(in_raster) is str \
+            else in_raster
+        factor = get_integer_factors(in_ds.GetGeoTransform(), resolution)
+        if factor is not None and \
+                in_ds.RasterYSize % factor[0] == 0 and \
+                in_ds.RasterXSize % factor[1] == 0:
+            _aggregate_raster(in_ds, out_raster, factor, resampling, datatype)
+            return True
+
+    options = {}
+    if resampling is not None:
+        options['resampleAlg'] = resampling
     tiff = gdal.Warp(
         out_raster, in_raster, xRes=resolution[0], yRes=resolution[1], 
-        format='GTiff', outputType=datatype
+        format='GTiff', outputType=datatype, **options
     )    
     tiff.GetRasterBand(1).FlushCache()
     tiff.FlushCache()
@@ -384,18 +970,24 @@ def mask_layer(layer, mask, mask_value = np.nan):
     layer[mask] = mask_value
     return layer
 
-def clip_raster (in_raster, out_raster, extent, datatpye=gdal.GDT_Float32):
+def clip_raster (in_raster, out_raster, extent, datatpye=gdal.GDT_Float32,
+        pool=None
+    ):
     """Clip a raster to extent
     
     Parameters
     ----------
-    in_raster: path
+    in_raster: path or gdal.Dataset
         input raster file
     out_raster: path
         output raster file
     extent: tuple
         (minX, maxY, maxX, minY)
+    pool: datasets.DatasetPool or bool, optional
+        pool to get input dataset from, see load_raster
     """
+    if type(in_raster) is str and datasets.get_pool(pool) is not None:
+        in_raster = load_raster(in_raster, True, pool=pool)
 
     tiff = gdal.Translate(
         out_raster, in_raster, projWin = extent, 
@@ -407,6 +999,282 @@ def clip_raster (in_raster, out_raster, extent, datatpye=gdal.GDT_Float32):
     return True
 
 
+STATISTICS_METADATA_KEY = 'SPICEBOX_STATISTICS_BAND_%i'
+
+## fine bins per output bin of the running histogram used when calc_statistics
+## finds the histogram range in the same pass
+HISTOGRAM_OVERSAMPLE = 64
+
+def _combine_moments(count, mean, m2, b_count, b_mean, b_m2):
+    """Combine running count, mean, and sum of squared differences (M2) with
+    those of a new block (parallel form of Welford's algorithm)
+    """
+    if b_count == 0:
+        return count, mean, m2
+    total = count + b_count
+    delta = b_mean - mean
+    mean = mean + delta * b_count / total
+    m2 = m2 + b_m2 + delta ** 2 * count * b_count / total
+    return total, mean, m2
+
+
+class _RunningHistogram(object):
+    """histogram of values with an unknown range. Bins start at the range of
+    the first values added and double in width (merging pairs of bins) when
+    later values fall outside the bins
+    """
+
+    def __init__(self, bins):
+        self.counts = np.zeros(bins + bins % 2, dtype=np.int64)
+        self.lo = None
+        self.width = None
+
+    ## bin width doublings that take the smallest float64 to the largest
+    MAX_GROW = 2100
+
+    def add(self, values):
+        """add a 1d float array of finite values"""
+        n = len(self.counts)
+        v_min, v_max = values.min(), values.max()
+        if not (np.isfinite(v_min) and np.isfinite(v_max)):
+            raise ValueError('histogram values must be finite')
+        if self.lo is None:
+            span = v_max - v_min
+            if span == 0:
+                span = max(abs(v_min), 1.0) * 1e-6
+            self.lo, self.width = v_min, span / n
+        grown = 0
+        while v_min < self.lo or v_max >= self.lo + self.width * n:
+            if grown == self.MAX_GROW:
+                raise ValueError('histogram range cannot be extended')
+            self._grow(left=v_min < self.lo)
+            grown += 1
+        idx = ((values - self.lo) / self.width).astype(np.int64)
+        np.clip(idx, 0, n - 1, out=idx)
+        self.counts += np.bincount(idx, minlength=n)
+
+    def _grow(self, left):
+        """double bin width, extending the range left or right"""
+        n = len(self.counts)
+        merged = self.counts.reshape(-1, 2).sum(axis=1)
+        self.counts = np.zeros(n, dtype=np.int64)
+        if left:
+            self.counts[n // 2:] = merged
+            self.lo -= self.width * n
+        else:
+            self.counts[:n // 2] = merged
+        self.width *= 2
+
+    def rebin(self, lo, hi, bins):
+        """counts in bins equal width bins from lo to hi, where lo and hi 
+        are the min and max of the values added. Counts in fine bins split 
+        by an output bin edge are divided linearly
+        """
+        counts = np.zeros(bins, dtype=np.int64)
+        if self.lo is None:
+            return counts
+        edges = self.lo + self.width * np.arange(len(self.counts) + 1)
+        cumulative = np.concatenate([[0], np.cumsum(self.counts)])
+        new = np.interp(np.linspace(lo, hi, bins + 1), edges, cumulative)
+        new[0], new[-1] = 0, cumulative[-1]
+        return np.diff(np.round(new)).astype(np.int64)
+
+
+def clear_statistics(ds, bands=None):
+    """Remove statistics cached by calc_statistics, called by functions that
+    write to a dataset in place. Call this after writing to a band outside
+    of spicebox.
+
+    Parameters
+    ----------
+    ds: gdal.dataset
+    bands: list, optional
+        defaults to all bands
+
+    Returns
+    -------
+    returns True if function is successful
+    """
+    if bands is None:
+        bands = range(1, ds.RasterCount+1)
+    for band in bands:
+        if ds.GetMetadataItem(STATISTICS_METADATA_KEY % band):
+            set_metadata_item(ds, STATISTICS_METADATA_KEY % band, '')
+    return True
+
+
+def histogram_percentiles(counts, edges, percentiles):
+    """Approximate percentiles from a histogram by linear interpolation 
+    within bins
+
+    Parameters
+    ----------
+    counts: array like
+        histogram counts
+    edges: array like
+        bin edges (len(counts) + 1)
+    percentiles: list
+        percentiles in [0, 100]
+
+    Returns
+    -------
+    dict
+        percentile: value
+    """
+    counts = np.asarray(counts, dtype=float)
+    edges = np.asarray(edges, dtype=float)
+    cumulative = np.concatenate([[0], np.cumsum(counts)])
+    if cumulative[-1] == 0:
+        return {p: np.nan for p in percentiles}
+    return {
+        p: float(np.interp(p / 100 * cumulative[-1], cumulative, edges))
+            for p in percentiles
+    }
+
+
+def calc_statistics(
+        raster, band=1, bins=256, hist_range=None, percentiles=(2, 50, 98),
+        approximate=False, use_cache=True, min_pixels=1024*1024,
+        tile_cache=None
+    ):
+    """Calculate band statistics and a histogram in one block by block 
+    pass, without loading the band. No data, nan, and infinite pixels are 
+    ignored. 
+    Results are saved in the dataset metadata (see set_metadata_item) and 
+    reused by later calls with the same arguments and no data value. 
+    set_no_data and change_no_data clear saved results, other writes to the
+    band need a call to clear_statistics.
+
+    Parameters
+    ----------
+    raster: path or gdal.Dataset
+    band: int, default 1
+    bins: int, default 256
+        number of histogram bins
+    hist_range: tuple, optional
+        (min, max) of histogram, defaults to the band min and max. Without
+        it the histogram is rebinned from a finer histogram built during the
+        pass, so counts near bin edges are approximate
+    percentiles: list, default (2, 50, 98)
+        percentiles to approximate from histogram
+    approximate: bool, default False
+        if True statistics may be calculated from an overview
+    use_cache: bool, default True
+        if True cached results are returned if available, and new results 
+        are cached
+    min_pixels: int, default 1024*1024
+        minimum pixels per block, and the minimum pixels in an overview used
+        for approximate statistics
+    tile_cache: tilecache.TileCache, optional
+        cache of decoded blocks used when reading full resolution data, see
+        read_window
+
+    Returns
+    -------
+    dict
+        with keys 'count', 'min', 'max', 'mean', 'std', 'variance',
+        'histogram', 'bin_edges', 'percentiles', and 'approximate'
+    """
+    ds = load_raster(raster, True) if type(raster) is str else raster
+    rb = ds.GetRasterBand(band)
+    key = STATISTICS_METADATA_KEY % band
+    percentiles = [float(p) for p in percentiles]
+    no_data = rb.GetNoDataValue()
+    params = {
+        'bins': bins, 'approximate': approximate,
+        'hist_range': None if hist_range is None else list(hist_range),
+        'percentiles': percentiles, 
+        ## repr so nan compares equal
+        'no_data': None if no_data is None else repr(float(no_data)),
+    }
+
+    if use_cache:
+        cached = ds.GetMetadataItem(key)
+        if cached:
+            cached = json.loads(cached)
+            if cached.get('params') == params:
+                stats = cached['stats']
+                stats['percentiles'] = {
+                    float(p): v for p, v in stats['percentiles'].items()
+                }
+                return stats
+
+    is_no_data = no_data_mask_function(no_data)
+    source = rb
+    if approximate:
+        for idx in range(rb.GetOverviewCount()):
+            overview = rb.GetOverview(idx)
+            if overview.XSize * overview.YSize < min_pixels:
+                break
+            source = overview
+
+    if hist_range is None:
+        running = _RunningHistogram(bins * HISTOGRAM_OVERSAMPLE)
+    else:
+        running = None
+        lo, hi = float(hist_range[0]), float(hist_range[1])
+        if hi <= lo:
+            hi = lo + 1
+        counts = np.zeros(bins, dtype=np.int64)
+
+    count, mean, m2 = 0, 0.0, 0.0
+    d_min, d_max = np.inf, -np.inf
+    for xoff, yoff, xsize, ysize in band_windows(source, min_pixels):
+        if source is rb:
+            data = read_window(
+                ds, xoff, yoff, xsize, ysize, band, tile_cache
+            )
+        else:
+            data = source.ReadAsArray(xoff, yoff, xsize, ysize)
+        valid = data[~is_no_data(data) & np.isfinite(data)] \
+            if data.dtype.kind == 'f' else data[~is_no_data(data)]
+        if valid.size == 0:
+            continue
+        valid = valid.astype(np.float64, copy=False)
+        b_mean = valid.mean()
+        b_m2 = np.square(valid - b_mean).sum()
+        count, mean, m2 = _combine_moments(
+            count, mean, m2, valid.size, b_mean, b_m2
+        )
+        d_min = min(d_min, valid.min())
+        d_max = max(d_max, valid.max())
+
+        if running is not None:
+            running.add(valid)
+            continue
+        idx = ((valid - lo) * (bins / (hi - lo))).astype(np.int64)
+        idx = idx[(valid >= lo) & (valid <= hi)]
+        np.clip(idx, 0, bins - 1, out=idx)
+        counts += np.bincount(idx, minlength=bins)
+
+    if running is not None:
+        lo, hi = (float(d_min), float(d_max)) if count else (0.0, 1.0)
+        if hi <= lo:
+            hi = lo + 1
+        counts = running.rebin(lo, hi, bins)
+
+    edges = np.linspace(lo, hi, bins + 1)
+    variance = m2 / count if count > 0 else np.nan
+    stats = {
+        'count': int(count),
+        'min': float(d_min) if count else np.nan,
+        'max': float(d_max) if count else np.nan,
+        'mean': float(mean) if count else np.nan,
+        'variance': float(variance),
+        'std': float(np.sqrt(variance)),
+        'histogram': counts.tolist(),
+        'bin_edges': edges.tolist(),
+        'percentiles': histogram_percentiles(counts, edges, percentiles),
+        'approximate': source is not rb,
+    }
+
+    if use_cache:
+        set_metadata_item(
+            ds, key, json.dumps({'params': params, 'stats': stats})
+        )
+    return stats
+
+
 def convert_to_figure(raster_name, figure_name, title = "", cmap = 'viridis', 
         ticks = None, tick_labels=None, vmin=None,vmax=None, save=True
     ):
@@ -449,7 +1317,7 @@ def convert_to_figure(raster_name, figure_name, title = "", cmap = 'viridis',
     plt.close()
 
 def clip_polygon_raster (
-    in_raster, out_raster, vector, **warp_options
+    in_raster, out_raster, vector, pool=None, **warp_options
     ):
     """clips raster from shape(a vector file) using gdal warp
 
@@ -461,6 +1329,8 @@ def clip_polygon_raster (
         file to save clipped data to
     vector: path
         path to vector file with shape to clip to
+    pool: datasets.DatasetPool or bool, optional
+        pool to get input dataset from, see load_raster
     warp_options:
         keyword options for gdal warp as formated for gdal.WarpOptions
         see https://gdal.org/python/osgeo.gdal-module.html#WarpOptions
@@ -472,7 +1342,7 @@ def clip_polygon_raster (
     gdal.Dataset
     """
     if type(in_raster) is str:
-        in_raster = load_raster(in_raster, True)
+        in_raster = load_raster(in_raster, True, pool=pool)
     gt = in_raster.GetGeoTransform()
      
     
@@ -537,17 +1407,327 @@ def calc_norm_index(dataset, band_a_name, band_b_name):
     return (band_a - band_b) /  (band_b + band_a)
 
 
-def reproject(in_img, out_img, new_projection, dest_nodata):
+EXPRESSION_FUNCTIONS = {
+    'abs': np.abs, 'sqrt': np.sqrt, 'log': np.log, 'log10': np.log10, 
+    'exp': np.exp, 'sin': np.sin, 'cos': np.cos, 'tan': np.tan,
+    'isnan': np.isnan, 'minimum': np.minimum, 'maximum': np.maximum,
+    'clip': np.clip, 'where': np.where,
+}
+
+_EXPRESSION_OPERATORS = {
+    ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, 
+    ast.Div: np.true_divide, ast.Pow: np.power, ast.Mod: np.mod,
+    ast.BitAnd: np.logical_and, ast.BitOr: np.logical_or,
+    ast.Lt: np.less, ast.LtE: np.less_equal, ast.Gt: np.greater, 
+    ast.GtE: np.greater_equal, ast.Eq: np.equal, ast.NotEq: np.not_equal,
+    ast.USub: np.negative, ast.Invert: np.logical_not,
+}
+
+class BlockExpression(object):
+    """Evaluates an arithmetic expression on blocks of raster data using 
+    numpy ufuncs with `out` arguments. Intermediate results are stored in 
+    scratch buffers that are reused between blocks, so no full size 
+    temporaries are created.
+
+    Expressions may use input names, numbers, + - * / ** %, comparisons, 
+    & | ~ (logical and, or, not), and the functions in EXPRESSION_FUNCTIONS,
+    i.e. "where(b > 0, (a - b) / (a + b), 0)" or "clip(a * 2, 0, 1)"
+    """
+
+    def __init__(self, expression, dtype=np.float32):
+        """
+        Parameters
+        ----------
+        expression: str
+        dtype: numpy dtype, default np.float32
+            data type of arithmetic results
+        """
+        self.expression = expression
+        self.tree = ast.parse(expression, mode='eval').body
+        self.dtype = np.dtype(dtype)
+        self.names = set()
+        self._validate(self.tree)
+        self.scratch = {}
+        self.in_use = set()
+
+    def _validate(self, node):
+        """check that expression only uses supported syntax"""
+        if isinstance(node, ast.Name):
+            if node.id in EXPRESSION_FUNCTIONS:
+                raise SyntaxError('%s is a function' % node.id)
+            self.names.add(node.id)
+        elif isinstance(node, ast.Constant):
+            if not isinstance(node.value, (int, float, bool)):
+                raise SyntaxError('Unsupported constant %r' % node.value)
+        elif isinstance(node, (ast.BinOp, ast.UnaryOp)):
+            if type(node.op) not in _EXPRESSION_OPERATORS:
+                raise SyntaxError('Unsupported operator %s' % node.op)
+        elif isinstance(node, ast.Compare):
+            if len(node.ops) != 1 or \
+                    type(node.ops[0]) not in _EXPRESSION_OPERATORS:
+                raise SyntaxError('Unsupported comparison')
+        elif isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or \
+                    node.func.id not in EXPRESSION_FUNCTIONS or node.keywords:
+                raise SyntaxError('Unsupported function call')
+            for arg in node.args:
+                self._validate(arg)
+            return
+        else:
+            raise SyntaxError(
+                'Unsupported expression element %s' % type(node).__name__
+            )
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, ast.expr):
+                self._validate(child)
+
+    def _buffer(self, dtype):
+        """get a free scratch buffer of the current block shape"""
+        dtype = np.dtype(dtype)
+        size = int(np.prod(self.shape))
+        for idx, buf in enumerate(self.scratch.setdefault(dtype, [])):
+            if (dtype, idx) not in self.in_use and buf.size >= size:
+                self.in_use.add((dtype, idx))
+                return buf[:size].reshape(self.shape)
+        self.scratch[dtype].append(np.empty(size, dtype=dtype))
+        self.in_use.add((dtype, len(self.scratch[dtype]) - 1))
+        return self.scratch[dtype][-1].reshape(self.shape)
+
+    def _release(self, value):
+        """return a scratch buffer to the pool"""
+        if not isinstance(value, np.ndarray):
+            return
+        for dtype, idx in list(self.in_use):
+            if np.may_share_memory(self.scratch[dtype][idx], value):
+                self.in_use.discard((dtype, idx))
+                return
+
+    def _is_scratch(self, value):
+        """check if value is an in use scratch buffer"""
+        return isinstance(value, np.ndarray) and any(
+            np.may_share_memory(self.scratch[d][i], value) 
+                for d, i in self.in_use
+        )
+
+    def _apply(self, func, args, dtype):
+        """apply a ufunc, writing to a reused buffer when possible"""
+        if not any(isinstance(a, np.ndarray) for a in args):
+            return func(*args)
+        out = None
+        for arg in args:
+            if self._is_scratch(arg) and arg.dtype == dtype:
+                out = arg
+                break
+        if out is None:
+            out = self._buffer(dtype)
+        func(*args, out=out)
+        for arg in args:
+            if arg is not out:
+                self._release(arg)
+        return out
+
+    def _eval(self, node):
+        """evaluate an expression node"""
+        if isinstance(node, ast.Name):
+            return self.blocks[node.id]
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.UnaryOp):
+            operand = self._eval(node.operand)
+            func = _EXPRESSION_OPERATORS[type(node.op)]
+            dtype = bool if func is np.logical_not else self.dtype
+            return self._apply(func, [operand], dtype)
+        if isinstance(node, ast.BinOp):
+            func = _EXPRESSION_OPERATORS[type(node.op)]
+            args = [self._eval(node.left), self._eval(node.right)]
+            dtype = bool if func in (np.logical_and, np.logical_or) \
+                else self.dtype
+            return self._apply(func, args, dtype)
+        if isinstance(node, ast.Compare):
+            func = _EXPRESSION_OPERATORS[type(node.ops[0])]
+            args = [self._eval(node.left), self._eval(node.comparators[0])]
+            return self._apply(func, args, bool)
+
+        name = node.func.id
+        args = [self._eval(arg) for arg in node.args]
+        if name == 'where':
+            cond, x, y = args
+            out = self._buffer(self.dtype)
+            np.copyto(out, y)
+            np.copyto(out, x, where=cond)
+            for arg in args:
+                self._release(arg)
+            return out
+        dtype = bool if name == 'isnan' else self.dtype
+        return self._apply(EXPRESSION_FUNCTIONS[name], args, dtype)
+
+    def __call__(self, **blocks):
+        """Evaluate the expression
+
+        Parameters
+        ----------
+        blocks:
+            input name: np.array, all arrays must have the same shape
+
+        Returns
+        -------
+        np.array
+            result, which is a scratch buffer that is overwritten by the 
+            next call
+        """
+        self.blocks = blocks
+        self.shape = next(iter(blocks.values())).shape
+        self.in_use = set()
+        result = self._eval(self.tree)
+        self.blocks = None
+        if not isinstance(result, np.ndarray):
+            out = self._buffer(self.dtype)
+            out[:] = result
+            result = out
+        return result
+
+
+def calc_expression(
+        inputs, expression, out_raster, no_data=np.nan, 
+        datatype=gdal.GDT_Float32, min_pixels=1024*1024,
+        creation_options=['TILED=YES', 'COMPRESS=LZW', 'BIGTIFF=IF_SAFER'],
+        tile_cache=None
+    ):
+    """Evaluate an expression on co-registered rasters block by block and 
+    write the result to a new raster (similar to gdal_calc). Full bands are
+    never loaded.
+
+    Parameters
+    ----------
+    inputs: dict
+        input name: path, gdal.Dataset, or (path or gdal.Dataset, band 
+        number). Band 1 is used if no band is given
+    expression: str or function
+        expression as described in BlockExpression, i.e. "(a - b) / (a + b)"
+        or a function that takes the input names as keyword arguments and
+        returns an array
+    out_raster: path
+        raster to create
+    no_data: number, default np.nan
+        output no data value. Pixels where any input is no data, or where 
+        the result is nan, are set to no_data
+    datatype: gdal data type, default gdal.GDT_Float32
+        output data type
+    min_pixels: int, default 1024*1024
+        minimum pixels per block
+    creation_options: list
+        GTiff creation options for output 
+    tile_cache: tilecache.TileCache, optional
+        cache of decoded blocks used when reading inputs, see read_window
+
+    Returns
+    -------
+    gdal.Dataset
+    """
+    bands = {}
+    sources = {}
+    for name, item in inputs.items():
+        source, band = item if type(item) is tuple else (item, 1)
+        ds = load_raster(source, True) if type(source) is str else source
+        sources[name] = (ds, band)
+        bands[name] = ds.GetRasterBand(band)
+
+    first = next(iter(bands.values()))
+    x_size, y_size = first.XSize, first.YSize
+    for name, band in bands.items():
+        if (band.XSize, band.YSize) != (x_size, y_size):
+            raise ValueError('input %s size does not match' % name)
+
+    if callable(expression):
+        evaluate = expression
+    else:
+        evaluate = BlockExpression(expression)
+        missing = evaluate.names - set(bands)
+        if missing:
+            raise NameError('undefined inputs: %s' % ', '.join(missing))
+
+    no_data_funcs = {
+        name: no_data_mask_function(band.GetNoDataValue()) 
+            for name, band in bands.items()
+    }
+
+    driver = gdal.GetDriverByName('GTiff')
+    out_ds = driver.Create(
+        out_raster, x_size, y_size, 1, datatype, options=creation_options
+    )
+    first_ds = next(iter(sources.values()))[0]
+    out_ds.SetGeoTransform(first_ds.GetGeoTransform())
+    out_ds.SetProjection(first_ds.GetProjection())
+    out_band = out_ds.GetRasterBand(1)
+    out_band.SetNoDataValue(no_data)
+
+    x_win, y_win = get_window_size(first, min_pixels)
+    buffers = {
+        name: np.empty([y_win, x_win], dtype=np.float32) for name in bands
+    }
+    mask_buffer = np.empty([y_win, x_win], dtype=bool)
+    for xoff, yoff, xsize, ysize in block_windows(
+                x_size, y_size, x_win, y_win
+            ):
+        blocks = {}
+        mask = mask_buffer[:ysize, :xsize]
+        mask[:] = False
+        for name, band in bands.items():
+            buf = buffers[name][:ysize, :xsize]
+            if tile_cache is None:
+                band.ReadAsArray(xoff, yoff, xsize, ysize, buf_obj=buf)
+            else:
+                ds, band_number = sources[name]
+                buf[:] = tile_cache.read_window(
+                    ds, band_number, xoff, yoff, xsize, ysize
+                )
+            np.logical_or(mask, no_data_funcs[name](buf), out=mask)
+            blocks[name] = buf
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = evaluate(**blocks)
+        result = np.asarray(result)
+        if result.dtype == bool:
+            result = result.astype(np.uint8)
+        if result.dtype.kind == 'f':
+            np.logical_or(mask, np.isnan(result), out=mask)
+        if mask.any():
+            result = result.astype(
+                np.result_type(result.dtype, np.min_scalar_type(no_data)), 
+                copy=False
+            )
+            np.copyto(result, no_data, where=mask)
+        out_band.WriteArray(result, xoff, yoff)
+
+    out_band.FlushCache()
+    out_ds.FlushCache()
+    return out_ds
+
+
+def reproject(in_img, out_img, new_projection, dest_nodata, cog=False):
+    """Reproject a raster with gdal warp
 
+    Parameters
+    ----------
+    in_img: path or gdal.Dataset
+    out_img: path
+    new_projection: str
+        projection as understood by gdal.WarpOptions dstSRS
+    dest_nodata: number
+    cog: bool, default False
+        if True write a Cloud Optimized GeoTIFF (see to_cog), otherwise a
+        LZW compressed GeoTIFF
+    """
     options = gdal.WarpOptions(
+        format='COG' if cog else 'GTiff',
         dstSRS=new_projection, 
         dstNodata=dest_nodata, 
-        creationOptions=['COMPRESS=LZW',]
+        creationOptions=COG_CREATION_OPTIONS if cog else ['COMPRESS=LZW',]
     )
     gdal.Warp(out_img, in_img, options=options)
 
 
-def merge(to_merge, outfile, warp_options=[]): 
+def merge(to_merge, outfile, warp_options=[], cog=False): 
     """Merge many rasters into a single raster using gdal warp
 
     Parameters
@@ -558,46 +1738,375 @@ def merge(to_merge, outfile, warp_options=[]):
         path to save merged data at
     warp_options: gdal.warpOptions
         options to pass to gdal warp
+    cog: bool, default False
+        if True write a Cloud Optimized GeoTIFF (see to_cog). Only used if
+        warp_options is a list of options
 
     Returns
     -------
     raster.Dataset
     """
-    merged = gdal.Warp(
-        outfile, to_merge, format="GTiff",
-        options=warp_options
-    ) # if you want
+    if cog:
+        merged = gdal.Warp(
+            outfile, to_merge, format="COG",
+            creationOptions=COG_CREATION_OPTIONS, options=warp_options
+        )
+    else:
+        merged = gdal.Warp(
+            outfile, to_merge, format="GTiff",
+            options=warp_options
+        ) # if you want
     
     merged.FlushCache() 
     return merged 
 
-def set_no_data(ds, no_data_val, no_data_mask, bands=None):
-    """sets 
+GRID = namedtuple('GRID', ['transform', 'projection', 'x_size', 'y_size'])
+
+def get_grid(reference):
+    """Get the grid (transform, projection, and size) of a reference
+
+    Parameters
+    ----------
+    reference: path, gdal.Dataset, GRID, or tuple
+        reference raster, or (transform, projection, x size, y size)
+
+    Returns
+    -------
+    GRID
+    """
+    if type(reference) in (GRID, tuple, list):
+        return GRID(*reference)
+    ds = load_raster(reference, True) if type(reference) is str \
+        else reference
+    return GRID(
+        ds.GetGeoTransform(), ds.GetProjection(), 
+        ds.RasterXSize, ds.RasterYSize
+    )
+
+
+def _same_projection(wkt_a, wkt_b):
+    """check if two projections are the same"""
+    if wkt_a == wkt_b:
+        return True
+    if not wkt_a or not wkt_b:
+        return False
+    srs_a, srs_b = osr.SpatialReference(), osr.SpatialReference()
+    srs_a.ImportFromWkt(wkt_a)
+    srs_b.ImportFromWkt(wkt_b)
+    return bool(srs_a.IsSame(srs_b))
+
+
+def is_aligned(raster, reference, tolerance=1e-6):
+    """Check if a raster is on a reference grid
+
+    Parameters
+    ----------
+    raster: path, gdal.Dataset
+    reference: path, gdal.Dataset, GRID, or tuple
+        see get_grid
+    tolerance: float, default 1e-6
+        allowed difference in transform values, as a fraction of the 
+        reference pixel size
+
+    Returns
+    -------
+    bool
+    """
+    grid = get_grid(reference)
+    other = get_grid(raster)
+    if (other.x_size, other.y_size) != (grid.x_size, grid.y_size):
+        return False
+    pixel = min(abs(grid.transform[1]), abs(grid.transform[5]))
+    if not np.allclose(
+            other.transform, grid.transform, rtol=0, atol=tolerance * pixel
+        ):
+        return False
+    return _same_projection(other.projection, grid.projection)
+
+
+def _align_warp_options(grid, resampling, dest_nodata, warp_options):
+    """gdal.Warp keyword options to warp a raster onto grid"""
+    gt = grid.transform
+    x_min, y_max = gt[0], gt[3]
+    x_max = gt[0] + gt[1] * grid.x_size
+    y_min = gt[3] + gt[5] * grid.y_size
+    options = {
+        'outputBounds': (
+            min(x_min, x_max), min(y_min, y_max), 
+            max(x_min, x_max), max(y_min, y_max)
+        ),
+        'width': grid.x_size, 'height': grid.y_size,
+        'dstSRS': grid.projection,
+        'resampleAlg': resampling,
+    }
+    if dest_nodata is not None:
+        options['dstNodata'] = dest_nodata
+    options.update(warp_options)
+    return options
+
+
+def _align_job_(args):
+    """warp one raster to a tiled GeoTIFF, used by align_rasters"""
+    in_raster, out_raster, options = args
+    ds = gdal.Warp(out_raster, in_raster, format='GTiff', **options)
+    ds.FlushCache()
+    ds = None
+    return out_raster
+
+
+def align_rasters(
+        rasters, reference, out_dir=None, resampling='nearest', 
+        dest_nodata=None, virtual=True, workers=1, 
+        creation_options=['TILED=YES', 'COMPRESS=LZW', 'BIGTIFF=IF_SAFER'],
+        tolerance=1e-6, **warp_options
+    ):
+    """Put rasters on the grid of a reference raster. Rasters already on the
+    grid are opened, not copied. Others are warped on read through a VRT 
+    (virtual=True), or warped to tiled GeoTIFFs in out_dir, in parallel if 
+    workers > 1. Returned datasets can be used with the block wise functions
+    (calc_expression, calc_statistics, band_windows, ...)
+
+    Parameters
+    ----------
+    rasters: list
+        paths or gdal.Datasets. Datasets can only be used if virtual is True
+        or workers is 1
+    reference: path, gdal.Dataset, GRID, or tuple
+        see get_grid
+    out_dir: path, optional
+        directory for aligned rasters. Required if virtual is False, if 
+        not given VRTs are kept in memory. Outputs are named after their
+        input files, with the input's index appended to repeated names
+    resampling: str, default 'nearest'
+        gdal.Warp resampling algorithm
+    dest_nodata: number, optional
+        no data value for aligned rasters
+    virtual: bool, default True
+        if True create warped VRTs, otherwise write GeoTIFFs
+    workers: int, default 1
+        number of processes used for writing GeoTIFFs
+    creation_options: list
+        GTiff creation options used when virtual is False
+    tolerance: float, default 1e-6
+        see is_aligned
+    **warp_options:
+        other keyword options for gdal.WarpOptions
+
+    Returns
+    -------
+    list
+        gdal.Datasets in the order of rasters
+    """
+    grid = get_grid(reference)
+    if not virtual and out_dir is None:
+        raise ValueError('out_dir is required when virtual is False')
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+
+    options = _align_warp_options(grid, resampling, dest_nodata, warp_options)
+    if not virtual:
+        options['creationOptions'] = creation_options
+
+    aligned = [None] * len(rasters)
+    jobs = []
+    used_names = set()
+    for idx, raster in enumerate(rasters):
+        ds = load_raster(raster, True) if type(raster) is str else raster
+        if is_aligned(ds, grid, tolerance):
+            aligned[idx] = ds
+            continue
+
+        if out_dir is None:
+            out_raster = ''
+        else:
+            name = os.path.split(ds.GetDescription())[1] or 'raster_%i' % idx
+            name = os.path.splitext(name)[0]
+            ## i.e. a/dem.tif and b/dem.tif, lower case for case 
+            ## insensitive file systems
+            if name.lower() in used_names:
+                name = '%s_%i' % (name, idx)
+            used_names.add(name.lower())
+            out_raster = os.path.join(
+                out_dir, name + ('.vrt' if virtual else '.tif')
+            )
+
+        if virtual:
+            aligned[idx] = gdal.Warp(out_raster, ds, format='VRT', **options)
+            if out_dir is not None:
+                aligned[idx].FlushCache()
+        else:
+            jobs.append((idx, raster, out_raster))
+    
+    job_args = [(raster, out_raster, options) for _, raster, out_raster in jobs]
+    if workers > 1 and len(jobs) > 1:
+        with Pool(min(workers, len(jobs))) as pool:
+            outputs = pool.map(_align_job_, job_args)
+    else:
+        outputs = [_align_job_(args) for args in job_args]
+
+    for (idx, _, _), out_raster in zip(jobs, outputs):
+        aligned[idx] = load_raster(out_raster, True)
+
+    return aligned
+
+
+def _row_windows(band, min_pixels=1024*1024):
+    """Full width windows aligned with a bands block height, with at least
+    min_pixels pixels where possible
+
+    Parameters
+    ----------
+    band: gdal.Band
+    min_pixels: int, default 1024*1024
+
+    Yields
+    ------
+    tuple
+        (x offset, y offset, x size, y size)
+    """
+    block_y = band.GetBlockSize()[1]
+    n_blocks = max(1, math.ceil(min_pixels / (band.XSize * block_y)))
+    return block_windows(
+        band.XSize, band.YSize, band.XSize, min(block_y * n_blocks, band.YSize)
+    )
+
+
+def set_no_data(ds, no_data_val, no_data_mask, bands=None, 
+        min_pixels=1024*1024
+    ):
+    """sets pixels in no_data_mask to no_data_val, and sets the no data value
+    of bands. Bands are processed block by block.
+
+    Parameters
+    ----------
+    ds: gdal.dataset
+        raster dataset opened for update
+    no_data_val: number
+        new no data value
+    no_data_mask: np.array or function
+        2d boolean array (True for no data), or a function that takes a block
+        of data and returns a boolean mask for the block
+    bands: list, optional
+        bands to update, defaults to all bands
+    min_pixels: int, default 1024*1024
+        minimum pixels per block
+
+    Returns
+    -------
+    returns True if function is successful
     """
     if bands is None:
         bands = range(1, ds.RasterCount+1)
+    clear_statistics(ds, bands)
     for band in bands:
         rb = ds.GetRasterBand(band)
-        data = rb.ReadAsArray()
-        data[no_data_mask] = no_data_val
-        ds.GetRasterBand(band).WriteArray(data)
-        ds.GetRasterBand(band).SetNoDataValue(no_data_val)
+        for xoff, yoff, xsize, ysize in band_windows(rb, min_pixels):
+            data = rb.ReadAsArray(xoff, yoff, xsize, ysize)
+            if callable(no_data_mask):
+                mask = no_data_mask(data)
+            else:
+                mask = no_data_mask[yoff:yoff+ysize, xoff:xoff+xsize]
+            if mask.any():
+                data[mask] = no_data_val
+                rb.WriteArray(data, xoff, yoff)
+        rb.SetNoDataValue(no_data_val)
+        rb.FlushCache()
 
     return True
 
-def change_no_data(ds, new_no_data, bands=None):
+def no_data_mask_function(no_data_val):
+    """Create a function that finds no data pixels in a block of data
+
+    Parameters
+    ----------
+    no_data_val: number or None
+        if None no pixels are no data
+
+    Returns
+    -------
+    function
+        f(data) -> boolean np.array, True for no data
+    """
+    if no_data_val is None:
+        return lambda data: np.zeros(data.shape, dtype=bool)
+    if np.isnan(no_data_val):
+        return np.isnan
+    return lambda data: data == no_data_val
+
+def change_no_data(ds, new_no_data, bands=None, mask_band=False, 
+        packed_mask=False, min_pixels=1024*1024
+    ):
+    """Change the no data value of bands, rewriting existing no data pixels.
+    Each band is read and written once, block by block, so memory use does 
+    not depend on the raster size.
+
+    Parameters
+    ----------
+    ds: gdal.dataset
+        raster dataset opened for update
+    new_no_data: number
+        new no data value
+    bands: list, optional
+        bands to update, defaults to all bands
+    mask_band: bool, default False
+        if True also write a per dataset GDAL mask band (0 where any 
+        processed band is no data, 255 otherwise)
+    packed_mask: bool, default False
+        if True return bit packed no data masks (see np.packbits, packed
+        along rows) instead of True
+    min_pixels: int, default 1024*1024
+        minimum pixels per block
+
+    Returns
+    -------
+    True, or dict of band number: packed mask if packed_mask is True
+    """
     if bands is None:
         bands = range(1, ds.RasterCount+1)
+    bands = list(bands)
+    clear_statistics(ds, bands)
+    rbs = {band: ds.GetRasterBand(band) for band in bands}
+    is_no_data = {
+        band: no_data_mask_function(rbs[band].GetNoDataValue()) 
+            for band in bands
+    }
+
+    if mask_band:
+        ds.CreateMaskBand(gdal.GMF_PER_DATASET)
+        mb = rbs[bands[0]].GetMaskBand()
+    if packed_mask:
+        packed = {
+            band: np.zeros(
+                [ds.RasterYSize, math.ceil(ds.RasterXSize / 8)], 
+                dtype=np.uint8
+            ) for band in bands
+        }
+
+    for xoff, yoff, xsize, ysize in _row_windows(rbs[bands[0]], min_pixels):
+        if mask_band:
+            valid = np.full([ysize, xsize], 255, dtype=np.uint8)
+        for band in bands:
+            rb = rbs[band]
+            data = rb.ReadAsArray(xoff, yoff, xsize, ysize)
+            mask = is_no_data[band](data)
+            if mask.any():
+                data[mask] = new_no_data
+                rb.WriteArray(data, xoff, yoff)
+                if mask_band:
+                    valid[mask] = 0
+            if packed_mask:
+                packed[band][yoff:yoff+ysize] = np.packbits(mask, axis=1)
+        if mask_band:
+            mb.WriteArray(valid, xoff, yoff)
+
     for band in bands:
-        rb = ds.GetRasterBand(band)
-        old_no_data = rb.GetNoDataValue()
-        data = rb.ReadAsArray()
-        if np.isnan(old_no_data):
-            mask = np.isnan(data)
-        else:
-            mask = data == old_no_data
-        set_no_data(ds, new_no_data, mask, [band])
+        rbs[band].SetNoDataValue(new_no_data)
+        rbs[band].FlushCache()
+    if mask_band:
+        mb.FlushCache()
 
+    if packed_mask:
+        return packed
     return True
 
 
@@ -0,0 +1,491 @@
+"""
+Tile Cache
+----------
+
+Persistent on disk cache of decoded raster blocks, shared between
+processes. Blocks are stored as .npy files keyed by (path, modification
+time, band, tile size, tile index), so a changed file never returns stale
+blocks. Sizes and last use times of cached blocks are kept in a SQLite
+index in the cache directory.
+
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+import math
+
+import numpy as np
+from osgeo import gdal, gdal_array
+
+## name of SQLite index in cache directory
+INDEX_FILE = 'index.sqlite'
+
+## minimum rows per cached tile, blocks of striped rasters are grouped
+## into tiles of at least this many rows
+MIN_TILE_ROWS = 256
+
+## blocks removed per query when trimming the cache
+TRIM_BATCH = 64
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS blocks (
+        name TEXT PRIMARY KEY, size INTEGER NOT NULL, used REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS blocks_used ON blocks (used)",
+    """CREATE TABLE IF NOT EXISTS total (
+        id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL
+    )""",
+    "INSERT OR IGNORE INTO total VALUES (0, 0)",
+]
+
+
+class TileCache(object):
+    """On disk cache of decoded raster blocks.
+
+    Blocks are written to a temporary file and renamed into place, so
+    readers in other processes only see complete blocks. The index keeps a
+    running total of the cache size, and after each write the least
+    recently used blocks are removed until the cache is within its size
+    budget. Last use times of hits are batched and written to the index
+    every check_every hits.
+
+    Example
+    -------
+    >>> cache = TileCache('/tmp/spicebox_tiles', max_bytes=4 * 1024**3)
+    >>> ds = raster.load_raster('tile.tif', True)
+    >>> data = cache.read_window(ds, 1, 0, 0, 1024, 1024)
+    >>> cache.stats()
+    """
+
+    def __init__(self, cache_dir, max_bytes=1024**3, check_every=256,
+            min_tile_rows=MIN_TILE_ROWS
+        ):
+        """
+        Parameters
+        ----------
+        cache_dir: path
+            directory for cached blocks, created if needed
+        max_bytes: int, default 1024**3
+            size budget of cache directory
+        check_every: int, default 256
+            number of hits between writes of last use times to the index
+        min_tile_rows: int, default MIN_TILE_ROWS
+            minimum rows per cached tile
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.check_every = check_every
+        self.min_tile_rows = min_tile_rows
+        os.makedirs(cache_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self._used = {}
+
+        new_index = not os.path.exists(
+            os.path.join(cache_dir, INDEX_FILE)
+        )
+        if new_index:
+            self._index_files()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_lock'] = None
+        state['_connection'] = None
+        state['_used'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """connection to index for this process, caller must hold lock"""
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(
+                os.path.join(self.cache_dir, INDEX_FILE), timeout=60,
+                check_same_thread=False, isolation_level=None
+            )
+            for statement in _SCHEMA:
+                self._connection.execute(statement)
+            self._pid = os.getpid()
+        return self._connection
+
+    def _index_files(self):
+        """add blocks already in cache directory to a new index"""
+        rows = [
+            (os.path.relpath(path, self.cache_dir), size, mtime)
+                for mtime, size, path in self._files()
+        ]
+        with self._lock:
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany(
+                'INSERT OR IGNORE INTO blocks VALUES (?, ?, ?)', rows
+            )
+            connection.execute(
+                'UPDATE total SET bytes = '
+                '(SELECT COALESCE(SUM(size), 0) FROM blocks)'
+            )
+            connection.execute('COMMIT')
+
+    def _key(self, path, mtime, band, tile_x, tile_y, tile_size):
+        """cache file name for a tile, relative to cache directory"""
+        key = '%s|%r|%i|%i|%i|%i|%i' % (
+            path, mtime, band, tile_x, tile_y, *tile_size
+        )
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(digest[:2], digest + '.npy')
+
+    @staticmethod
+    def source_id(dataset, mode=gdal.GA_ReadOnly):
+        """Get (path, mtime) of a datasets file
+
+        Parameters
+        ----------
+        dataset: gdal.Dataset
+        mode: int, defaults gdal.GA_ReadOnly
+            mode dataset was opened with. GDAL does not report this, so
+            datasets opened with gdal.GA_Update must be passed with
+            mode=gdal.GA_Update; writes to them may not change the mtime
+            until they are flushed
+
+        Returns
+        -------
+        tuple or None
+            None if the dataset should not be cached: it is not a local
+            file, is not opened read only, or is a VRT, whose sources may
+            change without changing the VRT file
+        """
+        if mode != gdal.GA_ReadOnly or \
+                dataset.GetDriver().ShortName in ('VRT', 'MEM'):
+            return None
+        path = dataset.GetDescription()
+        try:
+            return os.path.abspath(path), os.stat(path).st_mtime
+        except (OSError, ValueError):
+            return None
+
+    def tile_size(self, band):
+        """Get the size of cached tiles of a band, its block size with
+        blocks grouped to at least min_tile_rows rows
+
+        Parameters
+        ----------
+        band: gdal.Band
+
+        Returns
+        -------
+        tuple
+            (columns, rows)
+        """
+        size_x, size_y = band.GetBlockSize()
+        rows = size_y * max(1, math.ceil(self.min_tile_rows / size_y))
+        return size_x, rows
+
+    def get(self, source, band, tile_x, tile_y, tile_size):
+        """Get a cached tile
+
+        Parameters
+        ----------
+        source: tuple
+            (path, mtime), see source_id
+        band: int
+        tile_x: int
+        tile_y: int
+            tile column and row
+        tile_size: tuple
+            (columns, rows), see tile_size
+
+        Returns
+        -------
+        np.array or None
+        """
+        name = self._key(*source, band, tile_x, tile_y, tile_size)
+        try:
+            data = np.load(
+                os.path.join(self.cache_dir, name), allow_pickle=False
+            )
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self._used[name] = time.time()
+            if len(self._used) >= self.check_every:
+                self._flush_used()
+        return data
+
+    def _flush_used(self):
+        """write batched last use times to index, caller must hold lock"""
+        if not self._used:
+            return
+        used = [(t, name) for name, t in self._used.items()]
+        self._used = {}
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        connection.executemany(
+            'UPDATE blocks SET used = ? WHERE name = ?', used
+        )
+        connection.execute('COMMIT')
+
+    def put(self, source, band, tile_x, tile_y, tile_size, data):
+        """Add a tile to the cache
+
+        Parameters
+        ----------
+        source: tuple
+            (path, mtime), see source_id
+        band: int
+        tile_x: int
+        tile_y: int
+            tile column and row
+        tile_size: tuple
+            (columns, rows), see tile_size
+        data: np.array
+        """
+        name = self._key(*source, band, tile_x, tile_y, tile_size)
+        path = os.path.join(self.cache_dir, name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as fd:
+                np.save(fd, data, allow_pickle=False)
+            size = os.path.getsize(temp)
+            os.replace(temp, path)
+        except OSError:
+            if os.path.exists(temp):
+                os.remove(temp)
+            return
+
+        with self._lock:
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            old = connection.execute(
+                'SELECT size FROM blocks WHERE name = ?', (name,)
+            ).fetchone()
+            connection.execute(
+                'INSERT OR REPLACE INTO blocks VALUES (?, ?, ?)',
+                (name, size, time.time())
+            )
+            connection.execute(
+                'UPDATE total SET bytes = bytes + ?',
+                (size - (old[0] if old else 0),)
+            )
+            connection.execute('COMMIT')
+            self.writes += 1
+        self.evict()
+
+    def _files(self):
+        """(modification time, size, path) of cached blocks"""
+        files = []
+        for dirpath, dirnames, filenames in os.walk(self.cache_dir):
+            for name in filenames:
+                if not name.endswith('.npy'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def size(self):
+        """Get size of cached blocks in bytes
+
+        Returns
+        -------
+        int
+        """
+        with self._lock:
+            return self._connect().execute(
+                'SELECT bytes FROM total'
+            ).fetchone()[0]
+
+    def evict(self, max_bytes=None):
+        """Remove least recently used blocks until the cache is within its
+        size budget. Only the blocks removed are read from the index
+
+        Parameters
+        ----------
+        max_bytes: int, optional
+            size to evict down to, defaults to max_bytes of cache
+
+        Returns
+        -------
+        int
+            number of blocks removed
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        removed = 0
+        with self._lock:
+            self._flush_used()
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            total = connection.execute(
+                'SELECT bytes FROM total'
+            ).fetchone()[0]
+            while total > max_bytes:
+                rows = connection.execute(
+                    'SELECT name, size FROM blocks ORDER BY used LIMIT ?',
+                    (TRIM_BATCH,)
+                ).fetchall()
+                if len(rows) == 0:
+                    total = 0
+                    break
+                for name, size in rows:
+                    if total <= max_bytes:
+                        break
+                    try:
+                        os.remove(os.path.join(self.cache_dir, name))
+                    except OSError:
+                        pass
+                    connection.execute(
+                        'DELETE FROM blocks WHERE name = ?', (name,)
+                    )
+                    total -= size
+                    removed += 1
+            connection.execute('UPDATE total SET bytes = ?', (total,))
+            connection.execute('COMMIT')
+        self.evictions += removed
+        return removed
+
+    def clear(self):
+        """Remove all cached blocks, including blocks missing from the
+        index
+        """
+        self.evict(0)
+        for mtime, size, path in self._files():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        """Get cache counters for this process
+
+        Returns
+        -------
+        dict
+            'hits', 'misses', 'writes', and 'evictions'
+        """
+        return {
+            'hits': self.hits, 'misses': self.misses,
+            'writes': self.writes, 'evictions': self.evictions
+        }
+
+    def read_tile(
+            self, dataset, band, tile_x, tile_y, source=None,
+            mode=gdal.GA_ReadOnly
+        ):
+        """Read a tile of a band through the cache, see tile_size
+
+        Parameters
+        ----------
+        dataset: gdal.Dataset
+        band: int
+        tile_x: int
+        tile_y: int
+            tile column and row
+        source: tuple, optional
+            (path, mtime), see source_id, found if not given
+        mode: int, defaults gdal.GA_ReadOnly
+            mode dataset was opened with, see source_id
+
+        Returns
+        -------
+        np.array
+            tile data, tiles at the right and bottom edges are cropped to
+            the raster
+        """
+        if source is None:
+            source = self.source_id(dataset, mode)
+        rb = dataset.GetRasterBand(band)
+        tile_size = self.tile_size(rb)
+        if source is not None:
+            data = self.get(source, band, tile_x, tile_y, tile_size)
+            if data is not None:
+                return data
+        size_x, size_y = tile_size
+        xoff, yoff = tile_x * size_x, tile_y * size_y
+        data = rb.ReadAsArray(
+            xoff, yoff,
+            min(size_x, rb.XSize - xoff), min(size_y, rb.YSize - yoff)
+        )
+        if source is not None:
+            self.put(source, band, tile_x, tile_y, tile_size, data)
+        return data
+
+    def read_window(
+            self, dataset, band, xoff, yoff, xsize, ysize,
+            mode=gdal.GA_ReadOnly
+        ):
+        """Read a window of a band from cached tiles, reading and caching
+        tiles that are not cached
+
+        Parameters
+        ----------
+        dataset: gdal.Dataset
+        band: int
+        xoff: int
+        yoff: int
+            window offset in pixels
+        xsize: int
+        ysize: int
+            window size in pixels
+        mode: int, defaults gdal.GA_ReadOnly
+            mode dataset was opened with, see source_id. Windows of
+            datasets that are not opened read only are read from the
+            dataset without caching
+
+        Raises
+        ------
+        ValueError
+            if the window is not inside the raster
+
+        Returns
+        -------
+        np.array
+            (ysize, xsize) array, empty if either size is 0
+        """
+        rb = dataset.GetRasterBand(band)
+        if min(xoff, yoff, xsize, ysize) < 0 or \
+                xoff + xsize > rb.XSize or yoff + ysize > rb.YSize:
+            raise ValueError(
+                'window (%i, %i) of size %i x %i is out of range of %i x %i'
+                ' raster' % (xoff, yoff, xsize, ysize, rb.XSize, rb.YSize)
+            )
+        out = np.empty(
+            (ysize, xsize),
+            dtype=gdal_array.GDALTypeCodeToNumericTypeCode(rb.DataType)
+        )
+        if out.size == 0:
+            return out
+        source = self.source_id(dataset, mode)
+        if source is None:
+            return rb.ReadAsArray(xoff, yoff, xsize, ysize)
+
+        size_x, size_y = self.tile_size(rb)
+        for tile_y in range(yoff // size_y,
+                math.ceil((yoff + ysize) / size_y)):
+            for tile_x in range(xoff // size_x,
+                    math.ceil((xoff + xsize) / size_x)):
+                data = self.read_tile(dataset, band, tile_x, tile_y, source)
+                t_xoff, t_yoff = tile_x * size_x, tile_y * size_y
+                x0, y0 = max(xoff, t_xoff), max(yoff, t_yoff)
+                x1 = min(xoff + xsize, t_xoff + data.shape[1])
+                y1 = min(yoff + ysize, t_yoff + data.shape[0])
+                out[y0 - yoff:y1 - yoff, x0 - xoff:x1 - xoff] = \
+                    data[y0 - t_yoff:y1 - t_yoff, x0 - t_xoff:x1 - t_xoff]
+        return out
@@ -0,0 +1,473 @@
+"""
+Time Series
+-----------
+
+Tools for time series of co-registered rasters
+
+"""
+import os
+import json
+
+import numpy as np
+from osgeo import gdal, gdal_array
+
+from . import raster
+from . import transforms
+
+CUBE_METADATA_EXT = '.json'
+
+def _cube_paths(cube_path):
+    """data and metadata file paths of a cube"""
+    return cube_path, cube_path + CUBE_METADATA_EXT
+
+
+def build_cube(
+        rasters, cube_path, chunk=(64, 64), band=1, dtype=None, 
+        no_data=None, labels=None, max_memory=256 * 1024**2, verbose=False
+    ):
+    """Build an on disk, memory mapped, time series cube from a list of 
+    co-registered rasters. Data is stored in (chunk rows, chunk cols, 
+    chunk height, chunk width, time) order so the time series of a pixel is
+    contiguous and a chunk of pixel time series can be read at once.
+
+    Parameters
+    ----------
+    rasters: list
+        list of paths or gdal.Datasets in time order, all rasters must have 
+        the same size
+    cube_path: path
+        data file to create, metadata is saved to cube_path + '.json'
+    chunk: tuple, default (64, 64)
+        (height, width) of chunks in pixels
+    band: int, default 1
+        band to read from each raster
+    dtype: numpy dtype, optional
+        data type of cube, defaults to the data type of the first raster
+    no_data: number, optional
+        no data value, defaults to the first rasters no data value. Used to
+        fill padding at the edges of the cube
+    labels: list, optional
+        labels for each time step, i.e. years. Must be JSON serializable
+    max_memory: int, default 256 MiB
+        maximum bytes of raster data read at a time
+    verbose: bool, default False
+        if true prints progress messages
+
+    Returns
+    -------
+    RasterCube
+    """
+    datasets = [
+        raster.load_raster(r, True) if type(r) is str else r for r in rasters
+    ]
+    bands = [ds.GetRasterBand(band) for ds in datasets]
+    first = datasets[0]
+    x_size, y_size = first.RasterXSize, first.RasterYSize
+    for idx, ds in enumerate(datasets):
+        if (ds.RasterXSize, ds.RasterYSize) != (x_size, y_size):
+            raise ValueError('raster %i size does not match' % idx)
+
+    if dtype is None:
+        dtype = np.dtype(
+            gdal_array.GDALTypeCodeToNumericTypeCode(bands[0].DataType)
+        )
+    dtype = np.dtype(dtype)
+    if no_data is None:
+        no_data = bands[0].GetNoDataValue()
+
+    n_time = len(bands)
+    c_h, c_w = chunk
+    n_by = int(np.ceil(y_size / c_h))
+    n_bx = int(np.ceil(x_size / c_w))
+
+    data_path, md_path = _cube_paths(cube_path)
+    cube = np.lib.format.open_memmap(
+        data_path, mode='w+', dtype=dtype, shape=(n_by, n_bx, c_h, c_w, n_time)
+    ) 
+
+    # read windows of one chunk row and as many chunk columns as fit in 
+    # max_memory from every raster at once
+    chunk_bytes = c_h * c_w * n_time * dtype.itemsize
+    cols_per_read = max(1, min(n_bx, max_memory // chunk_bytes))
+    window = np.empty([n_time, c_h, cols_per_read * c_w], dtype=dtype)
+    for by in range(n_by):
+        yoff = by * c_h
+        ysize = min(c_h, y_size - yoff)
+        for bx in range(0, n_bx, cols_per_read):
+            n_cols = min(cols_per_read, n_bx - bx)
+            xoff = bx * c_w
+            xsize = min(n_cols * c_w, x_size - xoff)
+            win = window[:, :, :n_cols * c_w]
+            if no_data is not None:
+                win[:] = no_data
+            else:
+                win[:] = 0
+            for t, rb in enumerate(bands):
+                win[t, :ysize, :xsize] = rb.ReadAsArray(
+                    xoff, yoff, xsize, ysize
+                )
+            # (t, h, n_cols * w) -> (n_cols, h, w, t)
+            cube[by, bx:bx + n_cols] = win.reshape(
+                n_time, c_h, n_cols, c_w
+            ).transpose(2, 1, 3, 0)
+        if verbose:
+            print('Ingested chunk row %i of %i' % (by + 1, n_by))
+    cube.flush()
+    del cube
+
+    metadata = {
+        'shape': [n_time, y_size, x_size],
+        'chunk': [c_h, c_w],
+        'dtype': dtype.str,
+        'no_data': no_data,
+        'transform': list(first.GetGeoTransform()),
+        'projection': first.GetProjection(),
+        'labels': list(labels) if labels is not None else list(range(n_time)),
+        'sources': [ds.GetDescription() for ds in datasets],
+    }
+    with open(md_path, 'w') as fd:
+        json.dump(metadata, fd)
+
+    return RasterCube(cube_path)
+
+
+class RasterCube(object):
+    """Reader for time series cubes created by build_cube. Only the chunks
+    containing the requested pixels are read from disk.
+    """
+
+    def __init__(self, cube_path, mode='r'):
+        """
+        Parameters
+        ----------
+        cube_path: path
+            cube data file
+        mode: str, default 'r'
+            memory map mode, 'r' or 'r+'
+        """
+        data_path, md_path = _cube_paths(cube_path)
+        with open(md_path, 'r') as fd:
+            self.metadata = json.load(fd)
+        self.data = np.load(data_path, mmap_mode=mode)
+        self.shape = tuple(self.metadata['shape'])
+        self.chunk = tuple(self.metadata['chunk'])
+        self.transform = tuple(self.metadata['transform'])
+        self.projection = self.metadata['projection']
+        self.no_data = self.metadata['no_data']
+        self.labels = self.metadata['labels']
+
+    def series(self, row, col):
+        """Get the time series of a pixel
+
+        Parameters
+        ----------
+        row: int
+        col: int
+
+        Returns
+        -------
+        np.array
+            (T,) time series
+        """
+        if not (0 <= row < self.shape[1] and 0 <= col < self.shape[2]):
+            raise IndexError('pixel (%i, %i) is outside cube' % (row, col))
+        c_h, c_w = self.chunk
+        return np.array(
+            self.data[row // c_h, col // c_w, row % c_h, col % c_w]
+        )
+
+    def series_at(self, x, y):
+        """Get the time series of the pixel containing a geographic 
+        coordinate in the cubes projection
+
+        Parameters
+        ----------
+        x: number
+        y: number
+
+        Returns
+        -------
+        np.array
+            (T,) time series
+        """
+        row, col = transforms.to_pixel((x, y), self.transform)
+        return self.series(int(np.floor(row)), int(np.floor(col)))
+
+    def subcube(self, row, col, height, width):
+        """Get the time series of a block of pixels
+
+        Parameters
+        ----------
+        row: int
+        col: int
+            top left pixel
+        height: int
+        width: int
+
+        Returns
+        -------
+        np.array
+            (T, height, width) data
+        """
+        if row < 0 or col < 0 or row + height > self.shape[1] or \
+                col + width > self.shape[2]:
+            raise IndexError('subcube is outside cube')
+        c_h, c_w = self.chunk
+        by0, by1 = row // c_h, (row + height - 1) // c_h + 1
+        bx0, bx1 = col // c_w, (col + width - 1) // c_w + 1
+        # (by, bx, h, w, t) -> (t, by, h, bx, w) -> (t, rows, cols)
+        block = np.array(self.data[by0:by1, bx0:bx1])
+        block = block.transpose(4, 0, 2, 1, 3).reshape(
+            self.shape[0], (by1 - by0) * c_h, (bx1 - bx0) * c_w
+        )
+        r0 = row - by0 * c_h
+        c0 = col - bx0 * c_w
+        return block[:, r0:r0 + height, c0:c0 + width]
+
+    def get_zoom_geotransform(self, row, col):
+        """geotransform of a subcube with top left pixel (row, col)
+
+        Returns
+        -------
+        tuple
+        """
+        return raster.get_zoom_geotransform(
+            {'transform': self.transform}, (row, col), 0
+        )
+
+
+STD_CLASS_LABELS = [
+    '<= Average', '> Average', '> 1 Std. Dev.', '> 2 Std. Dev.'
+]
+
+class ClimatologyAccumulator(object):
+    """Streaming per pixel climatology (mean and standard deviation) of a 
+    series of co-registered rasters. Rasters are added one at a time and 
+    processed block by block, the running count, mean, and sum of squared 
+    differences (M2, Welford's algorithm) are kept in float64 memory mapped 
+    scratch files, so memory use does not depend on the number of rasters
+    or their size.
+    """
+
+    def __init__(self, template, scratch_dir, band=1, min_pixels=1024*1024):
+        """
+        Parameters
+        ----------
+        template: path or gdal.Dataset
+            raster with the grid of the series
+        scratch_dir: path
+            directory for scratch files
+        band: int, default 1
+            band to read from each raster
+        min_pixels: int, default 1024*1024
+            minimum pixels per block
+        """
+        ds = raster.load_raster(template, True) if type(template) is str \
+            else template
+        self.x_size, self.y_size = ds.RasterXSize, ds.RasterYSize
+        self.transform = ds.GetGeoTransform()
+        self.projection = ds.GetProjection()
+        self.band = band
+        self.windows = list(raster.band_windows(
+            ds.GetRasterBand(band), min_pixels
+        ))
+        self.n_rasters = 0
+
+        os.makedirs(scratch_dir, exist_ok=True)
+        shape = (self.y_size, self.x_size)
+        self.count = np.lib.format.open_memmap(
+            os.path.join(scratch_dir, 'count.npy'), 'w+', np.uint32, shape
+        )
+        self.mean = np.lib.format.open_memmap(
+            os.path.join(scratch_dir, 'mean.npy'), 'w+', np.float64, shape
+        )
+        self.m2 = np.lib.format.open_memmap(
+            os.path.join(scratch_dir, 'm2.npy'), 'w+', np.float64, shape
+        )
+
+    def _band(self, in_raster):
+        """open band of a raster in the series"""
+        ds = raster.load_raster(in_raster, True) if type(in_raster) is str \
+            else in_raster
+        if (ds.RasterXSize, ds.RasterYSize) != (self.x_size, self.y_size):
+            raise ValueError('raster size does not match climatology grid')
+        return ds, ds.GetRasterBand(self.band)
+
+    def add(self, in_raster):
+        """Add a raster to the climatology
+
+        Parameters
+        ----------
+        in_raster: path or gdal.Dataset
+        """
+        ds, rb = self._band(in_raster)
+        is_no_data = raster.no_data_mask_function(rb.GetNoDataValue())
+        for xoff, yoff, xsize, ysize in self.windows:
+            data = rb.ReadAsArray(xoff, yoff, xsize, ysize).astype(np.float64)
+            valid = ~(is_no_data(data) | np.isnan(data))
+            win = (slice(yoff, yoff + ysize), slice(xoff, xoff + xsize))
+            count = self.count[win]
+            mean = self.mean[win]
+            m2 = self.m2[win]
+
+            count += valid
+            delta = data - mean
+            np.divide(delta, count, out=data, where=valid)
+            np.add(mean, data, out=mean, where=valid)
+            # delta * (x - new mean)
+            np.multiply(delta, delta - data, out=delta)
+            np.add(m2, delta, out=m2, where=valid)
+        self.n_rasters += 1
+
+    def _write(self, out_raster, calc, datatype=gdal.GDT_Float32, 
+            no_data=np.nan
+        ):
+        """write a raster calculated from the accumulators block by block"""
+        out_ds = raster.create_empty_raster(
+            out_raster, self.x_size, self.y_size, self.transform, 
+            self.projection, datatype=datatype, no_data=no_data
+        )
+        out_band = out_ds.GetRasterBand(1)
+        for xoff, yoff, xsize, ysize in self.windows:
+            win = (slice(yoff, yoff + ysize), slice(xoff, xoff + xsize))
+            out_band.WriteArray(calc(win, xoff, yoff, xsize, ysize), xoff, yoff)
+        out_band.FlushCache()
+        out_ds.FlushCache()
+        return out_ds
+
+    def _mean(self, win):
+        """mean for a window with nan where there is no data"""
+        mean = np.array(self.mean[win])
+        mean[self.count[win] == 0] = np.nan
+        return mean
+
+    def _std(self, win, ddof=0):
+        """standard deviation for a window with nan where undefined"""
+        count = self.count[win].astype(np.float64) - ddof
+        with np.errstate(divide='ignore', invalid='ignore'):
+            std = np.sqrt(self.m2[win] / count)
+        std[count <= 0] = np.nan
+        return std
+
+    def write_mean(self, out_raster):
+        """Write the per pixel mean
+
+        Parameters
+        ----------
+        out_raster: path
+
+        Returns
+        -------
+        gdal.Dataset
+        """
+        return self._write(out_raster, lambda win, *_: self._mean(win))
+
+    def write_std(self, out_raster, ddof=0):
+        """Write the per pixel standard deviation
+
+        Parameters
+        ----------
+        out_raster: path
+        ddof: int, default 0
+            delta degrees of freedom, 1 for sample standard deviation
+
+        Returns
+        -------
+        gdal.Dataset
+        """
+        return self._write(
+            out_raster, lambda win, *_: self._std(win, ddof)
+        )
+
+    def write_anomaly(self, in_raster, out_raster, kind='anomaly', ddof=0):
+        """Write the departure of a raster from the climatology
+
+        Parameters
+        ----------
+        in_raster: path or gdal.Dataset
+            raster on the climatology grid, i.e. one year of the series
+        out_raster: path
+        kind: str, default 'anomaly'
+            'anomaly' for the difference from the mean, 'std_anomaly' for 
+            the difference in standard deviations, or 'std_class' for 
+            classes 0 to 3 as in STD_CLASS_LABELS (255 is no data)
+        ddof: int, default 0
+            delta degrees of freedom for standard deviation
+
+        Returns
+        -------
+        gdal.Dataset
+        """
+        ds, rb = self._band(in_raster)
+        is_no_data = raster.no_data_mask_function(rb.GetNoDataValue())
+
+        def calc(win, xoff, yoff, xsize, ysize):
+            data = rb.ReadAsArray(xoff, yoff, xsize, ysize).astype(np.float64)
+            data[is_no_data(data)] = np.nan
+            anomaly = data - self._mean(win)
+            if kind == 'anomaly':
+                return anomaly
+            with np.errstate(divide='ignore', invalid='ignore'):
+                std_anomaly = anomaly / self._std(win, ddof)
+            if kind == 'std_anomaly':
+                return std_anomaly
+            classes = np.full(anomaly.shape, 255, dtype=np.uint8)
+            classes[anomaly <= 0] = 0
+            classes[anomaly > 0] = 1
+            classes[std_anomaly > 1] = 2
+            classes[std_anomaly > 2] = 3
+            return classes
+
+        if kind == 'std_class':
+            return self._write(out_raster, calc, gdal.GDT_Byte, 255)
+        elif kind in ('anomaly', 'std_anomaly'):
+            return self._write(out_raster, calc)
+        raise ValueError('unknown anomaly kind %s' % kind)
+
+
+def calc_climatology(
+        rasters, scratch_dir, mean_raster=None, std_raster=None, 
+        anomaly_rasters=None, kind='anomaly', ddof=0, verbose=False
+    ):
+    """Calculate the climatology of a series of rasters in one streaming 
+    pass and optionally write mean, standard deviation, and per raster 
+    anomalies in a second streaming pass.
+
+    Parameters
+    ----------
+    rasters: list
+        list of paths or gdal.Datasets
+    scratch_dir: path
+        directory for scratch files
+    mean_raster: path, optional
+    std_raster: path, optional
+        outputs to write
+    anomaly_rasters: list, optional
+        output path for the anomaly of each raster in rasters
+    kind: str, default 'anomaly'
+        anomaly type see ClimatologyAccumulator.write_anomaly
+    ddof: int, default 0
+        delta degrees of freedom for standard deviation
+    verbose: bool, default False
+        if true prints progress messages
+
+    Returns
+    -------
+    ClimatologyAccumulator
+    """
+    acc = ClimatologyAccumulator(rasters[0], scratch_dir)
+    for idx, in_raster in enumerate(rasters):
+        acc.add(in_raster)
+        if verbose:
+            print('Added raster %i of %i' % (idx + 1, len(rasters)))
+
+    if mean_raster:
+        acc.write_mean(mean_raster)
+    if std_raster:
+        acc.write_std(std_raster, ddof)
+    if anomaly_rasters:
+        for in_raster, out_raster in zip(rasters, anomaly_rasters):
+            acc.write_anomaly(in_raster, out_raster, kind, ddof)
+            if verbose:
+                print('Wrote %s' % out_raster)
+    return acc
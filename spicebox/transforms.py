@@ -9,6 +9,11 @@ import numpy as np
 from osgeo import gdal
 from osgeo.osr import SpatialReference, CoordinateTransformation
 
+try:
+    from osgeo.osr import OAMS_TRADITIONAL_GIS_ORDER
+except ImportError: # gdal < 3
+    OAMS_TRADITIONAL_GIS_ORDER = None
+
 
 def to_pixel (coords, gt):
     """Convert from geographic coordinates (ie. Alaska Albers [east,north]) 
@@ -156,6 +161,27 @@ def convert_projections(points, in_crs, out_crs):
     
     return np.array(transform.TransformPoints(points))[:,:-1].reshape(shape)
 
+def coordinate_transformation(in_crs, out_crs):
+    """Create coordinate transformation between two CRSs using 
+    x/y (east/north, or lon/lat) axis order for both
+
+    Parameters
+    ----------
+    in_crs: str, int, or SpatialReference
+    out_crs: str, int, or SpatialReference
+        These arguments are passed through format_crs
+
+    Returns
+    -------
+    CoordinateTransformation
+    """
+    in_crs = format_crs(in_crs).Clone()
+    out_crs = format_crs(out_crs).Clone()
+    if hasattr(in_crs, 'SetAxisMappingStrategy'): # gdal >= 3
+        in_crs.SetAxisMappingStrategy(OAMS_TRADITIONAL_GIS_ORDER)
+        out_crs.SetAxisMappingStrategy(OAMS_TRADITIONAL_GIS_ORDER)
+    return CoordinateTransformation(in_crs, out_crs)
+
 def to_wgs84(points, in_crs):
     """Converts point or list of points to WGS84 (EPSG:4236) (lat, long) format
 
@@ -1,11 +1,18 @@
 from osgeo import ogr
 import json
+import os
+from multiprocessing import Pool
 from pandas import DataFrame
 import numpy as np
 import geojson
 
 from scipy.spatial import ConvexHull
 
+from matplotlib.path import Path
+from matplotlib.collections import PathCollection, LineCollection
+
+from . import transforms
+
 def load_vector(in_vec_file):
     """Open a vector file readable by ogr
 
@@ -164,6 +171,179 @@ def save_vector(data_source):
     data_source.FlushCache()
 
 
+FIELD_TYPE_LOOKUP = {
+    'i': ogr.OFTInteger64,
+    'u': ogr.OFTInteger64,
+    'b': ogr.OFTInteger,
+    'f': ogr.OFTReal,
+}
+
+WKB_TYPE_LOOKUP = {
+    ogr.wkbPoint: 1,
+    ogr.wkbLineString: 2,
+    ogr.wkbPolygon: 3,
+}
+
+def coords_to_geometries(coords, offsets, geom_type=ogr.wkbPolygon):
+    """Create geometries from a flat array of coordinates. Geometries are
+    built from WKB so no per vertex python calls are made.
+
+    Parameters
+    ----------
+    coords: np.array
+        [[x1,y1], [x2,y2], ... , [xN,yN]] coordinates of all geometries
+    offsets: list like
+        start index of each geometry in coords followed by len(coords). 
+        i.e. geometry i is coords[offsets[i]:offsets[i+1]]
+    geom_type: int, default ogr.wkbPolygon
+        ogr.wkbPoint, ogr.wkbLineString, or ogr.wkbPolygon. Polygons 
+        are created with a single ring that is closed if needed.
+
+    Returns
+    -------
+    list of ogr.Geometry
+    """
+    if geom_type not in WKB_TYPE_LOOKUP:
+        raise NotImplementedError(
+            'creating geometry type %s is not implemented' % geom_type
+        )
+    coords = np.ascontiguousarray(np.asarray(coords, dtype='<f8')[:, :2])
+    offsets = np.asarray(offsets, dtype=int)
+    header = np.array([1], dtype='u1').tobytes() + \
+        np.array([WKB_TYPE_LOOKUP[geom_type]], dtype='<u4').tobytes()
+
+    geometries = []
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        pts = coords[start:end]
+        if geom_type == ogr.wkbPoint:
+            body = pts[0].tobytes()
+        elif geom_type == ogr.wkbLineString:
+            body = np.array([len(pts)], dtype='<u4').tobytes() + pts.tobytes()
+        else:
+            if not (pts[0] == pts[-1]).all():
+                pts = np.concatenate([pts, pts[:1]])
+            body = np.array([1, len(pts)], dtype='<u4').tobytes() + \
+                pts.tobytes()
+        geometries.append(ogr.CreateGeometryFromWkb(header + body))
+    return geometries
+
+
+def write_features(
+        file_name, geometries=None, fields={}, layer_name=None, crs=None, 
+        geom_type=None, driver_name='GPKG', batch_size=10000, 
+        spatial_index=True, layer_options=[], verbose=False, 
+        coords=None, offsets=None
+    ):
+    """Bulk write features to a new vector data source. Features are inserted
+    in batches, each batch in a single transaction, which is much faster than
+    creating and saving features one at a time with create_new_feature.
+
+    Parameters
+    ----------
+    file_name: str
+        a path to the new file to create
+    geometries: list, optional
+        list of ogr.Geometry, required unless coords and offsets are given
+    fields: dict, default {}
+        dict of field names to list like column of values, one per geometry.
+        Field types are found from numpy data types (int, float, or string)
+    layer_name: str, optional
+        name of layer to create, if None the file name is used
+    crs: str, int, or SpatialReference, optional
+        CRS of geometries, passed through transforms.format_crs
+    geom_type: int, optional
+        ogr geometry type. If None, the type of the first geometry is used, or 
+        ogr.wkbPolygon if coords and offsets are given
+    driver_name: str, default 'GPKG'
+        vector driver recognized by ogr.GetDriverByName
+    batch_size: int, default 10000
+        number of features to insert per transaction
+    spatial_index: bool, default True
+        create a spatial index for the layer
+    layer_options: list, default []
+        extra layer creation options, i.e. ['FID=fid']
+    verbose: bool, default False
+        if true prints progress messages
+    coords: np.array, optional
+    offsets: list like, optional
+        coordinates and offsets of geometries as described in 
+        coords_to_geometries, used instead of geometries
+
+    Raises
+    ------
+    ValueError
+        if both or neither of geometries and coords/offsets are given
+
+    Returns
+    -------
+    ogr.DataSource
+    """
+    if (coords is None) != (offsets is None):
+        raise ValueError('coords and offsets must be given together')
+    if (geometries is None) == (coords is None):
+        raise ValueError('give either geometries or coords and offsets')
+
+    if coords is not None:
+        if geom_type is None:
+            geom_type = ogr.wkbPolygon
+        geometries = coords_to_geometries(coords, offsets, geom_type)
+    elif geom_type is None:
+        geom_type = geometries[0].GetGeometryType() if len(geometries) > 0 \
+            else ogr.wkbUnknown
+
+    columns = {}
+    for name in fields:
+        columns[name] = np.asarray(fields[name])
+        if len(columns[name]) != len(geometries):
+            raise ValueError(
+                'field %s does not have one value per geometry' % name
+            )
+
+    if layer_name is None:
+        layer_name = os.path.splitext(os.path.split(file_name)[1])[0]
+
+    srs = None if crs is None else transforms.format_crs(crs)
+
+    options = list(layer_options)
+    if driver_name == 'GPKG':
+        options.append('SPATIAL_INDEX=%s' % ('YES' if spatial_index else 'NO'))
+
+    data_source = create_new_data_source(file_name, driver_name)
+    layer = data_source.CreateLayer(layer_name, srs, geom_type, options)
+
+    for name in columns:
+        field_type = FIELD_TYPE_LOOKUP.get(columns[name].dtype.kind, 
+            ogr.OFTString
+        )
+        layer.CreateField(ogr.FieldDefn(name, field_type))
+    
+    feat_def = layer.GetLayerDefn()
+    field_idx = {name: feat_def.GetFieldIndex(name) for name in columns}
+    py_columns = {name: columns[name].tolist() for name in columns}
+    
+    n_features = len(geometries)
+    for start in range(0, n_features, batch_size):
+        data_source.StartTransaction()
+        for idx in range(start, min(start + batch_size, n_features)):
+            feat = ogr.Feature(feat_def)
+            feat.SetGeometry(geometries[idx])
+            for name in py_columns:
+                feat.SetField(field_idx[name], py_columns[name][idx])
+            layer.CreateFeature(feat)
+        data_source.CommitTransaction()
+        if verbose:
+            print(
+                'Wrote %i of %i features' % \
+                (min(start + batch_size, n_features), n_features)
+            )
+
+    if spatial_index and driver_name == 'ESRI Shapefile':
+        data_source.ExecuteSQL('CREATE SPATIAL INDEX ON %s' % layer_name)
+
+    save_vector(data_source)
+    return data_source
+
+
 def get(dataset, layer, feature=None):
     """
     get the targer layer, or feature from a data set
@@ -225,8 +405,13 @@ def plot_geometry(geometry, ax, gt=None):
     -------
     matplotlib compatible axis
 
+    See plot_layer for plotting many geometries at once
     """
 
+    if type(geometry) is ogr.Geometry and \
+            geometry.GetGeometryName() == 'MULTIPOLYGON':
+        return plot_layer([geometry], ax, simplify=False, edgecolor='C0')
+
     if type(geometry) is ogr.Geometry:
         gt, pts = geometry_to_array(geometry)
     else:
@@ -234,10 +419,507 @@ def plot_geometry(geometry, ax, gt=None):
 
     if gt == 'POLYGON':
         ax.plot(pts.T[0], pts.T[1])
-
     else:
         raise NotImplementedError('plotting of %s is not implemented' % gt)
 
     return ax 
 
 
+def _signed_area(ring):
+    """Signed area of a ring using the shoelace formula. Positive values
+    indicate counter clockwise rings.
+
+    Parameters
+    ----------
+    ring: np.array
+        [[x1,y1], [x2,y2], ...] ring coordinates
+
+    Returns
+    -------
+    float
+    """
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * (np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1]))
+
+
+def rings_to_path(rings):
+    """Build a single matplotlib Path from a list of polygon rings. The 
+    first ring of each polygon is the exterior, the rest are holes. Ring
+    orientation is normalized (exterior counter clockwise, holes clockwise) 
+    so holes are not filled.
+
+    Parameters
+    ----------
+    rings: list
+        list of polygons, where each polygon is a list of np.arrays of 
+        ring coordinates [[x1,y1], [x2,y2], ...]
+
+    Returns
+    -------
+    matplotlib.path.Path
+    """
+    vertices = []
+    codes = []
+    for polygon in rings:
+        for idx, ring in enumerate(polygon):
+            ring = np.asarray(ring, dtype=float)[:, :2]
+            if len(ring) < 3:
+                continue
+            ccw = _signed_area(ring) > 0
+            if (idx == 0) != ccw:
+                ring = ring[::-1]
+            ring_codes = np.full(len(ring), Path.LINETO, dtype=Path.code_type)
+            ring_codes[0] = Path.MOVETO
+            ring_codes[-1] = Path.CLOSEPOLY
+            vertices.append(ring)
+            codes.append(ring_codes)
+
+    if len(vertices) == 0:
+        return Path(np.empty([0, 2]))
+    return Path(np.concatenate(vertices), np.concatenate(codes))
+
+
+def geometry_to_rings(geometry):
+    """Get the rings, or line parts, of a geometry as lists of point arrays
+
+    Parameters
+    ----------
+    geometry: ogr.Geometry
+        POLYGON, MULTIPOLYGON, LINESTRING, or MULTILINESTRING geometry
+
+    Returns
+    -------
+    str, list
+        'polygon' and list of polygons (lists of ring arrays) or 
+        'line' and list of line arrays. Empty parts and rings, which 
+        simplification can produce, are left out
+    """
+    gt = geometry.GetGeometryName()
+
+    if gt in ('POLYGON', 'LINESTRING'):
+        parts = [geometry]
+    elif gt in ('MULTIPOLYGON', 'MULTILINESTRING'):
+        parts = [
+            geometry.GetGeometryRef(i) 
+                for i in range(geometry.GetGeometryCount())
+        ]
+    else:
+        raise NotImplementedError('%s Not implented' % gt)
+    parts = [part for part in parts if not part.IsEmpty()]
+
+    if gt in ('LINESTRING', 'MULTILINESTRING'):
+        return 'line', [np.array(part.GetPoints())[:, :2] for part in parts]
+
+    polygons = []
+    for part in parts:
+        rings = [
+            part.GetGeometryRef(i) for i in range(part.GetGeometryCount())
+        ]
+        polygons.append([
+            np.array(ring.GetPoints()) for ring in rings if not ring.IsEmpty()
+        ])
+    return 'polygon', polygons
+
+
+def geometry_to_path(geometry):
+    """Convert a POLYGON or MULTIPOLYGON geometry to a matplotlib Path, 
+    holes and multiple parts are included.
+
+    Parameters
+    ----------
+    geometry: ogr.Geometry
+
+    Returns
+    -------
+    matplotlib.path.Path
+    """
+    kind, rings = geometry_to_rings(geometry)
+    if kind != 'polygon':
+        raise NotImplementedError(
+            '%s Not implented' % geometry.GetGeometryName()
+        )
+    return rings_to_path(rings)
+
+
+def screen_resolution(ax, extent):
+    """Find the size of a screen pixel in map units for axes showing extent
+
+    Parameters
+    ----------
+    ax: matplotlib axes
+    extent: tuple
+        (minX, maxX, minY, maxY) as returned by ogr.Layer.GetExtent
+
+    Returns
+    -------
+    float
+        map units per pixel
+    """
+    bbox = ax.get_window_extent()
+    width = max(bbox.width, 1)
+    height = max(bbox.height, 1)
+    return max(
+        (extent[1] - extent[0]) / width, (extent[3] - extent[2]) / height
+    )
+
+
+def plot_layer(layer, ax, simplify=True, facecolor='none', 
+        edgecolor='black', linewidth=0.5, **kwargs
+    ):
+    """Plot all features in a layer on matplotlib axes using a single
+    collection for polygons and a single collection for lines. This is 
+    much faster than calling plot_geometry for each feature.
+
+    Parameters
+    ----------
+    layer: ogr.Layer or list
+        layer, or list of ogr.Geometry/ogr.Feature objects, to plot
+    ax: matplotlib axes
+    simplify: bool or float, default True
+        If True geometry is simplified to the screen resolution of ax before
+        drawing. If a float, the value is used as the simplification 
+        tolerance in map units. If False geometry is not simplified.
+    facecolor: color, default 'none'
+        polygon fill color
+    edgecolor: color, default 'black'
+    linewidth: float, default 0.5
+    kwargs:
+        other keyword arguments passed to the matplotlib collections
+
+    Returns
+    -------
+    matplotlib compatible axis
+    """
+    geometries = []
+    for item in layer:
+        geom = item if type(item) is ogr.Geometry else item.GetGeometryRef()
+        if geom is not None:
+            ## clone so the geometry outlives its feature
+            geometries.append(geom.Clone())
+
+    if len(geometries) == 0:
+        return ax
+
+    tolerance = 0
+    if simplify is True:
+        if hasattr(layer, 'GetExtent'):
+            extent = layer.GetExtent()
+        else:
+            envs = np.array([g.GetEnvelope() for g in geometries])
+            extent = (
+                envs[:,0].min(), envs[:,1].max(), 
+                envs[:,2].min(), envs[:,3].max()
+            )
+        tolerance = screen_resolution(ax, extent)
+    elif simplify:
+        tolerance = float(simplify)
+
+    paths = []
+    lines = []
+    for geom in geometries:
+        if tolerance > 0:
+            geom = geom.SimplifyPreserveTopology(tolerance)
+        try:
+            kind, rings = geometry_to_rings(geom)
+        except NotImplementedError:
+            continue
+        if kind == 'polygon':
+            paths.append(rings_to_path(rings))
+        else:
+            lines += rings
+
+    if len(paths) > 0:
+        ax.add_collection(PathCollection(
+            paths, facecolors=facecolor, edgecolors=edgecolor, 
+            linewidths=linewidth, **kwargs
+        ))
+    if len(lines) > 0:
+        ax.add_collection(LineCollection(
+            lines, colors=edgecolor, linewidths=linewidth, **kwargs
+        ))
+    ax.autoscale_view()
+
+    return ax
+
+
+
+
+def _geometry_structure_(geometry, coords):
+    """Walk a geometry, appending vertex arrays to coords and returning the
+    nested structure needed to rebuild it with _structure_to_wkb_
+
+    Parameters
+    ----------
+    geometry: ogr.Geometry
+    coords: list
+        list that vertex arrays are appended to
+
+    Returns
+    -------
+    tuple
+        (wkb type, number of points) or (wkb type, [child structures])
+    """
+    gt = ogr.GT_Flatten(geometry.GetGeometryType())
+    if gt in (ogr.wkbPoint, ogr.wkbLineString, ogr.wkbLinearRing):
+        pts = geometry.GetPoints()
+        pts = np.empty([0, 2]) if pts is None else np.array(pts)[:, :2]
+        coords.append(pts)
+        return gt, len(pts)
+    return gt, [
+        _geometry_structure_(geometry.GetGeometryRef(i), coords)
+            for i in range(geometry.GetGeometryCount())
+    ]
+
+
+def _structure_to_wkb_(structure, coords, start=0, ring=False):
+    """Build WKB from a geometry structure and a flat coordinate array
+
+    Parameters
+    ----------
+    structure: tuple
+        as returned by _geometry_structure_
+    coords: np.array
+        little endian float64 [[x1,y1], ... , [xN,yN]] coordinates
+    start: int
+        index of first vertex of the structure in coords
+    ring: bool, default False
+        True for the rings of a polygon, which are written as a point count
+        and points without a byte order or type. OGR reports polygon rings
+        as line strings, so this comes from the parent type
+
+    Returns
+    -------
+    bytes, int
+        wkb, index of the next unused vertex
+    """
+    gt, parts = structure
+    if ring or gt == ogr.wkbLinearRing:
+        end = start + parts
+        return np.array([parts], dtype='<u4').tobytes() + \
+            coords[start:end].tobytes(), end
+
+    header = b'\x01' + np.array([gt], dtype='<u4').tobytes()
+    if gt == ogr.wkbPoint:
+        end = start + parts
+        return header + coords[start:end].tobytes(), end
+    if gt == ogr.wkbLineString:
+        end = start + parts
+        return header + np.array([parts], dtype='<u4').tobytes() + \
+            coords[start:end].tobytes(), end
+
+    body = [header, np.array([len(parts)], dtype='<u4').tobytes()]
+    for part in parts:
+        wkb, start = _structure_to_wkb_(
+            part, coords, start, ring=gt == ogr.wkbPolygon
+        )
+        body.append(wkb)
+    return b''.join(body), start
+
+
+def _reproject_geometries_(geometries, transform):
+    """Reproject geometries with a single bulk coordinate transformation
+
+    Parameters
+    ----------
+    geometries: list
+        list of ogr.Geometry, None values are allowed
+    transform: osr.CoordinateTransformation
+
+    Returns
+    -------
+    list of WKB (bytes or None)
+    """
+    coords = []
+    structures = []
+    for geom in geometries:
+        if geom is None:
+            structures.append(None)
+            continue
+        structures.append(_geometry_structure_(geom, coords))
+
+    if len(coords) > 0 and sum(len(c) for c in coords) > 0:
+        coords = np.concatenate(coords)
+        coords = np.array(transform.TransformPoints(coords))[:, :2]
+    else: 
+        coords = np.empty([0, 2])
+    coords = np.ascontiguousarray(coords, dtype='<f8')
+
+    wkbs = []
+    start = 0
+    for struct in structures:
+        if struct is None:
+            wkbs.append(None)
+            continue
+        wkb, start = _structure_to_wkb_(struct, coords, start)
+        wkbs.append(wkb)
+    return wkbs
+
+
+def _reproject_chunk_(args):
+    """Reproject a chunk of features from a layer on disk, used by 
+    reproject_layer worker processes.
+
+    Parameters
+    ----------
+    args: tuple
+        (vector path, layer index, in_crs WKT, out_crs WKT, 
+        first feature index, number of features, read fields)
+
+    Returns
+    -------
+    list of WKB (bytes or None), list of field value lists (empty if 
+    fields are not read)
+    """
+    in_vector, layer_idx, in_wkt, out_wkt, start, count, with_fields = args
+    data_source = load_vector(in_vector)
+    layer = data_source.GetLayer(layer_idx)
+    n_fields = layer.GetLayerDefn().GetFieldCount()
+    layer.SetNextByIndex(start)
+    geometries = []
+    fields = []
+    for _ in range(count):
+        feat = layer.GetNextFeature()
+        if feat is None:
+            break
+        geom = feat.GetGeometryRef()
+        geometries.append(None if geom is None else geom.Clone())
+        if with_fields:
+            fields.append([
+                None if not feat.IsFieldSetAndNotNull(idx) \
+                    else feat.GetField(idx) for idx in range(n_fields)
+            ])
+
+    transform = transforms.coordinate_transformation(in_wkt, out_wkt)
+    return _reproject_geometries_(geometries, transform), fields
+
+
+def reproject_layer(
+        in_vector, out_crs, out_file=None, layer=0, in_crs=None, 
+        chunk_size=50000, workers=1, driver_name='GPKG', verbose=False
+    ):
+    """Reproject all features in a layer. Coordinates of each chunk of 
+    features are extracted to a flat array and transformed in a single call
+    using one coordinate transformation. Output geometries are 2D.
+
+    Parameters
+    ----------
+    in_vector: path or ogr.DataSource
+        vector data
+    out_crs: str, int, or SpatialReference
+        CRS to reproject to, passed through transforms.format_crs
+    out_file: path, optional
+        If provided a new data source is created with the reprojected 
+        features and their fields, otherwise the reprojected geometries are 
+        returned as a list
+    layer: int, default 0
+        layer number
+    in_crs: str, int, or SpatialReference, optional
+        input CRS, if None the layers spatial reference is used
+    chunk_size: int, default 50000
+        number of features transformed at a time
+    workers: int, default 1
+        number of processes used to reproject chunks, in_vector must be a 
+        path if workers > 1
+    driver_name: str, default 'GPKG'
+        vector driver recognized by ogr.GetDriverByName
+    verbose: bool, default False
+        if true prints progress messages
+
+    Returns
+    -------
+    ogr.DataSource or list of ogr.Geometry
+    """
+    if type(in_vector) is str:
+        data_source = load_vector(in_vector)
+    else:
+        data_source = in_vector
+        if workers > 1:
+            raise TypeError('in_vector must be a path if workers > 1')
+    src_layer = data_source.GetLayer(layer)
+
+    if in_crs is None:
+        in_crs = src_layer.GetSpatialRef()
+        if in_crs is None:
+            raise TypeError('in_crs must be provided for layers without CRS')
+    in_crs = transforms.format_crs(in_crs)
+    out_crs = transforms.format_crs(out_crs)
+
+    n_features = src_layer.GetFeatureCount()
+    starts = list(range(0, n_features, chunk_size))
+
+    if workers > 1:
+        jobs = [
+            (in_vector, layer, in_crs.ExportToWkt(), out_crs.ExportToWkt(), 
+                start, chunk_size, out_file is not None) 
+            for start in starts
+        ]
+        pool = Pool(workers)
+        results = pool.imap(_reproject_chunk_, jobs)
+    else:
+        transform = transforms.coordinate_transformation(in_crs, out_crs)
+
+    if out_file is None:
+        out_ds = None
+        geometries = []
+    else:
+        out_ds = create_new_data_source(out_file, driver_name)
+        out_layer = out_ds.CreateLayer(
+            src_layer.GetName(), out_crs, 
+            ogr.GT_Flatten(src_layer.GetGeomType())
+        )
+        src_defn = src_layer.GetLayerDefn()
+        for idx in range(src_defn.GetFieldCount()):
+            out_layer.CreateField(src_defn.GetFieldDefn(idx))
+        out_defn = out_layer.GetLayerDefn()
+
+    src_layer.ResetReading()
+    for start in starts:
+        ## workers read their own chunks, the source layer is only read 
+        ## here when working serially
+        if workers > 1:
+            features = None
+            wkbs, fields = next(results)
+        else:
+            features = [
+                src_layer.GetNextFeature() 
+                    for _ in range(min(chunk_size, n_features - start))
+            ]
+            wkbs = _reproject_geometries_(
+                [feat.GetGeometryRef() for feat in features], transform
+            )
+        
+        if out_ds is None:
+            geometries += [
+                None if w is None else ogr.CreateGeometryFromWkb(w) 
+                    for w in wkbs
+            ]
+            continue
+
+        out_ds.StartTransaction()
+        for idx, wkb in enumerate(wkbs):
+            feat = ogr.Feature(out_defn)
+            if features is not None:
+                feat.SetFrom(features[idx])
+            else:
+                for field_idx, value in enumerate(fields[idx]):
+                    if value is not None:
+                        feat.SetField2(field_idx, value)
+            if wkb is not None:
+                feat.SetGeometryDirectly(ogr.CreateGeometryFromWkb(wkb))
+            out_layer.CreateFeature(feat)
+        out_ds.CommitTransaction()
+        if verbose:
+            print(
+                'Reprojected %i of %i features' % \
+                (start + len(wkbs), n_features)
+            )
+
+    if workers > 1:
+        pool.close()
+        pool.join()
+
+    if out_ds is None:
+        return geometries
+
+    save_vector(out_ds)
+    return out_ds